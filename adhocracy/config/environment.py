@@ -17,6 +17,7 @@ from adhocracy.config.routing import make_map
 from adhocracy.model import init_model
 from adhocracy.lib.search import init_search
 from adhocracy.lib.democracy import init_democracy
+from adhocracy.lib.cache import init_cache
 from adhocracy.lib.util import create_site_subdirectory
 from adhocracy.lib import init_site
 
@@ -70,6 +71,7 @@ def load_environment(global_conf, app_conf, with_db=True):
     if with_db:
         init_search()
     init_democracy()
+    init_cache()
 
 
 class TimerProxy(ConnectionProxy):
@@ -18,8 +18,8 @@ from adhocracy.lib.auth.authorization import has_permission
 from adhocracy.lib.base import BaseController
 from adhocracy.lib.instance import RequireInstance
 from adhocracy.lib.pager import NamedPager
-from adhocracy.lib.templating import (render, render_def, render_json,
-                                      ret_abort, ret_success)
+from adhocracy.lib.templating import (entity_cache, render, render_def,
+                                      render_json, ret_abort, ret_success)
 from adhocracy.lib.util import get_entity_or_abort
 
 log = logging.getLogger(__name__)
@@ -177,7 +177,8 @@ class CommentController(BaseController):
         require.comment.show(c.comment)
         if format == 'fwd':
             redirect(h.entity_url(c.comment))
-        elif format == 'json':
+        entity_cache(c.comment, format)
+        if format == 'json':
             return render_json(c.comment)
         return render('/comment/show.html')
 
@@ -18,7 +18,8 @@ from adhocracy.lib.auth import can, require
 from adhocracy.lib.auth.csrf import RequireInternalRequest
 from adhocracy.lib.base import BaseController
 from adhocracy.lib.instance import RequireInstance
-from adhocracy.lib.templating import render, render_json, ret_abort
+from adhocracy.lib.templating import (entity_cache, render, render_json,
+                                      ret_abort)
 from adhocracy.lib.text.diff import (norm_texts_inline_compare,
                                      page_titles_compare)
 from adhocracy.lib.text.render import render_line_based, render as render_text
@@ -436,6 +437,7 @@ class PageController(BaseController):
         # Error handling and json api
         if c.text.variant != c.variant:
             abort(404, _("Variant %s does not exist!") % c.variant)
+        entity_cache(c.page, format)
         if format == 'json':
             return render_json(c.page.to_dict(text=c.text))
 
@@ -15,7 +15,8 @@ from adhocracy.lib.auth import require
 from adhocracy.lib.auth.csrf import RequireInternalRequest
 from adhocracy.lib.base import BaseController
 from adhocracy.lib.instance import RequireInstance
-from adhocracy.lib.templating import render, render_def, render_json
+from adhocracy.lib.templating import (entity_cache, render, render_def,
+                                      render_json)
 from adhocracy.lib.templating import ret_abort, ret_success
 from adhocracy.lib.util import get_entity_or_abort
 
@@ -58,6 +59,7 @@ class PollController(BaseController):
         require.poll.show(c.poll)
 
         if format == 'json':
+            entity_cache(poll, format)
             return render_json(poll)
 
         return self.not_implemented(format=format)
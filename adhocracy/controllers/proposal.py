@@ -17,7 +17,8 @@ from adhocracy.lib.auth import authorization, can, csrf, require
 from adhocracy.lib.auth.csrf import RequireInternalRequest
 from adhocracy.lib.base import BaseController
 from adhocracy.lib.instance import RequireInstance
-from adhocracy.lib.templating import render, render_def, render_json
+from adhocracy.lib.templating import (entity_cache, render, render_def,
+                                      render_json)
 from adhocracy.lib.queue import post_update
 from adhocracy.lib.util import get_entity_or_abort
 
@@ -271,6 +272,7 @@ class ProposalController(BaseController):
         if format == 'rss':
             return self.activity(id, format)
 
+        entity_cache(c.proposal, format)
         if format == 'json':
             return render_json(c.proposal)
 
@@ -3,7 +3,7 @@ import logging
 
 from pylons import config
 
-import memcache
+from adhocracy.lib.cache.backends import make_backend
 
 
 log = logging.getLogger(__name__)
@@ -22,14 +22,11 @@ class Globals(object):
         'app_globals' variable
 
         """
-        if 'memcached.server' in config:
-            self.cache = memcache.Client([config['memcached.server']])
-            log.info("Memcache set up")
-            log.debug("Flushing cache")
-            self.cache.flush_all()
+        self.cache = make_backend(config)
+        if self.cache is not None:
+            log.info("Cache set up: %s" % self.cache.__class__.__name__)
         else:
-            log.warn("Skipped memcache, no results caching will take place.")
-            self.cache = None
+            log.warn("Skipped caching, no results caching will take place.")
 
         if 'adhocracy.instance' in config:
             self.single_instance = config.get('adhocracy.instance')
@@ -14,6 +14,8 @@ from sqlalchemy.orm.exc import DetachedInstanceError
 
 from adhocracy import i18n, model
 from adhocracy.lib import helpers as h
+from adhocracy.lib.cache import page as page_cache
+from adhocracy.lib.cache import util as cache_util
 from adhocracy.lib.templating import ret_abort
 
 log = logging.getLogger(__name__)
@@ -31,6 +33,7 @@ class BaseController(WSGIController):
             c.active_global_nav = 'instances'
         else:
             c.active_global_nav = 'home'
+        cache_util.begin_request()
         c.user = environ.get('repoze.who.identity', {}).get('user')
         try:
             if c.user and (c.user.banned or c.user.delete_time):
@@ -60,6 +63,10 @@ class BaseController(WSGIController):
                      "decisions, decision-making"))
 
         try:
+            if page_cache.is_cacheable(environ, c.user):
+                app = lambda e, s: WSGIController.__call__(self, e, s)
+                return page_cache.serve_cached(app, environ, start_response,
+                                               c.instance, c.locale)
             return WSGIController.__call__(self, environ, start_response)
         except Exception, e:
             log.exception(e)
@@ -68,6 +75,7 @@ class BaseController(WSGIController):
         finally:
             if isinstance(model.meta.Session, ScopedSession):
                 model.meta.Session.remove()
+            cache_util.end_request()
 
     def bad_request(self, format='html'):
         log.debug("400 Request: %s" % request.params)
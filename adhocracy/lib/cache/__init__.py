@@ -1,8 +1,9 @@
+from collections import defaultdict
 import logging
 
 import adhocracy.model as model
 
-from util import memoize
+from util import clear_tags_once, is_targeted, memoize, record_read
 from invalidate import (invalidate_user, invalidate_vote, invalidate_page,
                         invalidate_delegateable, invalidate_delegation,
                         invalidate_revision, invalidate_comment,
@@ -12,6 +13,10 @@ from invalidate import (invalidate_user, invalidate_vote, invalidate_page,
 
 log = logging.getLogger(__name__)
 
+# the number of invalidations and of the tags they cleared per entity
+# type, to see the fan-out of invalidations.
+INVALIDATIONS = defaultdict(lambda: dict(invalidations=0, tags=0))
+
 HANDLERS = {
     model.User: invalidate_user,
     model.Vote: invalidate_vote,
@@ -30,11 +35,27 @@ HANDLERS = {
     }
 
 
+def init_cache():
+    '''
+    Track the entities memoized functions load (see
+    :func:`adhocracy.lib.cache.util.record_read`), if only the entries
+    that used a changed entity are invalidated.
+    '''
+    if is_targeted():
+        if record_read not in model.meta.LOAD_LISTENERS:
+            model.meta.LOAD_LISTENERS.append(record_read)
+    elif record_read in model.meta.LOAD_LISTENERS:
+        model.meta.LOAD_LISTENERS.remove(record_read)
+
+
 def invalidate(entity):
     try:
         from pylons import g
         if g.cache is not None:
             func = HANDLERS.get(entity.__class__, lambda x: x)
-            func(entity)
+            num_tags = clear_tags_once(lambda: func(entity))
+            stats = INVALIDATIONS[entity.__class__.__name__]
+            stats['invalidations'] += 1
+            stats['tags'] += num_tags
     except TypeError:
         pass
@@ -0,0 +1,267 @@
+'''
+The stores memoized results are kept in. They implement the parts of
+``memcache.Client`` that :mod:`adhocracy.lib.cache.util` uses.
+'''
+import cPickle as pickle
+from contextlib import contextmanager
+import fcntl
+from hashlib import sha1
+import logging
+import os
+import tempfile
+from threading import Lock
+from time import time
+
+import memcache
+
+from adhocracy.lib.cache.local import LRUCache
+
+log = logging.getLogger(__name__)
+
+# the longest time (in seconds) values without an expiration time are
+# kept in the memory and file backends.
+MAX_TTL = 30 * 24 * 3600
+
+# seconds between the sweeps of the file backend, and the prefix of the
+# files it is still writing.
+SWEEP_INTERVAL = 60
+TEMP_PREFIX = '.tmp'
+
+
+class MemoryBackend(object):
+    '''
+    Keeps the values in a :class:`LRUCache` within the process. Other
+    processes do not see its values or invalidations, so it is meant
+    for tests, benchmarks and setups with a single process.
+    '''
+
+    def __init__(self, max_bytes):
+        self._cache = LRUCache(max_bytes, MAX_TTL)
+        self._lock = Lock()
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def get_multi(self, keys):
+        values = [(key, self._cache.get(key)) for key in keys]
+        return dict((k, v) for (k, v) in values if v is not None)
+
+    def set(self, key, value, time=0):
+        self._cache.set(key, value, ttl=time or None)
+        return True
+
+    def set_multi(self, mapping, time=0):
+        for (key, value) in mapping.items():
+            self.set(key, value, time=time)
+        return []
+
+    def add(self, key, value, time=0):
+        with self._lock:
+            if self._cache.get(key) is not None:
+                return False
+            return self.set(key, value, time=time)
+
+    def incr(self, key, delta=1):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                return None
+            self.set(key, value + delta)
+            return value + delta
+
+    def delete(self, key, time=0):
+        self._cache.delete(key)
+        return True
+
+
+class FileBackend(object):
+    '''
+    Keeps each value in a file within *path*, so all processes of a host
+    share them. The modification time of a file is the time it expires.
+    Every :data:`SWEEP_INTERVAL` seconds one of the processes removes
+    the expired files and, while they take more than *max_bytes*, those
+    that expire first (see :meth:`sweep`).
+    '''
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._lock_file = os.path.join(path, 'lock')
+        self._sweep_file = os.path.join(path, 'sweep')
+        self._next_sweep = 0
+
+    def _file(self, key):
+        return os.path.join(self.path, sha1(key).hexdigest())
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self, key):
+        '''
+        :returns: ``(expires, value)`` or `None` if it is missing or
+        expired.
+        '''
+        try:
+            with open(self._file(key), 'rb') as f:
+                (expires, value) = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires and expires < time():
+            return None
+        return (expires, value)
+
+    def _write(self, key, value, expires):
+        (fd, name) = tempfile.mkstemp(dir=self.path, prefix=TEMP_PREFIX)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+        mtime = expires or time() + MAX_TTL
+        os.utime(name, (mtime, mtime))
+        # readers see either the old or the new file
+        os.rename(name, self._file(key))
+
+    def _sweep_if_due(self):
+        now = time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        with self._locked():
+            try:
+                if os.path.getmtime(self._sweep_file) > now - SWEEP_INTERVAL:
+                    return  # another process did it
+            except OSError:
+                pass
+            open(self._sweep_file, 'a').close()
+            os.utime(self._sweep_file, (now, now))
+        self.sweep()
+
+    def _remove(self, name):
+        try:
+            os.remove(name)
+            return True
+        except OSError:
+            return False
+
+    def sweep(self):
+        '''
+        Remove the expired files and the files of failed writes. Then,
+        if the files take more than *max_bytes*, remove those that
+        expire first.
+
+        :returns: the number of removed files
+        '''
+        now = time()
+        removed = 0
+        files = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if path in (self._lock_file, self._sweep_file):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed meanwhile
+            if name.startswith(TEMP_PREFIX):
+                expired = stat.st_ctime < now - SWEEP_INTERVAL
+            else:
+                expired = stat.st_mtime < now
+            if expired:
+                removed += self._remove(path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+        if self.max_bytes is not None:
+            size = sum([file_size for (_, file_size, _) in files])
+            for (_, file_size, path) in sorted(files):
+                if size <= self.max_bytes:
+                    break
+                size -= file_size
+                removed += self._remove(path)
+        return removed
+
+    def get(self, key):
+        entry = self._read(key)
+        return entry[1] if entry is not None else None
+
+    def get_multi(self, keys):
+        values = [(key, self.get(key)) for key in keys]
+        return dict((k, v) for (k, v) in values if v is not None)
+
+    def set(self, key, value, time=0):
+        self._write(key, value, _expires(time))
+        self._sweep_if_due()
+        return True
+
+    def set_multi(self, mapping, time=0):
+        for (key, value) in mapping.items():
+            self.set(key, value, time=time)
+        return []
+
+    def add(self, key, value, time=0):
+        with self._locked():
+            if self._read(key) is not None:
+                return False
+            self._write(key, value, _expires(time))
+        self._sweep_if_due()
+        return True
+
+    def incr(self, key, delta=1):
+        with self._locked():
+            entry = self._read(key)
+            if entry is None:
+                return None
+            (expires, value) = entry
+            self._write(key, value + delta, expires)
+            return value + delta
+
+    def delete(self, key, time=0):
+        self._remove(self._file(key))
+        return True
+
+
+def _expires(seconds):
+    return time() + seconds if seconds else 0
+
+
+def make_backend(config):
+    '''
+    Create the cache configured with ``adhocracy.cache.backend``:
+
+    ``memcached``
+        the server given as ``memcached.server`` (the default if it is
+        set)
+    ``memory``
+        a :class:`MemoryBackend` of ``adhocracy.cache.memory_size``
+        bytes (default: 64 MB)
+    ``file``
+        a :class:`FileBackend` in ``adhocracy.cache.path`` (default: the
+        ``cache`` directory of the site) of up to
+        ``adhocracy.cache.file_size`` bytes (default: 256 MB)
+
+    :returns: the cache or `None` if nothing is to be cached
+    '''
+    default = 'memcached' if 'memcached.server' in config else None
+    name = config.get('adhocracy.cache.backend', default)
+    if name == 'memcached':
+        return memcache.Client([config['memcached.server']])
+    elif name == 'memory':
+        max_bytes = int(config.get('adhocracy.cache.memory_size',
+                                   64 * 1024 * 1024))
+        return MemoryBackend(max_bytes)
+    elif name == 'file':
+        path = config.get('adhocracy.cache.path')
+        if not path:
+            from adhocracy.lib.util import get_site_path
+            path = get_site_path('cache')
+        max_bytes = int(config.get('adhocracy.cache.file_size',
+                                   256 * 1024 * 1024))
+        return FileBackend(path, max_bytes)
+    elif name:
+        log.error("Unknown cache backend: %s" % name)
+    return None
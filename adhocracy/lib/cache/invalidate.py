@@ -1,6 +1,7 @@
 import logging
+
 from adhocracy import model
-from adhocracy.lib.cache.util import clear_tag
+from adhocracy.lib.cache.util import clear_tag, is_targeted
 
 log = logging.getLogger(__name__)
 
@@ -35,10 +36,11 @@ def invalidate_page(page):
 
 def invalidate_delegateable(d):
     clear_tag(d)
-    for p in d.parents:
-        invalidate_delegateable(p)
-    if not len(d.parents):
-        clear_tag(d.instance)
+    if is_targeted():
+        return
+    for p in d.ancestors():
+        clear_tag(p)
+    clear_tag(d.instance)
 
 
 def invalidate_revision(rev):
@@ -84,8 +86,10 @@ def invalidate_poll(poll):
 
 
 def invalidate_instance(instance):
-    # muharhar cache epic fail
     clear_tag(instance)
+    if is_targeted():
+        return
+    # muharhar cache epic fail
     for d in instance.delegateables:
         invalidate_delegateable(d)
 
@@ -0,0 +1,101 @@
+from __future__ import with_statement
+import cPickle as pickle
+import logging
+from threading import Lock
+from time import time
+
+log = logging.getLogger(__name__)
+
+# the fields of the links of the entries, which form a circular list in
+# the order the entries were used.
+PREV, NEXT, KEY, ENTRY = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    '''
+    A least recently used cache within the process, limited by the
+    (pickled) size of its values in bytes. Entries expire after *ttl*
+    seconds.
+    '''
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        # key -> link, see PREV, NEXT, KEY, ENTRY
+        self._data = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = Lock()
+
+    def _unlink(self, key):
+        link = self._data.pop(key, None)
+        if link is None:
+            return None
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+        return link[ENTRY]
+
+    def _link(self, key, entry):
+        '''
+        Add *entry* as the most recently used one.
+        '''
+        last = self._root[PREV]
+        link = [last, self._root, key, entry]
+        last[NEXT] = self._root[PREV] = self._data[key] = link
+
+    def get(self, key):
+        '''
+        :returns: the value or `None` if it is missing or expired.
+        '''
+        with self._lock:
+            entry = self._unlink(key)
+            if entry is None:
+                return None
+            (value, size, expires, _) = entry
+            if expires < time():
+                self.size -= size
+                return None
+            self._link(key, entry)
+            return value
+
+    def set(self, key, value, iden=None, ttl=None):
+        '''
+        Store *value*, dropping the least recently used entries to make
+        room for it. It expires after *ttl* seconds if that is shorter
+        than the ttl of the cache.
+
+        :returns: list of the *iden* given for each evicted entry
+        '''
+        try:
+            size = len(key) + len(pickle.dumps(value,
+                                               pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, TypeError):
+            log.debug("Cannot determine the size of %r" % key)
+            return []
+        if size > self.max_bytes:
+            return []
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        evicted = []
+        with self._lock:
+            old = self._unlink(key)
+            if old is not None:
+                self.size -= old[1]
+            while self._data and self.size + size > self.max_bytes:
+                oldest = self._root[NEXT][KEY]
+                (_, old_size, _, old_iden) = self._unlink(oldest)
+                self.size -= old_size
+                evicted.append(old_iden)
+            self._link(key, (value, size, time() + ttl, iden))
+            self.size += size
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._unlink(key)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def __len__(self):
+        return len(self._data)
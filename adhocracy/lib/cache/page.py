@@ -0,0 +1,91 @@
+'''
+Caching whole responses for anonymous visitors.
+'''
+from Cookie import CookieError, SimpleCookie
+import logging
+
+from pylons import config
+
+from adhocracy.lib.cache.util import memoize
+
+log = logging.getLogger(__name__)
+
+
+def page_ttl():
+    '''
+    Seconds responses are cached (``adhocracy.cache.page_ttl``), 0 if
+    they are not cached at all.
+    '''
+    return int(config.get('adhocracy.cache.page_ttl', 0))
+
+
+def is_cacheable(environ, user):
+    '''
+    Only GET requests of anonymous visitors without a session are
+    answered from the cache, so nobody misses a flash message.
+    '''
+    if not page_ttl() or user is not None:
+        return False
+    if environ.get('REQUEST_METHOD') != 'GET':
+        return False
+    session_key = config.get('beaker.session.key', 'beaker.session.id')
+    try:
+        cookies = SimpleCookie(environ.get('HTTP_COOKIE', ''))
+    except CookieError:
+        return False
+    return session_key not in cookies
+
+
+class Uncacheable(Exception):
+
+    def __init__(self, response):
+        self.response = response
+
+
+def _call(app, environ):
+    '''
+    :returns: ``(status, headers, body)`` of *app*
+    '''
+    started = []
+    body = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+        return body.append
+
+    result = app(environ, start_response)
+    try:
+        body.extend(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return (started[0], started[1], ''.join(body))
+
+
+def serve_cached(app, environ, start_response, instance, locale):
+    '''
+    Answer the request with *app* or from the cache. Responses are
+    memoized per host, path, query, *instance* and *locale* for
+    :func:`page_ttl` seconds. They are invalidated along with their
+    instance or, with targeted invalidation, with the entities loaded
+    while rendering them (see :mod:`adhocracy.lib.cache.invalidate`).
+    Only successful responses that set no cookie are cached.
+    '''
+    @memoize('page', page_ttl())
+    def render(host, path, query, instance, locale):
+        response = _call(app, environ)
+        (status, headers, body) = response
+        if (not status.startswith('200') or
+                'set-cookie' in [h[0].lower() for h in headers]):
+            raise Uncacheable(response)
+        return response
+
+    path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+    try:
+        (status, headers, body) = render(environ.get('HTTP_HOST'), path,
+                                         environ.get('QUERY_STRING'),
+                                         instance, locale)
+    except Uncacheable, e:
+        (status, headers, body) = e.response
+    start_response(status, headers)
+    return [body]
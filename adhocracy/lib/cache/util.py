@@ -1,11 +1,43 @@
+from collections import defaultdict
 import logging
 from hashlib import sha1
+import os
+from time import time
 
-from pylons import app_globals
+import pkg_resources
+
+from beaker.util import ThreadLocal
+from paste.deploy.converters import asbool
+from pylons import app_globals, config
+from sqlalchemy.orm.attributes import instance_state
+
+from adhocracy.lib.cache.local import LRUCache
 
 log = logging.getLogger(__name__)
 
-SEP = "|"
+TAG_PREFIX = "tag."
+LEASE_PREFIX = "lease."
+
+# seconds a process may take to recompute a single flight entry before
+# another one tries.
+LEASE_TIME = 30
+
+# hits within the process, hits in memcached, misses, stale results
+# served while another process recomputes them and evictions from the
+# process cache per memoize identifier.
+STATS = defaultdict(lambda: dict(local_hits=0, hits=0, misses=0,
+                                 stale=0, evictions=0))
+
+_local_cache = None
+_namespace = None
+_code_time = None
+_request_generations = ThreadLocal()
+_request_entries = ThreadLocal()
+_collected_calls = ThreadLocal()
+_cleared_tags = ThreadLocal()
+# stack of (entities, tag keys) read by the memoized functions that
+# are being computed.
+_reads = ThreadLocal()
 
 
 class NoneResult(object):
@@ -16,51 +48,479 @@ def _hash(data):
     return sha1(data).hexdigest()
 
 
-def add_tags(key, tags):
-    ctags = app_globals.cache.get_multi(tags)
-    for tag in tags:
-        if not ctags.get(tag):
-            ctags[tag] = key
-        else:
-            ctags[tag] = ctags[tag] + SEP + key
-    app_globals.cache.set_multi(ctags)
+def _schema_version():
+    """ The number of the latest migration shipped with the code. """
+    import adhocracy.migration.versions
+    path = os.path.dirname(adhocracy.migration.versions.__file__)
+    numbers = [int(name.split('_')[0]) for name in os.listdir(path)
+               if name.split('_')[0].isdigit()]
+    return max(numbers) if numbers else 0
+
+
+def _code_mtime():
+    """
+    The time the code or a template of this deploy was last modified,
+    so edits and deploys without a new version number change the
+    namespace as well. Processes that share memcached only share their
+    entries if their files have the same mtimes.
+    """
+    import adhocracy
+    package = os.path.dirname(adhocracy.__file__)
+    templates = config.get('pylons.paths', {}).get('templates') or []
+    newest = 0
+    for top in [package] + list(templates):
+        for (path, dirs, files) in os.walk(top):
+            dirs[:] = [d for d in dirs if d not in ('static', 'tests')]
+            for name in files:
+                if name.endswith(('.pyc', '.pyo')):
+                    continue
+                try:
+                    mtime = os.path.getmtime(os.path.join(path, name))
+                except OSError:
+                    continue  # removed meanwhile
+                newest = max(newest, mtime)
+    return int(newest)
+
+
+def namespace():
+    """
+    The prefix of all cache keys. It changes with the code version,
+    the modification time of the code and templates (see
+    :func:`_code_mtime`), the database schema version and
+    ``adhocracy.cache.version``, so a new deploy does not read the
+    entries of older ones and memcached need not be flushed when a
+    process starts.
+    """
+    global _namespace, _code_time
+    if _namespace is None:
+        try:
+            code = pkg_resources.get_distribution('adhocracy').version
+        except pkg_resources.DistributionNotFound:
+            code = 'unknown'
+        _code_time = _code_mtime()
+        version = "%s.%s.%s.%s" % (code, _code_time, _schema_version(),
+                                   config.get('adhocracy.cache.version', ''))
+        _namespace = _hash(version)[:8]
+        log.info("Cache namespace %s (%s)" % (_namespace, version))
+    return _namespace
+
 
+def code_time():
+    """
+    The modification time of the code and templates that is part of
+    the current :func:`namespace`, as a timestamp.
+    """
+    namespace()
+    return _code_time
 
-def tag_fn(key, args, kwargs):
+
+def tag_key(tag):
+    """ The cache key of the generation counter of a tag. """
+    return TAG_PREFIX + namespace() + '.' + tag
+
+
+def make_tags(args, kwargs):
     tags = [make_tag(a) for a in args]
     tags += [make_tag(v) for v in kwargs.values()]
-    add_tags(key, tags)
+    return tags
 
 
-def make_tag(obj):
-    """ Collisisons here don't matter much. """
-    rep = "catch_all"
+def init_generations(cache, keys):
+    """
+    Start the generation counters that are missing from the cache,
+    e.g. because they were evicted. They start at the current time
+    so they do not match the generations stored with older entries.
+    """
+    generations = {}
+    for key in keys:
+        start = int(time() * 1000)
+        if not cache.add(key, start):
+            # someone else was faster
+            current = cache.get(key)
+            if current is not None:
+                start = current
+        generations[key] = start
+    return generations
+
+
+def _model_identity(obj):
+    """
+    The type and primary key of a model object, which SQLAlchemy
+    already knows, so it is neither stringified nor loaded. `None` for
+    other objects.
+
+    The ``version`` of versioned model objects is left out on purpose:
+    it is expired or an SQL expression whenever the entity has been
+    changed in the session, and loading it would cost a query. Entries
+    of changed entities are invalidated through their tags instead.
+    """
     try:
-        rep = repr(obj).encode('ascii', 'ignore')
-    except:
-        pass
+        key = instance_state(obj).key
+    except AttributeError:
+        return None
+    if key is None:
+        return None  # not saved yet
+    (cls, pk) = key[:2]
+    return '%s.%s' % (cls.__name__, '.'.join([str(v) for v in pk]))
+
+
+def _join(parts):
+    """
+    Join strings so that no two different lists of parts give the same
+    result, by prefixing each part with its length.
+    """
+    return ''.join(['%d:%s' % (len(part), part) for part in parts])
+
+
+def identity(obj):
+    """
+    A string that identifies *obj* in cache keys. It includes the type
+    of *obj*, so e.g. ``1`` and ``'1'`` are told apart.
+    """
+    if isinstance(obj, str):
+        return 'str:' + obj
+    if isinstance(obj, unicode):
+        return 'str:' + obj.encode('utf-8')
+    if isinstance(obj, (list, tuple)):
+        return '(%s)' % _join([identity(o) for o in obj])
+    rep = _model_identity(obj)
+    if rep is not None:
+        return 'model:' + rep
     try:
-        rep = unicode(obj).encode('ascii', 'ignore')
+        rep = unicode(obj).encode('utf-8')
     except:
-        pass
-    return _hash(rep)
+        rep = repr(obj)
+    return '%s:%s' % (type(obj).__name__, rep)
+
+
+def make_tag(obj):
+    """
+    Model objects are tagged with their type and primary key, other
+    objects with a hash. Collisisons here don't matter much.
+    """
+    rep = _model_identity(obj)
+    if rep is not None:
+        return rep
+    return _hash(identity(obj))
 
 
 def make_key(iden, args, kwargs):
-    sig = iden[:200] + make_tag(args) + make_tag(kwargs)
-    return sha1(sig).hexdigest()
+    parts = [identity(a) for a in args]
+    parts += ['%s=%s' % (k, identity(v)) for (k, v) in sorted(kwargs.items())]
+    return _hash(_join([namespace(), iden[:200]] + parts))
+
+
+def local_cache():
+    """
+    The cache within the process which is asked before memcached, or
+    `None` if ``adhocracy.cache.local_size`` (in bytes) is not set.
+    Its entries expire after ``adhocracy.cache.local_ttl`` seconds
+    (default: 60).
+    """
+    global _local_cache
+    if _local_cache is None:
+        max_bytes = int(config.get('adhocracy.cache.local_size', 0))
+        if not max_bytes:
+            return None
+        ttl = int(config.get('adhocracy.cache.local_ttl', 60))
+        _local_cache = LRUCache(max_bytes, ttl)
+    return _local_cache
+
+
+def begin_request():
+    """
+    Remember the tag generations read from memcached until
+    :func:`end_request`, so each tag is looked up only once per request
+    (or queue message). Invalidations from other processes are seen by
+    the next request.
+    """
+    _request_generations.put({})
+    _request_entries.put({})
+
+
+def end_request():
+    _request_generations.put(None)
+    _request_entries.put(None)
+
+
+def _known_generations():
+    generations = _request_generations.get()
+    return {} if generations is None else generations
 
 
 def clear_tag(tag):
+    """
+    Invalidate all entries memoized for *tag* by advancing its
+    generation. A missing generation does not need to be advanced:
+    The entries stored with it do not match anymore anyway.
+    """
+    cleared = _cleared_tags.get()
+    if cleared is not None:
+        cleared.add(make_tag(tag))
+    else:
+        _advance_generation(make_tag(tag))
+
+
+def _advance_generation(tag):
     try:
-        entities = app_globals.cache.get(make_tag(tag))
-        if entities:
-            app_globals.cache.delete_multi(entities.split(SEP))
+        key = tag_key(tag)
+        generation = app_globals.cache.incr(key)
+        known = _request_generations.get()
+        if known is not None:
+            known[key] = generation
     except TypeError:
         pass  # when app_globals isn't there yet
 
 
-def memoize(iden, time=0):
+def clear_tags_once(fn):
+    """
+    Call *fn*, but clear each of the tags it clears only once, when it
+    is done.
+
+    :returns: the number of cleared tags
+    """
+    if _cleared_tags.get() is not None:
+        fn()
+        return 0
+    cleared = set()
+    _cleared_tags.put(cleared)
+    try:
+        fn()
+    finally:
+        _cleared_tags.put(None)
+    for tag in cleared:
+        _advance_generation(tag)
+    return len(cleared)
+
+
+def is_targeted():
+    """
+    Whether only the entries that depend on a changed entity itself
+    are invalidated, instead of also those of its ancestors and its
+    instance. Only then memoized entries depend on the entities that
+    were loaded while computing them (see :func:`record_read`);
+    entities from the identity map or from lazy relations that are
+    loaded already are missed, so this is off by default. Configured
+    with ``adhocracy.cache.targeted_invalidation``.
+    """
+    return asbool(config.get('adhocracy.cache.targeted_invalidation',
+                             'false'))
+
+
+def record_read(entity):
+    """
+    Note that *entity* was loaded from the database, so the memoized
+    functions that are being computed depend on it (see
+    :data:`adhocracy.model.meta.LOAD_LISTENERS`).
+    """
+    stack = _reads.get()
+    if stack:
+        stack[-1][0][id(entity)] = entity
+
+
+def _record_keys(keys):
+    stack = _reads.get()
+    if stack:
+        stack[-1][1].update(keys)
+
+
+def _tracked_call(fn, a, kw):
+    """
+    Call *fn* and find the tag keys of the entities it read, including
+    those the memoized functions it called depend on.
+
+    :returns: ``(result, tag keys)``
+    """
+    if not is_targeted():
+        return (fn(*a, **kw), set())
+    stack = _reads.get()
+    if stack is None:
+        stack = []
+        _reads.put(stack)
+    (entities, keys) = ({}, set())
+    stack.append((entities, keys))
+    try:
+        res = fn(*a, **kw)
+    finally:
+        stack.pop()
+    # making the tags may load more entities, which do not count.
+    _reads.put(None)
+    try:
+        keys.update([tag_key(make_tag(e)) for e in entities.values()])
+    finally:
+        _reads.put(stack)
+    return (res, keys)
+
+
+def _fetch_generations(cache, keys, known):
+    unknown = [k for k in keys if k not in known]
+    if unknown:
+        cached = cache.get_multi(unknown)
+        for k in unknown:
+            known[k] = cached.get(k)
+
+
+def _is_current(cache, entry, known):
+    (generations, _, expires) = entry
+    if expires and expires < time():
+        return False
+    _fetch_generations(cache, generations.keys(), known)
+    return all(known[k] == generation for (k, generation)
+               in generations.items())
+
+
+def _new_entry(cache, res, keys, known, timeout):
+    if res is None:
+        res = NoneResult
+    _fetch_generations(cache, keys, known)
+    missing = [k for k in keys if known[k] is None]
+    known.update(init_generations(cache, missing))
+    expires = time() + timeout if timeout else 0
+    return (dict((k, known[k]) for k in keys), res, expires)
+
+
+def _recompute(cache, call, known, stale=None):
+    """
+    Compute the entry of a memoized *call* and store it. For single
+    flight functions only the process that gets the lease on the key
+    recomputes it, the others return the *stale* entry meanwhile.
+    Without a stale entry there is nothing to wait for, so it is
+    computed right away.
+    """
+    (iden, key, tag_keys, timeout, single_flight, fn, a, kw) = call
+    lease = None
+    if single_flight:
+        lease = LEASE_PREFIX + key
+        if not cache.add(lease, 1, time=LEASE_TIME):
+            lease = None
+            if stale is not None:
+                STATS[iden]['stale'] += 1
+                return stale
+    STATS[iden]['misses'] += 1
+    try:
+        (res, dependencies) = _tracked_call(fn, a, kw)
+        entry = _new_entry(cache, res, dependencies.union(tag_keys),
+                           known, timeout)
+        # stale entries must outlive their expiration to be served.
+        cache.set(key, entry,
+                  time=timeout * 2 if single_flight else timeout)
+    finally:
+        if lease is not None:
+            cache.delete(lease)
+    return entry
+
+
+def collect_memoized(fn, items):
+    """
+    Call ``fn(item)`` for each of *items*, but only record the calls of
+    memoized functions it makes instead of running them. They return
+    `None` meanwhile. If *fn* fails for an item, e.g. because it needs
+    the results, the calls of that item are left out, so they are made
+    as usual later.
+
+    :returns: the recorded calls for :func:`prefetch_memoized`
+    """
+    calls = []
+    try:
+        for item in items:
+            item_calls = []
+            _collected_calls.put(item_calls)
+            try:
+                fn(item)
+            except Exception, e:
+                log.debug("Collecting memoized calls for %r failed: %s" %
+                          (item, e))
+                continue
+            calls.extend(item_calls)
+    finally:
+        _collected_calls.put(None)
+    return calls
+
+
+def is_collecting():
+    """
+    Whether the memoized calls are only being recorded (see
+    :func:`collect_memoized`), so work that is not memoized can be
+    skipped meanwhile.
+    """
+    return _collected_calls.get() is not None
+
+
+def prefetch_memoized(calls):
+    """
+    Look up the results of the memoized *calls* (see
+    :func:`collect_memoized`) with a single ``get_multi``, compute the
+    missing ones and store them with one ``set_multi`` (per expiration
+    time). When the calls are made later within the same request, they
+    are answered without asking memcached.
+    """
+    try:
+        cache = app_globals.cache
+    except TypeError:
+        cache = None
+    entries = _request_entries.get()
+    if not cache or entries is None or not calls:
+        return
+    known = _known_generations()
+    calls = [call for call in calls if call[1] not in entries]
+    fetch = set()
+    for call in calls:
+        fetch.update([k for k in call[2] if k not in known])
+        fetch.add(call[1])
+    cached = cache.get_multi(list(fetch)) if fetch else {}
+    for k in fetch:
+        if k.startswith(TAG_PREFIX):
+            known[k] = cached.get(k)
+    # the generations of the dependencies of all entries at once
+    dependencies = set()
+    for call in calls:
+        entry = cached.get(call[1])
+        if entry is not None:
+            dependencies.update(entry[0].keys())
+    _fetch_generations(cache, dependencies, known)
+
+    updates = defaultdict(dict)
+    for call in calls:
+        (iden, key, tag_keys, timeout, single_flight) = call[:5]
+        if key in entries:
+            continue
+        entry = cached.get(key)
+        if entry is not None and _is_current(cache, entry, known):
+            STATS[iden]['hits'] += 1
+        elif single_flight:
+            # needs its lease, so it is stored on its own.
+            entry = _recompute(cache, call, known, stale=entry)
+        else:
+            STATS[iden]['misses'] += 1
+            (res, dependencies) = _tracked_call(*call[5:])
+            entry = _new_entry(cache, res, dependencies.union(tag_keys),
+                               known, timeout)
+            updates[timeout][key] = entry
+        entries[key] = entry
+    for (timeout, mapping) in updates.items():
+        cache.set_multi(mapping, time=timeout)
+
+
+def memoize(iden, time=0, single_flight=False):
+    """
+    Cache the results of the decorated function in memcached and, if
+    configured, in the process (see :func:`local_cache`).
+
+    The results are stored together with the generations of the tags
+    they depend on: Those of the arguments and, with targeted
+    invalidation (see :func:`is_targeted`), those of the entities that
+    were loaded from the database while computing them and those the
+    memoized functions called meanwhile depend on.
+
+    A hit is usually a single ``get_multi`` for the entry and the
+    generations that were not read in this request yet, and none at all
+    if it was prefetched (see :func:`prefetch_memoized`).
+
+    Expensive functions should be memoized with *single_flight*: When
+    their entry expired or was invalidated, only one process recomputes
+    it (holding a lease in memcached) while the others keep serving the
+    outdated result.
+    """
     try:
         from pylons import tmpl_context as c
         iden = c.instance.key + '.' + iden if c.instance else iden
@@ -77,22 +537,53 @@ def memoize(iden, time=0):
                 # Probably in tests
                 cache = None
             if not cache:
-                res = fn(*a, **kw)
+                return fn(*a, **kw)
+
+            key = make_key(iden, a, kw)
+            tag_keys = [tag_key(t) for t in make_tags(a, kw)]
+            calls = _collected_calls.get()
+            call = (iden, key, tag_keys, time, single_flight, fn, a, kw)
+            if calls is not None:
+                calls.append(call)
+                return None
+
+            stats = STATS[iden]
+            local = local_cache()
+            known = _known_generations()
+            fetch = [k for k in tag_keys if k not in known]
+            entry = (_request_entries.get() or {}).get(key)
+            prefetched = entry is not None
+            if entry is None and local is not None:
+                entry = local.get(key)
+            if entry is None:
+                fetch.append(key)
+            cached = cache.get_multi(fetch) if fetch else {}
+            for k in tag_keys:
+                if k not in known:
+                    known[k] = cached.get(k)
+
+            if entry is not None and _is_current(cache, entry, known):
+                if not prefetched:
+                    stats['local_hits'] += 1
             else:
-                key = make_key(iden, a, kw)
-                res = cache.get(key)
-                if res is None:
-                    res = fn(*a, **kw)
-                    #print "Cache miss", key + iden
-                    if res is None:
-                        res = NoneResult
-                    #print "Cache set:", key + iden
-                    cache.set(key, res, time=time)
-                    tag_fn(key, a, kw)
-                #else:
-                    #print "Cache hit", key + iden
-                if res == NoneResult:
-                    res = None
+                if entry is not None:
+                    entry = cache.get(key)
+                else:
+                    entry = cached.get(key)
+                if entry is not None and _is_current(cache, entry, known):
+                    stats['hits'] += 1
+                else:
+                    entry = _recompute(cache, call, known, stale=entry)
+                if local is not None:
+                    evictions = local.set(key, entry, iden=iden,
+                                          ttl=time or None)
+                    for evicted in evictions:
+                        STATS[evicted]['evictions'] += 1
+            # whoever called us depends on the same entities.
+            _record_keys(entry[0].keys())
+            res = entry[1]
+            if res == NoneResult:
+                res = None
             return res
         return new_fn
     return memoize_fn
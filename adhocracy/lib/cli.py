@@ -1,5 +1,7 @@
 import itertools
+import json
 import os
+import time
 
 import paste.script
 import paste.fixture
@@ -11,6 +13,23 @@ from paste.script.command import Command
 from adhocracy import model
 from adhocracy.lib import search
 
+# the number of instances `paster warmcache` warms up by default
+LARGEST_INSTANCES = 5
+
+
+def _index_range(work):
+    '''
+    Index a range of ids in a worker process of `paster index`.
+    '''
+    from adhocracy.lib.search import index
+    (cls, low, high, instance_ids) = work
+    buffer_ = index.IndexBuffer(index.make_connection())
+    try:
+        count = search.index_range(cls, low, high, instance_ids, buffer_)
+    finally:
+        model.meta.Session.remove()
+    return (cls, low, high, count)
+
 
 class AdhocracyCommand(Command):
     parser = Command.standard_parser(verbose=True)
@@ -82,6 +101,131 @@ class Background(AdhocracyCommand):
         queue.dispatch()
 
 
+class DelegationWeights(AdhocracyCommand):
+    """Rebuild the precomputed delegation weights."""
+    summary = __doc__.split('\n')[0]
+    usage = __doc__ + ('\n\n'
+                       'delegation_weights [<instance>, ...] -c <inifile>'
+                       '\n\n'
+                       '  <instance>\n'
+                       '      Keys of the instances to rebuild. If not '
+                       'given,\n'
+                       '      all instances are rebuilt.')
+    max_args = None
+    min_args = None
+
+    def command(self):
+        from adhocracy.lib import democracy
+        self._load_config()
+
+        instances = []
+        for key in self.args:
+            instance = model.Instance.find(key, include_deleted=True)
+            if not instance:
+                print 'Instance "%s" not found.' % key
+                exit(1)
+            instances.append(instance)
+        if not instances:
+            instances = model.Instance.all(include_deleted=True,
+                                           include_hidden=True)
+
+        for instance in instances:
+            count = democracy.rebuild_delegation_weights(instance)
+            model.meta.Session.commit()
+            print '%s: %s weights' % (instance.key, count)
+        print 'done.'
+
+
+class Tallies(AdhocracyCommand):
+    """Create the missing historical tallies of all polls."""
+    summary = __doc__.split('\n')[0]
+    usage = __doc__ + ('\n\n'
+                       'tallies [<instance>, ...] -c <inifile>'
+                       '\n\n'
+                       '  <instance>\n'
+                       '      Keys of the instances to rebuild. If not '
+                       'given,\n'
+                       '      all instances are rebuilt.')
+    max_args = None
+    min_args = None
+
+    def command(self):
+        from adhocracy.lib import democracy
+        self._load_config()
+
+        instances = []
+        for key in self.args:
+            instance = model.Instance.find(key, include_deleted=True)
+            if not instance:
+                print 'Instance "%s" not found.' % key
+                exit(1)
+            instances.append(instance)
+        if not instances:
+            instances = model.Instance.all(include_deleted=True,
+                                           include_hidden=True)
+
+        for instance in instances:
+            count = democracy.rebuild_tallies(instance)
+            model.meta.Session.commit()
+            print '%s: %s tallies' % (instance.key, count)
+        print 'done.'
+
+
+class WarmCache(AdhocracyCommand):
+    """Pre-populate the cache for the largest instances."""
+    summary = __doc__.split('\n')[0]
+    usage = __doc__ + ('\n\n'
+                       'warmcache [<instance>, ...] -c <inifile>'
+                       '\n\n'
+                       '  <instance>\n'
+                       '      Keys of the instances to warm up. If not '
+                       'given,\n'
+                       '      the %s instances with the most proposals '
+                       'are used.' % LARGEST_INSTANCES)
+    max_args = None
+    min_args = None
+
+    def warm(self, instance):
+        from pylons import tmpl_context as c
+        from adhocracy import i18n
+        from adhocracy.lib import tiles
+
+        model.instance_filter.setup_thread(instance)
+        c.instance = instance
+        c.user = None
+        c.locale = i18n.get_default_locale()
+        tiles.instance.row(instance)
+        proposals = model.Proposal.all(instance=instance)
+        for proposal in proposals:
+            tiles.proposal.row(proposal)
+        pages = model.Page.all(instance=instance)
+        for page in pages:
+            if page.head is not None:
+                page.head.render()
+        return len(proposals) + len(pages) + 1
+
+    def command(self):
+        self._load_config()
+
+        instances = []
+        for key in self.args:
+            instance = model.Instance.find(key)
+            if not instance:
+                print 'Instance "%s" not found.' % key
+                exit(1)
+            instances.append(instance)
+        if not instances:
+            instances = sorted(
+                model.Instance.all(),
+                key=lambda i: model.Proposal.all_q(instance=i).count(),
+                reverse=True)[:LARGEST_INSTANCES]
+
+        for instance in instances:
+            count = self.warm(instance)
+            print '%s: %s entries' % (instance.key, count)
+        print 'done.'
+
+
 class Index(AdhocracyCommand):
     """Re-create Adhocracy's search index."""
     summary = __doc__.split('\n')[0]
@@ -90,10 +234,25 @@ class Index(AdhocracyCommand):
 
     DROP = 'DROP'
     INDEX = 'INDEX'
+    RESUME = 'RESUME'
 
     errors = False
+    processes = 1
     _indexed_classes = None
 
+    def get_processes(self, args):
+        PROCESSES_KEYWORD = '-P'
+        if PROCESSES_KEYWORD not in args:
+            return args
+        index = args.index(PROCESSES_KEYWORD)
+        try:
+            self.processes = int(args[index + 1])
+        except (IndexError, ValueError):
+            print 'The number of processes is missing.'
+            self.errors = True
+            return args[:index]
+        return args[:index] + args[index + 2:]
+
     def get_instances(self, args):
 
         names = []
@@ -101,7 +260,7 @@ class Index(AdhocracyCommand):
         remaining_args = args[:]
         if INSTANCES_KEYWORD in args:
             index = args.index(INSTANCES_KEYWORD)
-            names = self.args[index + 1:]
+            names = args[index + 1:]
             remaining_args = args[:index]
 
         instances = []
@@ -127,7 +286,7 @@ class Index(AdhocracyCommand):
 
     def get_actions(self, args):
         actions = []
-        for action in [self.DROP, self.INDEX]:
+        for action in [self.DROP, self.INDEX, self.RESUME]:
             if action in args:
                 actions.append(action)
                 args.remove(action)
@@ -146,6 +305,7 @@ class Index(AdhocracyCommand):
 
         args = self.args[:]
 
+        args = self.get_processes(args)
         args, instances = self.get_instances(args)
         args, actions = self.get_actions(args)
         classes = self.get_classes(args)
@@ -181,12 +341,92 @@ class Index(AdhocracyCommand):
                 search.drop(cls, instance)
             print '...done.'
 
-        if self.INDEX in actions:
+        if self.INDEX in actions or self.RESUME in actions:
             classes = classes if classes else self.indexed_classes.values()
-            search.rebuild(classes, instances=instances)
+            arguments = self.checkpoint_arguments(classes, instances)
+            done = set()
+            if self.RESUME in actions:
+                done = self.load_checkpoint(arguments)
+                print 'Resuming after %s indexed id ranges.' % len(done)
+
+            def progress(cls, low, high, count):
+                done.add((cls.__name__, low))
+                self.save_checkpoint(arguments, done)
+
+            if self.processes > 1:
+                self.index_parallel(classes, instances, done, progress)
+            else:
+                search.rebuild(classes, instances=instances, skip=done,
+                               progress=progress)
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
             print 'done.'
             return
 
+    @property
+    def checkpoint_path(self):
+        from adhocracy.lib.util import get_site_path
+        return get_site_path('index_checkpoint.json')
+
+    def checkpoint_arguments(self, classes, instances):
+        '''
+        The arguments an interrupted INDEX has to be resumed with: its
+        content types and instances, and the size of the id ranges.
+        '''
+        return dict(classes=sorted([cls.__name__ for cls in classes]),
+                    instances=sorted([i.key for i in instances]),
+                    range_size=search.RANGE_SIZE)
+
+    def load_checkpoint(self, arguments):
+        '''
+        :returns: set of ``(class name, low id)`` of the indexed id
+        ranges (see :func:`adhocracy.lib.search.id_ranges`). Exits if
+        the checkpoint was saved with other *arguments*.
+        '''
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if not isinstance(checkpoint, dict) or \
+                checkpoint.get('arguments') != arguments:
+            print ('The checkpoint in %s was saved by an INDEX with other '
+                   'content types or instances. Run RESUME with the same '
+                   'arguments, or INDEX to start over.' %
+                   self.checkpoint_path)
+            exit(1)
+        return set([tuple(item) for item in checkpoint['done']])
+
+    def save_checkpoint(self, arguments, done):
+        with open(self.checkpoint_path, 'w') as f:
+            json.dump(dict(arguments=arguments, done=sorted(done)), f)
+
+    def index_parallel(self, classes, instances, done, progress):
+        from multiprocessing import Pool
+        instance_ids = [i.id for i in instances] if instances else None
+        work = []
+        for cls in classes:
+            for (low, high) in search.id_ranges(cls, instance_ids):
+                if (cls.__name__, low) not in done:
+                    work.append((cls, low, high, instance_ids))
+        print 'Indexing %s id ranges with %s processes...' % (
+            len(work), self.processes)
+
+        # the workers must not share the connections of this process.
+        model.meta.Session.remove()
+        model.meta.engine.dispose()
+        pool = Pool(self.processes)
+        start = time.time()
+        total = 0
+        for (cls, low, high, count) in pool.imap_unordered(_index_range,
+                                                            work):
+            progress(cls, low, high, count)
+            total += count
+            print '%s %s-%s: %s docs, %0.1f docs/s in total' % (
+                cls.__name__, low, high, count,
+                total / max(time.time() - start, 0.001))
+        pool.close()
+        pool.join()
+
     @property
     def indexed_classes(self):
         if self._indexed_classes is None:
@@ -200,14 +440,18 @@ class Index(AdhocracyCommand):
         indexed_classes = sorted(self.indexed_classes.keys())
         content_types = '\n          '.join(indexed_classes)
         usage += (
-            'index (ALL|DROP) [<entity>, ...] [-I <instance>, ...]'
-            ' -c <inifile>'
+            'index (INDEX|RESUME|DROP) [<entity>, ...] [-P <processes>]'
+            ' [-I <instance>, ...] -c <inifile>'
             '\n\n'
-            '  DROP_ALL:\n'
+            '  DROP:\n'
             '      Remove all documents from solr.\n'
-            '  ALL\n'
+            '  INDEX\n'
             '      Index all content in solr.\n'
             '      Default if no arguments are given\n'
+            '  RESUME\n'
+            '      Continue an interrupted INDEX with the same arguments.\n'
+            '  -P <processes>\n'
+            '      Index ranges of ids in this many processes at once.\n'
             '  <entity>\n'
             '      Names of a content types to index. If not given,\n'
             '      all content is indexed. Types:\n'
@@ -1,14 +1,28 @@
+from datetime import datetime
+import json
 import logging
 
+from paste.deploy.converters import asbool
+from pylons import config
+
 from adhocracy.lib.democracy.decision import Decision
+from adhocracy.lib.democracy.delegation_graph import DelegationGraph
 from adhocracy.lib.democracy.delegation_node import DelegationNode
+from adhocracy.lib.democracy.timeline import DelegationTimeline, PollTimeline
 
+from adhocracy.lib.queue import has_queue, post_after_commit
 from adhocracy.model import meta
-from adhocracy.model import Delegation, Poll, Proposal, Tally, Vote
+from adhocracy.model import Delegateable, Delegation, DelegationWeight
+from adhocracy.model import Poll, Proposal, Tally, Vote
 
 
 log = logging.getLogger(__name__)
 
+SERVICE = 'democracy'
+
+REPLAY_DELEGATION = 'replay_delegation'
+CREATOR_VOTE = 'creator_vote'
+
 
 def init_democracy():
     '''Register callback functions for  :class:`adhocracy.models.Vote`
@@ -21,12 +35,54 @@ def init_democracy():
     LISTENERS[(Vote, UPDATE)].append(handle_vote)
     LISTENERS[(Delegation, INSERT)].append(update_delegation)
     LISTENERS[(Delegation, UPDATE)].append(update_delegation)
+    LISTENERS[(Vote, INSERT)].append(update_weights_for_vote)
+    LISTENERS[(Delegation, INSERT)].append(update_weights_for_delegation)
+    LISTENERS[(Delegation, UPDATE)].append(update_weights_for_delegation)
+
+
+def use_bulk_tally():
+    '''
+    Whether tallies should be computed with a single query for all
+    votes of a poll (see :meth:`Decision.bulk_for_poll`). Configured
+    with ``adhocracy.tally.bulk``.
+    '''
+    return asbool(config.get('adhocracy.tally.bulk', 'false'))
+
+
+def use_incremental_tally():
+    '''
+    Whether the tally after a vote should be derived from the previous
+    tally (see :meth:`Tally.incremental_counts`). Configured with
+    ``adhocracy.tally.incremental``.
+    '''
+    return asbool(config.get('adhocracy.tally.incremental', 'false'))
+
+
+def is_recount_due(vote):
+    '''
+    With incremental tallies, every ``adhocracy.tally.recount_interval``th
+    vote (default: 100, 0 disables it) is counted fully to check the
+    incremental results.
+    '''
+    interval = int(config.get('adhocracy.tally.recount_interval', 100))
+    return interval > 0 and vote.id % interval == 0
 
 
 def handle_vote(vote):
     #log.debug("Post-processing vote: %s" % vote)
     if Tally.find_by_vote(vote) is None:
-        tally = Tally.create_from_vote(vote)
+        incremental = use_incremental_tally()
+        expected = None
+        if incremental and is_recount_due(vote):
+            expected = Tally.incremental_counts(vote)
+            incremental = False
+        tally = Tally.create_from_vote(vote, bulk=use_bulk_tally(),
+                                       incremental=incremental)
+        if expected is not None and expected != (tally.num_for,
+                                                 tally.num_against,
+                                                 tally.num_abstain):
+            log.warn("Incremental tally of %s diverged: %s, recounted: %s" %
+                     (vote.poll, expected, tally))
         meta.Session.commit()
         log.debug("Tallied %s: %s" % (vote.poll, tally))
 
@@ -45,7 +101,188 @@ def check_adoptions():
 
 
 def update_delegation(delegation):
+    bulk = use_bulk_tally()
     for poll in Poll.within_scope(delegation.scope):
-        tally = Tally.create_from_poll(poll)
+        tally = Tally.create_from_poll(poll, bulk=bulk)
         meta.Session.commit()
         log.debug("Tallied %s: %s" % (poll, tally))
+
+
+def replay_delegation(delegation):
+    '''
+    Have the principal of a new delegation take over the agent's
+    decisions (see :meth:`Decision.replay_decisions`), unless this was
+    done already or the delegation has been revoked in the meantime.
+    With a queue, the tallies are updated by :func:`update_delegation`
+    once the cleared ``replay_pending`` marker is committed.
+    '''
+    if not delegation.replay_pending:
+        return
+    if not delegation.is_revoked():
+        Decision.replay_decisions(delegation)
+    delegation.replay_pending = False
+    meta.Session.flush()
+
+
+def make_creator_vote(poll):
+    '''
+    Cast the vote of the creator of a new poll, unless this was done
+    already.
+    '''
+    if not poll.vote_pending:
+        return
+    Decision(poll.user, poll).make(Vote.YES)
+    poll.vote_pending = False
+    meta.Session.flush()
+
+
+JOBS = {REPLAY_DELEGATION: (Delegation, replay_delegation),
+        CREATOR_VOTE: (Poll, make_creator_vote)}
+
+
+def post_job(job, entity):
+    '''
+    Run one of the :data:`JOBS` for *entity* from the queue once the
+    current transaction is committed, or right away if there is no
+    queue. The jobs do nothing if they were run for the entity before,
+    so messages can safely be delivered more than once.
+    '''
+    if has_queue():
+        post_after_commit(SERVICE, json.dumps(dict(job=job, id=entity.id)))
+    else:
+        (_, handler) = JOBS[job]
+        handler(entity)
+
+
+def handle_queue_message(message):
+    data = json.loads(message)
+    (cls, handler) = JOBS[data.get('job')]
+    entity = cls.find(data.get('id'), instance_filter=False,
+                      include_deleted=True)
+    if entity is None:
+        log.warn("No %s for job %s" % (cls.__name__, data))
+        return
+    handler(entity)
+    meta.Session.commit()
+
+
+def use_delegation_weights():
+    '''
+    Whether the number of delegations an agent holds is read from the
+    ``delegation_weight`` table (see :func:`delegation_weight`). The
+    table is kept up to date by the queue, so this needs a queue and
+    ``adhocracy.delegation_weight.precompute``.
+    '''
+    return has_queue() and asbool(
+        config.get('adhocracy.delegation_weight.precompute', 'false'))
+
+
+def delegation_weight(agent, scope):
+    '''
+    The number of delegations *agent* holds within *scope*. Weights
+    that are not stored yet are computed, but not stored: Only the
+    queue writes to the ``delegation_weight`` table.
+    '''
+    if use_delegation_weights():
+        weight = DelegationWeight.find(agent, scope)
+        if weight is not None:
+            return weight.weight
+    return DelegationNode(agent, scope).number_of_delegations()
+
+
+def _store_delegation_weights(scope, agents, graph):
+    scope_ids = [scope.id] + list(scope.descendant_ids())
+    q = meta.Session.query(Delegateable)
+    q = q.filter(Delegateable.id.in_(scope_ids))
+    scopes = q.all()
+    weights = dict(((w.agent_id, w.scope_id), w) for w in
+                   DelegationWeight.all_in_scopes(scope_ids))
+    for agent in agents:
+        for delegateable in scopes:
+            if (agent.id, delegateable.id) not in weights:
+                weight = DelegationWeight(agent, delegateable, 0)
+                meta.Session.add(weight)
+                weights[(agent.id, delegateable.id)] = weight
+    computed_at = datetime.utcnow()
+    for weight in weights.values():
+        weight.weight = graph.number_of_delegations(weight.agent,
+                                                    weight.scope)
+        weight.computed_at = computed_at
+    meta.Session.flush()
+    return weights.values()
+
+
+def update_delegation_weights(scope, agents=()):
+    '''
+    Recompute the stored delegation weights within *scope* and its
+    descendants, and store the weights of *agents* there.
+    '''
+    if not use_delegation_weights():
+        return
+    graph = DelegationGraph(scope.instance)
+    weights = _store_delegation_weights(scope, agents, graph)
+    meta.Session.commit()
+    log.debug("Updated %s delegation weights in %s" % (len(weights), scope))
+
+
+def update_weights_for_delegation(delegation):
+    # every agent has a stored weight within the scopes of its
+    # delegations, so a missing weight is always computed in full.
+    update_delegation_weights(delegation.scope, [delegation.agent])
+
+
+def update_weights_for_vote(vote):
+    # a direct vote overrides the delegations of the voter.
+    if vote.delegation is not None or \
+            not Delegation.find_by_principal(vote.user):
+        return
+    update_delegation_weights(vote.poll.scope)
+
+
+def rebuild_delegation_weights(instance):
+    '''
+    Replace the stored delegation weights within *instance*. The
+    weights of each agent are stored within the scopes of its
+    delegations.
+
+    :returns: the number of stored weights
+    '''
+    scopes = dict((d.id, d) for d in
+                  Delegateable.all(instance=instance, include_deleted=True))
+    for weight in DelegationWeight.all_in_scopes(scopes.keys()):
+        meta.Session.delete(weight)
+    meta.Session.flush()
+
+    pairs = set()
+    for delegation in Delegation.all(instance=instance):
+        scope_ids = [delegation.scope_id] + \
+            list(delegation.scope.descendant_ids())
+        pairs.update([(delegation.agent, id_) for id_ in scope_ids
+                      if id_ in scopes])
+    graph = DelegationGraph(instance)
+    computed_at = datetime.utcnow()
+    for (agent, scope_id) in pairs:
+        scope = scopes[scope_id]
+        weight = DelegationWeight(agent, scope,
+                                  graph.number_of_delegations(agent, scope))
+        weight.computed_at = computed_at
+        meta.Session.add(weight)
+    meta.Session.flush()
+    return len(pairs)
+
+
+def rebuild_tallies(instance):
+    '''
+    Create the missing tallies of all polls within *instance*, replaying
+    the votes of each poll once (see :class:`PollTimeline`). The
+    delegations of the instance are loaded once for all polls.
+
+    :returns: the number of created tallies
+    '''
+    q = meta.Session.query(Poll).join(Poll.scope)
+    q = q.filter(Delegateable.instance_id == instance.id)
+    delegations = DelegationTimeline(instance)
+    count = 0
+    for poll in q:
+        count += len(PollTimeline(poll, delegations).rebuild_tallies())
+    return count
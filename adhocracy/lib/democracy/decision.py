@@ -1,3 +1,4 @@
+from datetime import datetime
 import logging
 import math
 
@@ -5,6 +6,7 @@ from sqlalchemy.orm import eagerload
 
 from adhocracy import model
 from adhocracy.lib.cache import memoize
+from adhocracy.lib.democracy.delegation_graph import DelegationGraph
 from adhocracy.lib.democracy.delegation_node import DelegationNode
 from adhocracy.model import Delegateable, Vote, Poll, User
 
@@ -17,21 +19,58 @@ class DecisionException(Exception):
     pass
 
 
+def _votes_cache():
+    """
+    The votes loaded for decisions within the current session, keyed by
+    ``(user_id, poll_id, at_time)``. The session lasts for a request, a
+    queue message or, when the consumer handles messages in batches,
+    for all entity updates of a batch (see
+    :func:`adhocracy.lib.queue.dispatch`).
+    """
+    session = model.meta.Session()
+    if not hasattr(session, '_decision_votes'):
+        session._decision_votes = {}
+    return session._decision_votes
+
+
+def forget_votes(poll):
+    """
+    Drop the cached votes of all users on *poll* after new votes have
+    been cast.
+    """
+    cache = _votes_cache()
+    for key in [k for k in cache.keys() if k[1] == poll.id]:
+        del cache[key]
+
+
 class Decision(object):
     """
     A decision describes the current or past opinion that a user has
     expressed on a given poll. This includes opinions that were determined
     by an agent as a result of delegation.
+
+    The votes of a decision are loaded only once per session (see
+    :func:`_votes_cache`) for each user, poll and point in time.
+    ``bulk_for_users`` loads them for many users at once.
+
+    A ``DelegationGraph`` can be given to evaluate the delegations of
+    the decision in memory, e.g. a snapshot from a
+    ``DelegationTimeline`` for decisions in the past.
     """
 
-    def __init__(self, user, poll, at_time=None, votes=None):
+    def __init__(self, user, poll, at_time=None, votes=None, graph=None):
         self.user = user
         self.poll = poll
         self.at_time = at_time
-        self.node = DelegationNode(user, poll.scope)
+        self.node = DelegationNode(user, poll.scope, graph=graph)
         self.votes = votes
-        if not votes:
-            self.reload()
+        if votes is None:
+            self.votes = _votes_cache().get(self._key())
+            if self.votes is None:
+                self.reload()
+
+    def _key(self):
+        return (self.user.id, self.poll.id, self.at_time)
 
     def reload(self):
         """
@@ -45,6 +84,7 @@ class Decision(object):
             q = q.filter(Vote.create_time <= self.at_time)
         q = q.order_by(Vote.id.desc())
         self.votes = q.all()
+        _votes_cache()[self._key()] = self.votes
         return self
 
     def _relevant_votes(self):
@@ -64,7 +104,10 @@ class Decision(object):
             create_time = relevant.get(vote.delegation, vote).create_time
             if create_time <= vote.create_time:
                 relevant[vote.delegation] = vote
-        use_keys = self.node.filter_less_specific_delegations(relevant.keys())
+        filtering = self.node.graph
+        if filtering is None:
+            filtering = self.node
+        use_keys = filtering.filter_less_specific_delegations(relevant.keys())
         return [v for k, v in relevant.items() if k in use_keys]
 
     relevant_votes = property(_relevant_votes)
@@ -137,6 +180,7 @@ class Decision(object):
             return vote
 
         votes = self.node.propagate(propagating_vote, _edge=_edge)
+        forget_votes(self.poll)
         self.reload()
         return votes
 
@@ -168,8 +212,8 @@ class Decision(object):
             return self
         else:
             votes = [v for v in self.votes if v != vote]
-            return Decision(self.user, self.poll,
-                            at_time=self.at_time, votes=votes)
+            return Decision(self.user, self.poll, at_time=self.at_time,
+                            votes=votes, graph=self.node.graph)
 
     def to_dict(self):
         d = dict(user=self.user.user_name,
@@ -213,6 +257,86 @@ class Decision(object):
             query = query.filter(Vote.create_time <= at_time)
         return [Decision(u, poll, at_time=at_time) for u in query]
 
+    @classmethod
+    def bulk_for_poll(cls, poll, at_time=None):
+        """
+        Get all decisions that have been made on a poll, like
+        ``for_poll``, but load the votes of all users with a single
+        query instead of one query per user. The resulting decisions
+        are the same.
+
+        :param poll: The poll on which to get decisions.
+        """
+        return cls.bulk_for_polls([poll], at_time=at_time).get(poll.id, [])
+
+    @classmethod
+    def bulk_for_users(cls, users, poll, at_time=None):
+        """
+        Get the decisions of several users on a poll, loading the votes
+        of all of them with a single query. Later decisions of these
+        users on the poll within the same request use the loaded votes.
+
+        :param users: The users for which to get ``Decisions``.
+        :param poll: The poll on which to get decisions.
+        :returns: list of ``Decision``, including undecided ones.
+        """
+        cache = _votes_cache()
+        users = dict((user.id, user) for user in users)
+        missing = [id_ for id_ in users.keys()
+                   if (id_, poll.id, at_time) not in cache]
+        if missing:
+            votes = dict((id_, []) for id_ in missing)
+            query = model.meta.Session.query(Vote)
+            query = query.filter(Vote.poll_id == poll.id)
+            query = query.filter(Vote.user_id.in_(missing))
+            query = query.options(eagerload(Vote.delegation))
+            if at_time:
+                query = query.filter(Vote.create_time <= at_time)
+            query = query.order_by(Vote.id.desc())
+            for vote in query:
+                votes[vote.user_id].append(vote)
+            for (id_, user_votes) in votes.items():
+                cache[(id_, poll.id, at_time)] = user_votes
+        return [Decision(user, poll, at_time=at_time)
+                for user in users.values()]
+
+    @classmethod
+    def bulk_for_polls(cls, polls, at_time=None):
+        """
+        Get all decisions that have been made on several polls, loading
+        the votes of all of them with a single query.
+
+        :param polls: The polls on which to get decisions.
+        :returns: dict mapping poll ids to lists of ``Decision``
+        """
+        polls = dict((poll.id, poll) for poll in polls)
+        decisions = {}
+        if not polls:
+            return decisions
+        query = model.meta.Session.query(Vote)
+        query = query.filter(Vote.poll_id.in_(polls.keys()))
+        query = query.options(eagerload(Vote.user))
+        query = query.options(eagerload(Vote.delegation))
+        if at_time:
+            query = query.filter(Vote.create_time <= at_time)
+        query = query.order_by(Vote.poll_id, Vote.user_id, Vote.id.desc())
+
+        def add_decision(votes):
+            poll = polls[votes[0].poll_id]
+            decisions.setdefault(poll.id, []).append(
+                Decision(votes[0].user, poll, at_time=at_time, votes=votes))
+
+        votes = []
+        for vote in query:
+            if votes and (votes[0].poll_id != vote.poll_id or
+                          votes[0].user_id != vote.user_id):
+                add_decision(votes)
+                votes = []
+            votes.append(vote)
+        if votes:
+            add_decision(votes)
+        return decisions
+
     @classmethod
     def average_decisions(cls, instance):
         """
@@ -222,7 +346,7 @@ class Decision(object):
 
         :param instance: the ``Instance`` for which to calculate the average.
         """
-        @memoize('average_decisions', 84600)
+        @memoize('average_decisions', 84600, single_flight=True)
         def avg_decisions(instance):
             query = model.meta.Session.query(Poll)
             query = query.join(Delegateable)
@@ -238,6 +362,39 @@ class Decision(object):
             return int(max(2, math.ceil(avg)))
         return avg_decisions(instance)
 
+    @classmethod
+    def bulk_for_user(cls, user, polls, at_time=None):
+        """
+        Get the decisions of a user on several polls, loading the votes
+        of the user on all of them with a single query.
+
+        :param user: The user for which to get ``Decisions``.
+        :param polls: The polls on which to get decisions.
+        :returns: dict mapping poll ids to ``Decision``. Polls the user
+            did not vote on are left out.
+        """
+        polls = dict((poll.id, poll) for poll in polls)
+        if not polls:
+            return {}
+        query = model.meta.Session.query(Vote)
+        query = query.filter(Vote.user_id == user.id)
+        query = query.filter(Vote.poll_id.in_(polls.keys()))
+        query = query.options(eagerload(Vote.delegation))
+        if at_time:
+            query = query.filter(Vote.create_time <= at_time)
+        query = query.order_by(Vote.id.desc())
+        votes = dict((poll_id, []) for poll_id in polls.keys())
+        for vote in query:
+            votes[vote.poll_id].append(vote)
+        cache = _votes_cache()
+        for (poll_id, poll_votes) in votes.items():
+            cache[(user.id, poll_id, at_time)] = poll_votes
+        votes = dict((poll_id, poll_votes) for (poll_id, poll_votes)
+                     in votes.items() if poll_votes)
+        return dict((poll_id, Decision(user, polls[poll_id], at_time=at_time,
+                                       votes=poll_votes))
+                    for (poll_id, poll_votes) in votes.items())
+
     @classmethod
     def replay_decisions(cls, delegation):
         """
@@ -247,12 +404,52 @@ class Decision(object):
         is reproduced, but only the latest interim result. The resulting
         decisions should be the same, though.
 
+        The agent's decisions are loaded with one query and the votes
+        are propagated through one in-memory ``DelegationGraph``, like
+        ``make`` does. All resulting votes are inserted at once and
+        bypass the session, so no update event is posted for them:
+        Tallies are refreshed once per poll by the update event of the
+        delegation (see ``adhocracy.lib.democracy.update_delegation``),
+        or right away if there is no queue.
+
         :param delegation: The delegation that is newly created.
         """
-        for poll in Poll.within_scope(delegation.scope):
-            agent_decision = Decision(delegation.agent, poll)
-            if agent_decision.is_decided():
-                principal_decision = Decision(delegation.principal, poll)
-                principal_decision.make(agent_decision.result,
-                                        _edge=delegation)
-                log.debug("RP: Making %s" % principal_decision)
+        from adhocracy.lib.democracy import use_bulk_tally
+        from adhocracy.lib.queue import has_queue
+
+        polls = Poll.within_scope(delegation.scope)
+        agent_decisions = cls.bulk_for_user(delegation.agent, polls)
+        graph = DelegationGraph(delegation.scope.instance)
+        create_time = datetime.utcnow()
+        reached = {}
+        rows = []
+        decided_polls = []
+        for poll in polls:
+            agent_decision = agent_decisions.get(poll.id)
+            if agent_decision is None or not agent_decision.is_decided():
+                continue
+            if poll.scope_id not in reached:
+                node = DelegationNode(delegation.principal, poll.scope,
+                                      graph=graph)
+                reached[poll.scope_id] = node.propagate(
+                    lambda user, delegateable, edge: (user, edge),
+                    _edge=delegation)
+            for (user, edge) in reached[poll.scope_id]:
+                rows.append(dict(orientation=agent_decision.result,
+                                 create_time=create_time,
+                                 user_id=user.id,
+                                 poll_id=poll.id,
+                                 delegation_id=edge.id))
+            decided_polls.append(poll)
+            log.debug("RP: %s is voting '%s' on %s (via %s)" %
+                      (repr(delegation.principal), agent_decision.result,
+                       poll, delegation))
+
+        if rows:
+            model.meta.Session.execute(model.vote_table.insert(), rows)
+        for poll in decided_polls:
+            forget_votes(poll)
+        if not has_queue():
+            bulk = use_bulk_tally()
+            for poll in decided_polls:
+                model.Tally.create_from_poll(poll, bulk=bulk)
@@ -0,0 +1,286 @@
+from datetime import datetime
+import logging
+
+from sqlalchemy import or_
+from sqlalchemy.orm import eagerload
+
+from adhocracy import model
+from adhocracy.model import Delegateable, Delegation, Vote, category_graph
+
+log = logging.getLogger(__name__)
+
+
+class DelegationGraph(object):
+    """
+    A ``DelegationGraph`` is an in-memory snapshot of all delegations
+    that are active within an ``Instance`` at a given point in time.
+
+    All delegations of the instance are loaded with a single query and
+    kept in adjacency maps keyed by the ids of the agents and principals.
+    The category tree of the instance is loaded along with them, so that
+    traversing the graph (``inbound``, ``outbound``, ``transitive_inbound``
+    and ``number_of_delegations``) does not need to touch the database.
+    The only exception are the direct voters of a poll, which are loaded
+    lazily and at most once per poll.
+
+    The graph is not updated when delegations are created or revoked, so
+    it should not be kept longer than the operation it was created for.
+    Snapshots for other points in time are best taken from a
+    ``DelegationTimeline``, which loads the delegations only once.
+
+    :param instance: The ``Instance`` whose delegations are loaded.
+    :param at_time: load the delegation graph at the given time, defaults
+        to the current time.
+    :param load: if ``False``, start with an empty graph which is filled
+        with ``add`` and ``load_tree``.
+    """
+
+    def __init__(self, instance, at_time=None, load=True):
+        self.instance = instance
+        self.at_time = at_time
+        self._inbound = {}
+        self._outbound = {}
+        self._parents = {}
+        self._children = {}
+        self._self_deciders = {}
+        if load:
+            self.reload()
+
+    def reload(self):
+        """
+        Load all active delegations and the category tree of the instance.
+        """
+        self.load_delegations()
+        self.load_tree()
+        self._self_deciders = {}
+        return self
+
+    def load_delegations(self):
+        at_time = self.at_time
+        if at_time is None:
+            at_time = datetime.utcnow()
+
+        query = model.meta.Session.query(Delegation)
+        query = query.join(Delegateable)
+        query = query.filter(Delegateable.instance_id == self.instance.id)
+        query = query.filter(Delegation.create_time <= at_time)
+        query = query.filter(or_(Delegation.revoke_time == None,
+                                 Delegation.revoke_time > at_time))
+        query = query.options(eagerload(Delegation.agent),
+                              eagerload(Delegation.principal))
+        query = query.order_by(Delegation.id)
+
+        self._inbound = {}
+        self._outbound = {}
+        for delegation in query:
+            self.add(delegation)
+
+    def load_tree(self, graph=None):
+        """
+        Load the category tree of the instance, or share the one already
+        loaded by *graph*.
+        """
+        if graph is not None:
+            self._parents = graph._parents
+            self._children = graph._children
+            return
+
+        # Column names in the category graph are inverted with regard
+        # to the ``parents`` and ``children`` relations of the
+        # ``Delegateable`` mapper, see ``adhocracy.model``.
+        query = model.meta.Session.query(category_graph.c.parent_id,
+                                         category_graph.c.child_id)
+        query = query.filter(category_graph.c.parent_id == Delegateable.id)
+        query = query.filter(Delegateable.instance_id == self.instance.id)
+
+        self._parents = {}
+        self._children = {}
+        for (child_id, parent_id) in query:
+            self._parents.setdefault(child_id, []).append(parent_id)
+            self._children.setdefault(parent_id, []).append(child_id)
+
+    def add(self, delegation):
+        """
+        Add a delegation to the graph.
+        """
+        self._inbound.setdefault(delegation.agent_id, {}).setdefault(
+            delegation.scope_id, []).append(delegation)
+        self._outbound.setdefault(delegation.principal_id, {}).setdefault(
+            delegation.scope_id, []).append(delegation)
+
+    def remove(self, delegation):
+        """
+        Remove a delegation from the graph, e.g. when it is revoked.
+        """
+        self._inbound[delegation.agent_id][delegation.scope_id].remove(
+            delegation)
+        self._outbound[delegation.principal_id][delegation.scope_id].remove(
+            delegation)
+
+    def _scope_ids(self, scope_id, recurse):
+        ids = [scope_id]
+        if recurse:
+            for parent_id in self._parents.get(scope_id, []):
+                ids.extend(self._scope_ids(parent_id, recurse))
+        return ids
+
+    def _traverse(self, adjacency, user, delegateable, recurse):
+        by_scope = adjacency.get(user.id)
+        if not by_scope:
+            return []
+        delegations = []
+        for scope_id in self._scope_ids(delegateable.id, recurse):
+            delegations.extend(by_scope.get(scope_id, []))
+        return delegations
+
+    def is_super(self, delegateable, other):
+        """
+        In-memory equivalent of ``Delegateable.is_super``: Determine if
+        *other* is a (transitive) child of *delegateable*.
+        """
+        return self._is_super_id(delegateable.id, other.id)
+
+    def _is_super_id(self, scope_id, other_id):
+        children = self._children.get(scope_id, [])
+        if other_id in children:
+            return True
+        for child_id in children:
+            if self._is_super_id(child_id, other_id):
+                return True
+        return False
+
+    def filter_less_specific_delegations(self, delegations):
+        """
+        Same as ``DelegationNode.filter_less_specific_delegations``, but
+        using the category tree of the graph.
+        """
+        matches = list(delegations)
+        for d in delegations:
+            for m in matches:
+                if self._is_super_id(m.scope_id, d.scope_id):
+                    matches.remove(m)
+        return matches
+
+    def inbound(self, user, delegateable, recurse=True,
+                is_counting_delegations=False):
+        """
+        Retrieve all inbound delegations (i.e. those that the user has received
+        from other users in order to vote on their behalf) that apply to the
+        ``Delegateable``.
+
+        :param recurse: if ``True``, search will include delegations on parent
+            ``Delegateables`` in breadth-first traversal order.
+        :returns: list of ``Delegation``
+        """
+        delegations = self._traverse(self._inbound, user, delegateable,
+                                     recurse)
+        delegations = self._filter_out_overriden_delegations(delegations)
+        if is_counting_delegations:
+            delegations = [d for d in delegations if
+                           self._is_most_specific_delegation(d, user,
+                                                             delegateable)]
+        delegations = [d for d in delegations if
+                       not self._is_overriden_by_direct_vote(d)]
+        return delegations
+
+    def transitive_inbound(self, user, delegateable, recurse=True,
+                           is_counting_delegations=False, _path=None):
+        """
+        Retrieve inbound delegations recursing through the delegation graph
+        as well as through the category tree.
+
+        :param recurse: if ``True``, search will include delegations on parent
+            ``Delegateables`` in breadth-first traversal order.
+        :returns: list of ``Delegation``
+        """
+        if _path is None:
+            _path = []
+        elif user.id in _path:
+            return []  # we already visited this node
+        # circle detection uses this path of visited nodes
+        _path.append(user.id)
+
+        delegations = self.inbound(
+            user, delegateable, recurse=recurse,
+            is_counting_delegations=is_counting_delegations)
+        for delegation in list(delegations):
+            additional_delegations = self.transitive_inbound(
+                delegation.principal, delegateable, recurse=recurse,
+                is_counting_delegations=is_counting_delegations, _path=_path)
+            for additional_delegation in additional_delegations:
+                if additional_delegation.principal_id in _path:
+                    continue  # this is a delegation from a node we
+                              # already visited
+                else:
+                    delegations.append(additional_delegation)
+        # _path is used as a stack in the recursion - so we need to remove
+        # what we added in going into the recursion
+        _path.remove(user.id)
+        return delegations
+
+    def outbound(self, user, delegateable, recurse=True, filter=True):
+        """
+        Retrieve all outbound delegations (i.e. those that the user has given
+        to other users in order allow them to vote on his/her behalf) that
+        apply to the ``Delegateable``.
+
+        :param recurse: if ``True``, search will include delegations on parent
+            ``Delegateables`` in breadth-first traversal order.
+        :returns: list of ``Delegation``
+        """
+        delegations = self._traverse(self._outbound, user, delegateable,
+                                     recurse)
+        if filter:
+            by_agent = dict()
+            for delegation in set(delegations):
+                by_agent[delegation.agent_id] = (
+                    by_agent.get(delegation.agent_id, []) + [delegation])
+            delegations = [self.filter_less_specific_delegations(ds)[0] for
+                           ds in by_agent.values()]
+        return delegations
+
+    def number_of_delegations(self, user, delegateable):
+        return len(self.transitive_inbound(user, delegateable,
+                                           is_counting_delegations=True))
+
+    def _filter_out_overriden_delegations(self, delegations):
+        by_principal = dict()
+        for delegation in set(delegations):
+            by_principal[delegation.principal_id] = by_principal.get(
+                delegation.principal_id, []) + [delegation]
+        return [self.filter_less_specific_delegations(ds)[0] for
+                ds in by_principal.values()]
+
+    def _is_most_specific_delegation(self, delegation, agent, delegateable):
+        outbound_delegations = self.outbound(delegation.principal,
+                                             delegateable)
+        if 1 == len(outbound_delegations):
+            # If this returns false, the data model is invalid!
+            return outbound_delegations[0].agent_id == agent.id
+        elif len(outbound_delegations) > 1:
+            smallest_delegations = [outbound_delegations[0]]
+            for outbound_delegation in outbound_delegations:
+                scope_id = smallest_delegations[0].scope_id
+                if self._is_super_id(scope_id, outbound_delegation.scope_id):
+                    smallest_delegations = [outbound_delegation]
+                elif scope_id == outbound_delegation.scope_id:
+                    smallest_delegations.append(outbound_delegation)
+            for smallest_delegation in smallest_delegations:
+                if smallest_delegation.agent_id == agent.id:
+                    return True
+        return False
+
+    def _is_overriden_by_direct_vote(self, delegation):
+        poll = getattr(delegation.scope, 'poll', None)
+        if poll is None:
+            return False  # no poll in this scope -> can't self decide
+        if poll.id not in self._self_deciders:
+            query = model.meta.Session.query(Vote.user_id)
+            query = query.filter(Vote.poll_id == poll.id)
+            query = query.filter(Vote.delegation_id == None)
+            self._self_deciders[poll.id] = set(
+                [user_id for (user_id,) in query.distinct()])
+        return delegation.principal_id in self._self_deciders[poll.id]
+
+    def __repr__(self):
+        return "<DelegationGraph(%s,%s)>" % (self.instance.key, self.at_time)
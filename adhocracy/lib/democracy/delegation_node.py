@@ -1,10 +1,7 @@
-from datetime import datetime
 import logging
 
-from sqlalchemy import or_
-
 from adhocracy import model
-from adhocracy.model import Delegation
+from adhocracy.lib.democracy.delegation_graph import DelegationGraph
 
 log = logging.getLogger(__name__)
 
@@ -51,30 +48,34 @@ class DelegationNode(object):
     **TODO:** Developing a good caching strategy for this class would be
     useful in order to cache the delegation graph to memcached.
 
+    The traversal itself is done by a ``DelegationGraph`` which loads
+    all delegations of the instance at once.
+
     :param user: The ``User`` at the center of this ``DelegationNode``.
     :param delegateable: A ``Delegateable``.
+    :param graph: An optional ``DelegationGraph`` to reuse. If not given,
+        a new one is loaded for each traversal.
+    :param timeline: An optional ``DelegationTimeline`` of the instance.
+        Traversals at a given time then use a snapshot of it instead of
+        loading the delegations of that time.
     """
 
-    def __init__(self, user, delegateable):
+    def __init__(self, user, delegateable, graph=None, timeline=None):
         self.user = user
         self.delegateable = delegateable
-
-    def _query_traverse(self, querymod, recurse, at_time=None):
-        if not at_time:  # shouldn't this be if at_time is None: ?
-            at_time = datetime.utcnow()
-
-        query = model.meta.Session.query(Delegation)
-        query = query.filter(Delegation.scope == self.delegateable)
-        query = query.filter(Delegation.create_time <= at_time)
-        query = query.filter(or_(Delegation.revoke_time == None,
-                                 Delegation.revoke_time > at_time))
-        query = querymod(query)
-        delegations = query.all()
-        if recurse:
-            for parent in self.delegateable.parents:
-                node = DelegationNode(self.user, parent)
-                delegations += node._query_traverse(querymod, recurse, at_time)
-        return delegations
+        self.graph = graph
+        self.timeline = timeline
+        self._snapshot = None
+
+    def _get_graph(self, at_time=None):
+        if self.graph is not None and (at_time is None or
+                                       at_time == self.graph.at_time):
+            return self.graph
+        if self.timeline is not None and at_time is not None:
+            if self._snapshot is None or self._snapshot.at_time != at_time:
+                self._snapshot = self.timeline.snapshot(at_time)
+            return self._snapshot
+        return DelegationGraph(self.delegateable.instance, at_time=at_time)
 
     def inbound(self, recurse=True, at_time=None,
                 is_counting_delegations=False):
@@ -88,17 +89,11 @@ class DelegationNode(object):
         :param at_time: return the delegation graph at the given time, defaults
             to the current time.
         """
-        delegations = self._query_traverse(
-            lambda q: q.filter(Delegation.agent == self.user),
-            recurse, at_time)
-
-        delegations = self._filter_out_overriden_delegations(delegations)
-        if is_counting_delegations:
-            delegations = self._filter_out_delegations_where_a_more_specific_delegation_exists(delegations)
-        delegations = self._filter_out_delegations_that_are_overriden_by_direct_votes(delegations)
-        return delegations
+        return self._get_graph(at_time).inbound(
+            self.user, self.delegateable, recurse=recurse,
+            is_counting_delegations=is_counting_delegations)
 
-    def transitive_inbound(self, recurse=True, at_time=None, _path=None,
+    def transitive_inbound(self, recurse=True, at_time=None,
                            is_counting_delegations=False):
         """
         Retrieve inbound delegations recursing through the delegation graph
@@ -110,31 +105,9 @@ class DelegationNode(object):
             to the current time.
         :returns: list of ``Delegation``
         """
-        if _path is None:
-            _path = []
-        elif self.user in _path:
-            return []  # we already visited this node
-        # circle detection uses this path of visited nodes
-        _path.append(self.user)
-
-        delegations = self.inbound(
-            recurse=recurse, at_time=at_time,
+        return self._get_graph(at_time).transitive_inbound(
+            self.user, self.delegateable, recurse=recurse,
             is_counting_delegations=is_counting_delegations)
-        for delegation in list(delegations):
-            ddnode = DelegationNode(delegation.principal, self.delegateable)
-            additional_delegations = ddnode.transitive_inbound(
-                recurse=recurse, at_time=at_time, _path=_path,
-                is_counting_delegations=is_counting_delegations)
-            for additional_delegation in additional_delegations:
-                if additional_delegation.principal in _path:
-                    continue  # this is a delegation from  a node we
-                              # already visited
-                else:
-                    delegations.append(additional_delegation)
-        # _path is used as a stack in the recursion - so we need to remove
-        # what we added in going into the recursion
-        _path.remove(self.user)
-        return delegations
 
     def outbound(self, recurse=True, at_time=None, filter=True):
         """
@@ -148,19 +121,8 @@ class DelegationNode(object):
             to the current time.
         :returns: list of ``Delegation``
         """
-        delegations = self._query_traverse(
-            lambda q: q.filter(Delegation.principal == self.user),
-            recurse, at_time)
-
-        if filter:
-            by_agent = dict()
-            for delegation in set(delegations):
-                by_agent[delegation.agent] = (
-                    by_agent.get(delegation.agent, []) + [delegation])
-            delegations = [self.filter_less_specific_delegations(ds)[0] for
-                           ds in by_agent.values()]
-
-        return delegations
+        return self._get_graph(at_time).outbound(
+            self.user, self.delegateable, recurse=recurse, filter=filter)
     # TODO: consider to add a transitive-outbound to know where the vote
     #        will end up for a specific issue
 
@@ -193,15 +155,18 @@ class DelegationNode(object):
         result = [callable(self.user, self.delegateable, _edge)]
         if not self.delegateable.instance.allow_delegate:
             return result
-        for delegation in self.inbound():
-            node = DelegationNode(delegation.principal, self.delegateable)
+        graph = self._get_graph()
+        for delegation in graph.inbound(self.user, self.delegateable):
+            node = DelegationNode(delegation.principal, self.delegateable,
+                                  graph=graph, timeline=self.timeline)
             result += node.propagate(callable,
                                      _edge=delegation,
                                      _propagation_path=_propagation_path)
         return result
 
     def number_of_delegations(self):
-        return len(self.transitive_inbound(is_counting_delegations=True))
+        return self._get_graph().number_of_delegations(self.user,
+                                                       self.delegateable)
 
     def __repr__(self):
         return "<DelegationNode(%s,%s)>" % (self.user.user_name,
@@ -244,53 +209,3 @@ class DelegationNode(object):
                 if m.scope.is_super(d.scope):
                     matches.remove(m)
         return matches
-
-    def _filter_out_overriden_delegations(self, delegations):
-        # return delegations
-        by_principal = dict()
-        for delegation in set(delegations):
-            by_principal[delegation.principal] = by_principal.get(
-                delegation.principal, []) + [delegation]
-        return [self.filter_less_specific_delegations(ds)[0] for
-                ds in by_principal.values()]
-
-    def _filter_out_delegations_that_are_overriden_by_direct_votes(
-        self, delegations):
-        from adhocracy.lib.democracy.decision import Decision
-
-        def is_overriden_by_own_decision(delegation):
-            if not hasattr(delegation.scope, 'poll'):
-                return True  # scope doesn't have polls -> can't self decide
-            if delegation.scope.poll is None:
-                return True  # currently no poll in this cope -> can't
-                             # self decide
-            decision = Decision(delegation.principal, delegation.scope.poll)
-            return not decision.is_self_decided()
-
-        return filter(is_overriden_by_own_decision, delegations)
-
-    # REFACT: this method apears to do the same as
-    #         filter_less_specific_delegations (modulo the pre-work
-    #         that happens before it is called)
-    def _filter_out_delegations_where_a_more_specific_delegation_exists(
-        self, delegations):
-        def is_overriden_by_other_delegation(delegation):
-            node = DelegationNode(delegation.principal, self.delegateable)
-            outbound_delegations = node.outbound()
-            if 1 == len(outbound_delegations):
-                # If this returns false, the data model is invalid!
-                return outbound_delegations[0].agent == self.user
-            elif len(outbound_delegations) > 1:
-                smallest_delegations = [outbound_delegations[0]]
-                for delegation in outbound_delegations:
-                    scope = smallest_delegations[0].scope
-                    if scope.is_super(delegation.scope):
-                        smallest_delegations = [delegation]
-                    elif scope == delegation.scope:
-                        smallest_delegations.append(delegation)
-                for delegation in smallest_delegations:
-                    if delegation.agent == self.user:
-                        return True
-            return False
-
-        return filter(is_overriden_by_other_delegation, delegations)
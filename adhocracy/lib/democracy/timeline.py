@@ -0,0 +1,221 @@
+from bisect import bisect_right
+import logging
+
+from sqlalchemy.orm import eagerload
+
+from adhocracy import model
+from adhocracy.lib.democracy.decision import Decision
+from adhocracy.lib.democracy.delegation_graph import DelegationGraph
+from adhocracy.model import Delegateable, Delegation, Tally, Vote
+
+log = logging.getLogger(__name__)
+
+
+class DelegationTimeline(object):
+    """
+    A ``DelegationTimeline`` holds every delegation ever made within an
+    ``Instance``, indexed by the times they were created and revoked.
+    It produces ``DelegationGraph`` snapshots for any point in time
+    without querying the database again, and can replay the changes
+    of the graph event by event.
+
+    :param instance: The ``Instance`` whose delegations are loaded.
+    """
+
+    CREATE = 0
+    REVOKE = 1
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.reload()
+
+    def reload(self):
+        """
+        Load all delegations (including revoked ones) and the category
+        tree of the instance.
+        """
+        query = model.meta.Session.query(Delegation)
+        query = query.join(Delegateable)
+        query = query.filter(Delegateable.instance_id == self.instance.id)
+        query = query.options(eagerload(Delegation.agent),
+                              eagerload(Delegation.principal))
+
+        events = []
+        for delegation in query:
+            events.append((delegation.create_time, self.CREATE,
+                           delegation.id, delegation))
+            if delegation.revoke_time is not None:
+                events.append((delegation.revoke_time, self.REVOKE,
+                               delegation.id, delegation))
+        events.sort()
+        self._events = [(time, kind, delegation) for
+                        (time, kind, _, delegation) in events]
+        self._times = [time for (time, kind, delegation) in self._events]
+
+        self._tree = DelegationGraph(self.instance, load=False)
+        self._tree.load_tree()
+        return self
+
+    def _apply(self, graph, event):
+        (time, kind, delegation) = event
+        if kind == self.CREATE:
+            graph.add(delegation)
+        else:
+            graph.remove(delegation)
+
+    def events(self, start=None, end=None):
+        """
+        The creations and revocations of delegations in the given
+        interval, in the order they happened.
+
+        :returns: list of ``(time, kind, delegation)`` tuples where
+            kind is ``CREATE`` or ``REVOKE``.
+        """
+        first = 0 if start is None else bisect_right(self._times, start)
+        last = len(self._events) if end is None else \
+            bisect_right(self._times, end)
+        return self._events[first:last]
+
+    def snapshot(self, at_time):
+        """
+        The delegation graph as it was at *at_time*.
+
+        :returns: a ``DelegationGraph``
+        """
+        graph = DelegationGraph(self.instance, at_time=at_time, load=False)
+        graph.load_tree(self._tree)
+        for event in self.events(end=at_time):
+            self._apply(graph, event)
+        return graph
+
+    def advance(self, graph, at_time):
+        """
+        Move a snapshot of this timeline forward to *at_time* in place,
+        applying only the events since the time of the snapshot.
+
+        :returns: the updated *graph*
+        """
+        if graph.at_time is not None and at_time < graph.at_time:
+            raise ValueError("Cannot move %r back to %s" % (graph, at_time))
+        for event in self.events(start=graph.at_time, end=at_time):
+            self._apply(graph, event)
+        graph.at_time = at_time
+        graph._self_deciders = {}
+        return graph
+
+    def replay(self, start=None, end=None):
+        """
+        Step through the delegation graph event by event. The graph
+        starts as it was at *start* (or empty) and is updated in place.
+
+        :returns: iterator of ``(time, graph)`` tuples, one after each
+            event up to *end*.
+        """
+        if start is None:
+            graph = DelegationGraph(self.instance, load=False)
+            graph.load_tree(self._tree)
+        else:
+            graph = self.snapshot(start)
+        for event in self.events(start=start, end=end):
+            self._apply(graph, event)
+            graph.at_time = event[0]
+            yield (event[0], graph)
+
+
+class PollTimeline(object):
+    """
+    A ``PollTimeline`` replays all votes cast on a ``Poll`` in the order
+    they were cast and keeps track of the decision of each voter. This
+    gives the tally of the poll after each vote in a single pass, with
+    the same results as counting all decisions as of the time of the
+    vote (``Tally.create_from_poll``).
+
+    The decisions are made against one snapshot of the delegation graph
+    of the instance, which is moved forward along with the votes.
+
+    :param poll: The ``Poll`` whose votes are loaded.
+    :param delegations: An optional ``DelegationTimeline`` of the
+        instance of the poll, e.g. to share it between the polls of an
+        instance. If not given, it is loaded.
+    """
+
+    def __init__(self, poll, delegations=None):
+        self.poll = poll
+        if delegations is None:
+            delegations = DelegationTimeline(poll.scope.instance)
+        self.delegations = delegations
+        self.reload()
+
+    def reload(self):
+        """
+        Load all votes on the poll.
+        """
+        query = model.meta.Session.query(Vote)
+        query = query.filter(Vote.poll_id == self.poll.id)
+        query = query.options(eagerload(Vote.user))
+        query = query.options(eagerload(Vote.delegation))
+        query = query.order_by(Vote.create_time, Vote.id)
+        self.votes = query.all()
+        return self
+
+    def replay(self):
+        """
+        :returns: iterator of ``(vote, (num_for, num_against,
+            num_abstain))`` tuples. Votes cast at the same time are
+            counted together.
+        """
+        votes_by_user = {}
+        results = {}
+        counts = {Vote.YES: 0, Vote.NO: 0, Vote.ABSTAIN: 0}
+        group = []
+        graph = None
+        for i, vote in enumerate(self.votes):
+            group.append(vote)
+            user_votes = votes_by_user.setdefault(vote.user_id, [])
+            user_votes.append(vote)
+            user_votes.sort(key=lambda v: v.id, reverse=True)
+            if i + 1 < len(self.votes) and \
+                    self.votes[i + 1].create_time == vote.create_time:
+                continue
+
+            if graph is None:
+                graph = self.delegations.snapshot(vote.create_time)
+            else:
+                self.delegations.advance(graph, vote.create_time)
+            for user_id in set([v.user_id for v in group]):
+                user_votes = votes_by_user[user_id]
+                decision = Decision(user_votes[0].user, self.poll,
+                                    at_time=vote.create_time,
+                                    votes=list(user_votes), graph=graph)
+                before = results.get(user_id)
+                after = decision.result
+                if before is not None:
+                    counts[before] -= 1
+                if after is not None:
+                    counts[after] += 1
+                results[user_id] = after
+            for group_vote in group:
+                yield (group_vote, (counts[Vote.YES], counts[Vote.NO],
+                                    counts[Vote.ABSTAIN]))
+            group = []
+
+    def rebuild_tallies(self):
+        """
+        Create the missing tallies for all votes on the poll in one pass.
+
+        :returns: list of the created ``Tally`` objects
+        """
+        query = model.meta.Session.query(Tally.vote_id)
+        query = query.filter(Tally.poll_id == self.poll.id)
+        existing = set([vote_id for (vote_id,) in query])
+        tallies = []
+        for (vote, counts) in self.replay():
+            if vote.id in existing:
+                continue
+            tally = Tally(self.poll, *counts)
+            tally.create_time = vote.create_time
+            tally.vote = vote
+            model.meta.Session.add(tally)
+            tallies.append(tally)
+        model.meta.Session.flush()
+        return tallies
@@ -9,28 +9,38 @@ from adhocracy.lib.util import timedelta2seconds
 log = logging.getLogger(__name__)
 
 
-def activity(query_filter, from_time=None, to_time=None):
+def _time_range(from_time=None, to_time=None):
     if not to_time:
         to_time = datetime.utcnow()
     if not from_time:
         from_time = to_time - timedelta(days=30)
+    return (from_time, to_time)
+
+
+def _event_scorer(from_time, to_time):
     base_age = timedelta2seconds(to_time - from_time)
 
+    def evt_value(event_time):
+        age = base_age - timedelta2seconds(to_time - event_time)
+        return math.log(max(1, age))
+    return evt_value
+
+
+def activity(query_filter, from_time=None, to_time=None):
+    (from_time, to_time) = _time_range(from_time, to_time)
+    evt_value = _event_scorer(from_time, to_time)
+
     query = model.meta.Session.query(model.Event.time)
     query = query.filter(model.Event.time >= from_time)
     query = query.filter(model.Event.time <= to_time)
     query = query.order_by(model.Event.time.asc())
     query = query_filter(query)
 
-    def evt_value(event_time):
-        age = base_age - timedelta2seconds(to_time - event_time)
-        return math.log(max(1, age))
-
     act = sum([evt_value(row[0]) for row in query])
     return act
 
 
-@memoize('instance_activity', 84600)
+@memoize('instance_activity', 84600, single_flight=True)
 def instance_activity(instance, from_time=None, to_time=None):
     def query_filter(q):
         return q.filter(model.Event.instance == instance)
@@ -50,3 +60,29 @@ def user_activity(instance, user, from_time=None, to_time=None):
             q = q.filter(model.Event.instance == instance)
         return q
     return activity(query_filter, from_time, to_time)
+
+
+def user_activities(users, from_time=None, to_time=None):
+    '''
+    Compute the activity of all *users* in each instance with one query.
+    The values are the same :func:`user_activity` returns for each user
+    and instance.
+
+    Returns: a dict mapping ``(user id, instance id)`` to the activity
+    '''
+    (from_time, to_time) = _time_range(from_time, to_time)
+    evt_value = _event_scorer(from_time, to_time)
+
+    query = model.meta.Session.query(model.Event.user_id,
+                                     model.Event.instance_id,
+                                     model.Event.time)
+    query = query.filter(model.Event.user_id.in_([u.id for u in users]))
+    query = query.filter(model.Event.time >= from_time)
+    query = query.filter(model.Event.time <= to_time)
+    query = query.order_by(model.Event.time.asc())
+
+    activities = {}
+    for (user_id, instance_id, event_time) in query:
+        key = (user_id, instance_id)
+        activities[key] = activities.get(key, 0) + evt_value(event_time)
+    return activities
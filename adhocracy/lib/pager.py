@@ -1,4 +1,5 @@
 import copy
+from datetime import datetime
 from inspect import isclass
 import math
 import logging
@@ -9,13 +10,18 @@ from formencode import validators
 from pylons.i18n import _, lazy_ugettext, lazy_ugettext as L_
 from pylons import config, request, tmpl_context as c, url
 from pylons.controllers.util import redirect
+from sqlalchemy import func, or_
+from sqlalchemy.orm.attributes import set_committed_value
 from webob.multidict import MultiDict
 
 from adhocracy import model
 from adhocracy.lib import sorting, tiles
-from adhocracy.lib.event.stats import user_activity
-from adhocracy.lib.search.query import sunburnt_query, add_wildcard_query
+from adhocracy.lib.event.stats import user_activities, user_activity
+from adhocracy.lib.search.query import (add_wildcard_query,
+                                        all_counts_key, faceted_options,
+                                        sunburnt_query)
 from adhocracy.lib.templating import render_def
+from adhocracy.lib.tiles.util import prefetch_tiles
 from adhocracy.model.refs import ref_attr_value
 
 log = logging.getLogger(__name__)
@@ -164,6 +170,7 @@ class PagerMixin(object):
         '''
         render the template for the pager (without facets)
         '''
+        prefetch_tiles(self.itemfunc, self.items)
         return render_def('/pager.html', 'namedpager', pager=self)
 
     @property
@@ -381,6 +388,62 @@ class SolrIndexer(object):
         """
         raise NotImplemented('has to be implemented in subclass')
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        """
+        Like :meth:`add_data_to_index`, for a list of *entities* of
+        one class and the list of their *indexes*. It is used when
+        many entities are indexed at once. Overwrite it to load what
+        the indexer needs for all entities with a few queries.
+        """
+        for (entity, data) in zip(entities, indexes):
+            cls.add_data_to_index(entity, data)
+
+
+def load_relation(entities, name, cls, column):
+    '''
+    Load the many-to-one relation *name* of all *entities* with one
+    query for the *cls* objects whose id is in the attribute *column*.
+    Entities that have the relation loaded already are left alone.
+    '''
+    entities = [e for e in entities if name not in e.__dict__]
+    ids = set([getattr(e, column) for e in entities]) - set([None])
+    if not ids:
+        return
+    q = model.meta.Session.query(cls).filter(cls.id.in_(ids))
+    related = dict((r.id, r) for r in q)
+    for entity in entities:
+        set_committed_value(entity, name,
+                            related.get(getattr(entity, column)))
+
+
+def load_collection(entities, name, cls, column):
+    '''
+    Load the one-to-many relation *name* of all *entities* with one
+    query for the *cls* objects that refer to them with their
+    attribute *column*.
+    '''
+    entities = [e for e in entities if name not in e.__dict__]
+    if not entities:
+        return
+    collections = dict((e.id, []) for e in entities)
+    q = model.meta.Session.query(cls)
+    q = q.filter(getattr(cls, column).in_(collections.keys()))
+    for item in q:
+        collections[getattr(item, column)].append(item)
+    for entity in entities:
+        set_committed_value(entity, name, collections[entity.id])
+
+
+def load_instances(users):
+    '''
+    Load what :attr:`adhocracy.model.User.instances` needs for all
+    *users*.
+    '''
+    load_collection(users, 'memberships', model.Membership, 'user_id')
+    memberships = [m for u in users for m in u.memberships]
+    load_relation(memberships, 'instance', model.Instance, 'instance_id')
+
 
 class SolrFacet(SolrIndexer):
     """
@@ -396,13 +459,13 @@ class SolrFacet(SolrIndexer):
     Only in a thread:
     >>> some_facet = SomeFacet('mypager_prefix', request)
     >>> q = solr_query()
-    >>> counts_query = q
     >>> # configure the query further
-    >>> q, counts_query = some_facet.add_to_queries(q, counts_query)
-    >>> response = q.execute()
-    >>> counts_response = counts_response.execute()
-    >>> some_facet.update(response, counts_response)
-    >>> some_facet.items
+    >>> q = some_facet.add_to_query(q)
+    >>> options = faceted_options(q, some_facet.filters(),
+    ...                           [some_facet.solr_field])
+    >>> response = q.interface.search(**options)
+    >>> some_facet.update(response)
+    >>> some_facet.current_items
     [...]
     """
 
@@ -414,6 +477,9 @@ class SolrFacet(SolrIndexer):
     solr_field = None
     show_empty = False
     show_current_empty = True
+    # the most facet values solr counts and the facet shows, -1 for
+    # all. Lower it for facets where the most frequent values suffice.
+    limit = -1
     template = '/pager.html'
     _response = None
 
@@ -439,27 +505,29 @@ class SolrFacet(SolrIndexer):
     def response(self, response):
         self._response = response
 
-    def add_to_queries(self, query, counts_query):
+    def add_to_query(self, query):
+        '''
+        Add the facet to the *query*. The results are limited to the
+        facet values used in the request by the :meth:`filters`.
+
+        Returns: the modified query
         '''
-        Add the facet to the queries *query* and *counts_query*.
-        The difference is that the *query* will be limited to facet values
-        used in the the request.
+        return query.facet_by(self.solr_field, limit=self.limit)
 
-        Returns: the modified queries as a (query, counts_query) tuple
+    def filters(self):
         '''
-        query = query.facet_by(self.solr_field)
-        counts_query = counts_query.facet_by(self.solr_field)
-        for value in self.used:
-            query = query.query(**{self.solr_field: value})
-        return query, counts_query
+        Return the facet values used in the request as a list of
+        ``(solr field, value)`` tuples.
+        '''
+        return [(self.solr_field, value) for value in self.used]
 
-    def update(self, response, counts_response):
+    def update(self, response):
         '''
         Compute and update different attributes of the facet based
-        on the solr *response* and the *base_query*.
+        on the solr *response* to a query with
+        :func:`adhocracy.lib.search.query.faceted_options`.
         '''
         self.response = response
-        self.counts_response = counts_response
         solr_field = self.solr_field
 
         # the counts in the current query which is limited to selected
@@ -470,9 +538,10 @@ class SolrFacet(SolrIndexer):
                                             reverse=True)
         self.current_counts = dict(self.sorted_current_counts)
 
-        # the counts in the current query which is limited to selected
-        # facet values
-        facet_counts = counts_response.facet_counts.facet_fields[solr_field]
+        # the counts in the current query without the selected facet
+        # values
+        facet_counts = response.facet_counts.facet_fields[
+            all_counts_key(solr_field)]
         self.sorted_facet_counts = sorted(facet_counts,
                                           key=lambda(value, count): count,
                                           reverse=True)
@@ -547,7 +616,9 @@ class SolrFacet(SolrIndexer):
         ids = []
         facet_items = {}
         for (value, facet_count) in self.sorted_facet_counts:
-            current_count = self.current_counts[value]
+            # values not among the most frequent in the current query
+            # are not counted
+            current_count = self.current_counts.get(value, 0)
 
             if show_facet(current_count, facet_count,
                           self.show_empty, self.show_current_empty):
@@ -691,6 +762,11 @@ class InstanceFacet(SolrFacet):
         index[cls.solr_field] = [ref_attr_value(instance) for
                                  instance in user.instances]
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        load_instances([e for e in entities if isinstance(e, model.User)])
+        super(InstanceFacet, cls).add_data_to_indexes(entities, indexes)
+
 
 class DelegateableBadgeCategoryFacet(SolrFacet):
     """Index all delegateable badge categories"""
@@ -743,6 +819,18 @@ class DelegateableAddedByBadgeFacet(SolrFacet):
                                 (badge.instance is entity.instance or
                                  badge.instance is None)]
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        delegateables = [e for e in entities
+                         if isinstance(e, model.Delegateable)]
+        load_relation(delegateables, 'creator', model.User, 'creator_id')
+        load_relation(delegateables, 'instance', model.Instance,
+                      'instance_id')
+        badges = [b for d in delegateables for b in d.creator.badges]
+        load_relation(badges, 'instance', model.Instance, 'instance_id')
+        super(DelegateableAddedByBadgeFacet, cls).add_data_to_indexes(
+            entities, indexes)
+
 
 class DelegateableTags(SolrFacet):
 
@@ -761,6 +849,13 @@ class DelegateableTags(SolrFacet):
             tags.extend([ref_attr_value(tag)] * count)
         data[cls.solr_field] = tags
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        load_collection([e for e in entities
+                         if isinstance(e, model.Delegateable)],
+                        'taggings', model.Tagging, 'delegateable_id')
+        super(DelegateableTags, cls).add_data_to_indexes(entities, indexes)
+
 
 class DelegateableMilestoneFacet(SolrFacet):
 
@@ -780,7 +875,23 @@ class DelegateableMilestoneFacet(SolrFacet):
             return []
 
 
-class CommentOrderIndexer(SolrIndexer):
+class CommentTallyIndexer(SolrIndexer):
+    '''
+    Base class for indexers that use the tally of the poll of
+    comments. The tallies of all comments are loaded with one query
+    by :meth:`add_data_to_indexes`.
+    '''
+
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        model.Poll.preload_tallies([e.poll for e in entities
+                                    if isinstance(e, model.Comment) and
+                                    e.poll is not None])
+        super(CommentTallyIndexer, cls).add_data_to_indexes(entities,
+                                                            indexes)
+
+
+class CommentOrderIndexer(CommentTallyIndexer):
 
     solr_field = 'order.comment.order'
 
@@ -790,7 +901,7 @@ class CommentOrderIndexer(SolrIndexer):
             data[cls.solr_field] = sorting.comment_order_key(entity)
 
 
-class CommentScoreIndexer(SolrIndexer):
+class CommentScoreIndexer(CommentTallyIndexer):
 
     solr_field = 'order.comment.score'
 
@@ -800,7 +911,7 @@ class CommentScoreIndexer(SolrIndexer):
             data[cls.solr_field] = entity.poll.tally.score
 
 
-class CommentScoreIndexer(SolrIndexer):
+class CommentScoreIndexer(CommentTallyIndexer):
 
     solr_field = 'order.comment.score'
 
@@ -820,6 +931,13 @@ class NormNumSelectionsIndexer(SolrIndexer):
             entity.function == model.Page.NORM):
             data[cls.solr_field] = len(entity.selections)
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        load_collection([e for e in entities if isinstance(e, model.Page)],
+                        '_selections', model.Selection, 'page_id')
+        super(NormNumSelectionsIndexer, cls).add_data_to_indexes(
+            entities, indexes)
+
 
 class NormNumVariantsIndexer(SolrIndexer):
 
@@ -831,6 +949,13 @@ class NormNumVariantsIndexer(SolrIndexer):
             entity.function == model.Page.NORM):
             data[cls.solr_field] = len(entity.selections)
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        load_collection([e for e in entities if isinstance(e, model.Page)],
+                        '_selections', model.Selection, 'page_id')
+        super(NormNumVariantsIndexer, cls).add_data_to_indexes(
+            entities, indexes)
+
 
 class ProposalNumCommentsIndexer(SolrIndexer):
 
@@ -841,6 +966,19 @@ class ProposalNumCommentsIndexer(SolrIndexer):
         if isinstance(entity, model.Delegateable):
             data[cls.solr_field] = len(entity.comments)
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        ids = [e.id for e in entities if isinstance(e, model.Delegateable)]
+        if not ids:
+            return
+        q = model.meta.Session.query(model.Comment.topic_id,
+                                     func.count(model.Comment.id))
+        q = q.filter(model.Comment.topic_id.in_(ids))
+        counts = dict(q.group_by(model.Comment.topic_id))
+        for (entity, data) in zip(entities, indexes):
+            if isinstance(entity, model.Delegateable):
+                data[cls.solr_field] = counts.get(entity.id, 0)
+
 
 class ProposalNewestCommentsIndexer(SolrIndexer):
 
@@ -854,8 +992,56 @@ class ProposalNewestCommentsIndexer(SolrIndexer):
                 value = time.mktime(commenttime.timetuple())
                 data[cls.solr_field] = value
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        ids = [e.description_id for e in entities
+               if isinstance(e, model.Proposal) and
+               e.description_id is not None]
+        if not ids:
+            return
+        Comment = model.Comment
+        q = model.meta.Session.query(Comment.topic_id, func.count(Comment.id))
+        q = q.filter(Comment.topic_id.in_(ids))
+        q = q.filter(or_(Comment.delete_time == None,
+                         Comment.delete_time > datetime.utcnow()))
+        counts = dict(q.group_by(Comment.topic_id))
+        if not counts:
+            return
+        q = model.meta.Session.query(Comment.topic_id,
+                                     func.max(model.Revision.create_time))
+        q = q.filter(model.Revision.comment_id == Comment.id)
+        q = q.filter(Comment.topic_id.in_(counts.keys()))
+        latest = dict(q.group_by(Comment.topic_id))
+        for (entity, data) in zip(entities, indexes):
+            if not isinstance(entity, model.Proposal):
+                continue
+            if counts.get(entity.description_id, 0) > 0:
+                # like find_latest_comment_time for comments without
+                # revisions.
+                commenttime = latest.get(entity.description_id)
+                if commenttime is None:
+                    commenttime = entity.description.create_time
+                value = time.mktime(commenttime.timetuple())
+                data[cls.solr_field] = value
+
 
-class ProposalSupportIndexer(SolrIndexer):
+class ProposalTallyIndexer(SolrIndexer):
+    '''
+    Base class for indexers that use the tally of the rate poll of
+    proposals. The tallies of all proposals are loaded with one query
+    by :meth:`add_data_to_indexes`.
+    '''
+
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        model.Poll.preload_tallies([e.rate_poll for e in entities
+                                    if isinstance(e, model.Proposal) and
+                                    e.rate_poll is not None])
+        super(ProposalTallyIndexer, cls).add_data_to_indexes(entities,
+                                                             indexes)
+
+
+class ProposalSupportIndexer(ProposalTallyIndexer):
 
     solr_field = 'order.proposal.support'
 
@@ -865,7 +1051,7 @@ class ProposalSupportIndexer(SolrIndexer):
             data[cls.solr_field] = entity.rate_poll.tally.score
 
 
-class ProposalVotesIndexer(SolrIndexer):
+class ProposalVotesIndexer(ProposalTallyIndexer):
 
     solr_field = 'order.proposal.votes'
 
@@ -876,7 +1062,7 @@ class ProposalVotesIndexer(SolrIndexer):
             data[cls.solr_field] = tally.num_for + tally.num_against
 
 
-class ProposalVotesYesIndexer(SolrIndexer):
+class ProposalVotesYesIndexer(ProposalTallyIndexer):
 
     solr_field = 'order.proposal.yesvotes'
 
@@ -887,7 +1073,7 @@ class ProposalVotesYesIndexer(SolrIndexer):
             data[cls.solr_field] = tally.num_for
 
 
-class ProposalVotesNoIndexer(SolrIndexer):
+class ProposalVotesNoIndexer(ProposalTallyIndexer):
 
     solr_field = 'order.proposal.novotes'
 
@@ -898,7 +1084,7 @@ class ProposalVotesNoIndexer(SolrIndexer):
             data[cls.solr_field] = tally.num_against
 
 
-class ProposalMixedIndexer(SolrIndexer):
+class ProposalMixedIndexer(ProposalTallyIndexer):
 
     solr_field = 'order.proposal.mixed'
 
@@ -927,6 +1113,23 @@ class InstanceUserActivityIndexer(SolrIndexer):
                 activity_sum = activity_sum + activity
             data[cls.solr_field()] = activity_sum
 
+    @classmethod
+    def add_data_to_indexes(cls, entities, indexes):
+        users = [e for e in entities if isinstance(e, model.User)]
+        if not users:
+            return
+        load_instances(users)
+        activities = user_activities(users)
+        for (entity, data) in zip(entities, indexes):
+            if not isinstance(entity, model.User):
+                continue
+            activity_sum = 0
+            for instance in entity.instances:
+                activity = activities.get((entity.id, instance.id), 0)
+                data[cls.solr_field(instance)] = activity
+                activity_sum = activity_sum + activity
+            data[cls.solr_field()] = activity_sum
+
 
 class SolrPager(PagerMixin):
     '''
@@ -968,12 +1171,10 @@ class SolrPager(PagerMixin):
             query = add_wildcard_query(query, field, string)
 
         # Add facets
-        counts_query = query
-        counts_query = counts_query.paginate(rows=0)
-        query.faceter.update(limit='65000')
-        counts_query.faceter.update(limit='65000')
+        filters = []
         for facet in self.facets:
-            query, counts_query = facet.add_to_queries(query, counts_query)
+            query = facet.add_to_query(query)
+            filters.extend(facet.filters())
 
         # Add pagination and sorting
         if enable_pages:
@@ -982,9 +1183,12 @@ class SolrPager(PagerMixin):
         if self.selected_sort is not None:
             query = query.sort_by(self.selected_sort)
 
-        # query solr and calculate values from it
-        self.response = query.execute()
-        self.counts_response = counts_query.execute()
+        # query solr and calculate values from it. The results and
+        # the facet counts with and without the selected facet values
+        # are returned by one request.
+        options = faceted_options(query, filters,
+                                  [facet.solr_field for facet in self.facets])
+        self.response = query.interface.search(**options)
         # if we are out of the page range do a permanent redirect
         # to the last page
         if (self.pages > 0) and (self.page > self.pages):
@@ -992,7 +1196,7 @@ class SolrPager(PagerMixin):
             redirect(new_url, code=301)
 
         for facet in self.facets:
-            facet.update(self.response, self.counts_response)
+            facet.update(self.response)
         self.items = self._items_from_response(self.response)
 
     def total_num_items(self):
@@ -1246,4 +1450,5 @@ def solr_proposal_pager(instance, wildcard_queries=None):
 
 INDEX_DATA_FINDERS = [v for v in globals().values() if
                       (isclass(v) and issubclass(v, SolrIndexer) and
-                      ((v is not SolrFacet) and (v is not SolrIndexer)))]
+                      (v not in (SolrFacet, SolrIndexer, CommentTallyIndexer,
+                                 ProposalTallyIndexer)))]
@@ -1,6 +1,8 @@
 import logging
-from amqp import has_queue, post_message, consume
-from update import handle_update, post_update, UPDATE_SERVICE
+from amqp import (has_queue, post_message, consume, consume_batches,
+                  batch_size)
+from update import (flush_listeners, handle_update, handle_updates,
+                    post_update, UPDATE_SERVICE)
 
 from adhocracy import model
 log = logging.getLogger(__name__)
@@ -9,6 +11,10 @@ MINUTE = 'minute'
 HOURLY = 'hourly'
 DAILY = 'daily'
 
+# messages received by the consumer and the work actually done for
+# them: listener calls for entity updates and other messages handled.
+STATS = dict(received=0, done=0)
+
 
 def minute():
     post_message(MINUTE, '')
@@ -22,6 +28,18 @@ def daily():
     post_message(DAILY, '')
 
 
+def post_after_commit(service, text):
+    '''
+    Post a message once the current transaction is committed, so the
+    consumer finds the data the message refers to. The message is
+    dropped if the transaction is rolled back.
+    '''
+    session = model.meta.Session()
+    if not hasattr(session, '_queue_messages'):
+        session._queue_messages = []
+    session._queue_messages.append((service, text))
+
+
 def update_solr_for_all_user():
     '''
     Reindex all users in solr. Mainly to update their
@@ -32,23 +50,47 @@ def update_solr_for_all_user():
         post_update(user, model.update.UPDATE)
 
 
+def coalesce(messages):
+    '''
+    Split a batch of messages into the bodies of the entity updates,
+    which are handled together (see
+    :func:`adhocracy.lib.queue.update.handle_updates`), and the other
+    messages without the repeated ones.
+
+    :returns: ``(update bodies, [(service, body), ...])``
+    '''
+    updates = []
+    seen = set()
+    others = []
+    for message in messages:
+        service = message.application_headers.get('service')
+        if service == UPDATE_SERVICE:
+            updates.append(message.body)
+        elif (service, message.body) not in seen:
+            seen.add((service, message.body))
+            others.append((service, message.body))
+    return (updates, others)
+
+
 # TODO: Inversion of control
 def dispatch():
     import adhocracy.model as model
     from adhocracy.lib import event
     from adhocracy.lib import broadcast
+    from adhocracy.lib import democracy
+    from adhocracy.lib.cache import util as cache_util
 
-    def _handle_message(message):
-        service = message.application_headers.get('service')
+    def _handle(service, body):
         if service == UPDATE_SERVICE:
-            handle_update(message.body)
+            handle_update(body)
         elif service == event.SERVICE:
-            event.handle_queue_message(message.body)
+            event.handle_queue_message(body)
         elif service == broadcast.REPORT_SERVICE:
-            broadcast.handle_abuse_message(message.body)
+            broadcast.handle_abuse_message(body)
+        elif service == democracy.SERVICE:
+            democracy.handle_queue_message(body)
         elif service == MINUTE:
             log.debug("Minutely housekeeping...")
-            from adhocracy.lib import democracy
             democracy.check_adoptions()
         elif service == HOURLY:
             log.debug("Hourly housekeeping...")
@@ -58,5 +100,41 @@ def dispatch():
             # housekeeping
             from adhocracy.lib import watchlist
             watchlist.clean_stale_watches()
+
+    def _handle_message(message):
+        STATS['received'] += 1
+        STATS['done'] += 1
+        cache_util.begin_request()
+        _handle(message.application_headers.get('service'), message.body)
+        flush_listeners()
         model.meta.Session.remove()
-    consume(_handle_message)
+        cache_util.end_request()
+
+    def _handle_batch(messages):
+        (updates, others) = coalesce(messages)
+        done = len(others)
+        cache_util.begin_request()
+        try:
+            if updates:
+                done += handle_updates(updates)
+                flush_listeners()
+                model.meta.Session.remove()
+            for (service, body) in others:
+                try:
+                    _handle(service, body)
+                except Exception, e:
+                    log.exception(e)
+                    model.meta.Session.rollback()
+                model.meta.Session.remove()
+        finally:
+            cache_util.end_request()
+        STATS['received'] += len(messages)
+        STATS['done'] += done
+        log.debug("%s messages, %s done (%s of %s in total)" % (
+            len(messages), done, STATS['done'], STATS['received']))
+
+    size = batch_size()
+    if size > 1:
+        consume_batches(_handle_batch, size)
+    else:
+        consume(_handle_message)
@@ -1,5 +1,5 @@
 import logging
-from time import time
+from time import sleep, time
 
 import amqplib.client_0_8 as amqp
 from pylons import config
@@ -7,6 +7,9 @@ from pylons import config
 log = logging.getLogger(__name__)
 post_channel = None
 
+# seconds to wait for new messages when the queue is empty
+IDLE_WAIT = 0.5
+
 
 def has_queue():
     return config.get('adhocracy.amqp.host') \
@@ -84,3 +87,34 @@ def consume(callback):
     while channel.callbacks:
         channel.wait()
     channel.close()
+
+
+def batch_size():
+    return int(config.get('adhocracy.amqp.batch_size', 1))
+
+
+def consume_batches(callback, size):
+    '''
+    Call *callback* with lists of up to *size* messages, as many as are
+    waiting in the queue. They are acknowledged when it returns.
+    '''
+    channel = create_channel(read=True)
+    while True:
+        messages = []
+        while len(messages) < size:
+            message = channel.basic_get(queue_name())
+            if message is None:
+                break
+            messages.append(message)
+        if not messages:
+            sleep(IDLE_WAIT)
+            continue
+        begin_time = time()
+        try:
+            callback(messages)
+        except Exception, ex:
+            log.exception(ex)
+        for message in messages:
+            channel.basic_ack(message.delivery_tag)
+        log.debug("Queue batch of %s messages -> %.2fms" % (
+            len(messages), (time() - begin_time) * 1000))
@@ -1,13 +1,21 @@
 import json
 from collections import defaultdict
+import logging
 
 from amqp import has_queue, post_message
+from adhocracy.model import meta
 from adhocracy.model.refs import to_ref, to_entity
 
+log = logging.getLogger(__name__)
+
 UPDATE_SERVICE = 'entity'
 
 LISTENERS = defaultdict(list)
 
+# called when the updates of a message or a batch of messages are
+# handled, e.g. to send what the listeners buffered.
+FLUSH_LISTENERS = []
+
 
 def post_update(entity, operation):
     if has_queue():
@@ -18,12 +26,47 @@ def post_update(entity, operation):
         post_message(UPDATE_SERVICE, json.dumps(data))
 
 
-def handle_update(message):
-    data = json.loads(message)
-    entity = to_entity(data.get('entity'))
-    for (clazz, operation), listeners in LISTENERS.items():
-        if operation != data.get('operation') \
+def _listeners(entity, operation):
+    for (clazz, operation_), listeners in LISTENERS.items():
+        if operation_ != operation \
             or not isinstance(entity, clazz):
             continue
         for listener in listeners:
-            listener(entity)
+            yield listener
+
+
+def handle_update(message):
+    handle_updates([message])
+
+
+def flush_listeners():
+    for listener in FLUSH_LISTENERS:
+        listener()
+
+
+def handle_updates(messages):
+    '''
+    Run the listeners for the updates in *messages*. Each listener runs
+    only once per entity, even if the entity was updated repeatedly or
+    the listener is registered for several operations.
+
+    :returns: the number of listener calls
+    '''
+    entities = {}
+    done = set()
+    for message in messages:
+        data = json.loads(message)
+        ref = data.get('entity')
+        if ref not in entities:
+            entities[ref] = to_entity(ref)
+        entity = entities[ref]
+        for listener in _listeners(entity, data.get('operation')):
+            if (ref, listener) in done:
+                continue
+            done.add((ref, listener))
+            try:
+                listener(entity)
+            except Exception, e:
+                log.exception(e)
+                meta.Session.rollback()
+    return len(done)
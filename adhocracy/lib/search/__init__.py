@@ -3,6 +3,8 @@
 import logging
 import time
 
+from sqlalchemy import func
+
 from adhocracy import model
 from adhocracy.lib.search import index, query
 
@@ -13,33 +15,100 @@ log = logging.getLogger(__name__)
 INDEXED_CLASSES = (model.Proposal, model.Instance, model.User,
                    model.Comment, model.Page, model.Milestone)
 
+# the number of ids in the ranges that are reindexed as one piece of work,
+# and the number of entities loaded and sent to solr at once.
+RANGE_SIZE = 10000
+CHUNK_SIZE = 1000
+
 
 def init_search():
     '''Register callback functions for commit hooks to add/update and
     delete documents in solr when model instances are commited.
     '''
-    from adhocracy.lib.queue.update import LISTENERS
+    from adhocracy.lib.queue.update import FLUSH_LISTENERS, LISTENERS
     from adhocracy.model.update import INSERT, UPDATE, DELETE
     for cls in INDEXED_CLASSES:
         LISTENERS[(cls, INSERT)].append(index.update)
         LISTENERS[(cls, UPDATE)].append(index.update)
         LISTENERS[(cls, DELETE)].append(index.delete)
+    if index.flush not in FLUSH_LISTENERS:
+        FLUSH_LISTENERS.append(index.flush)
+
+
+def _query(cls, instance_ids=None):
+    q = model.meta.Session.query(cls)
+    if instance_ids:
+        if cls is model.Instance:
+            q = q.filter(cls.id.in_(instance_ids))
+        elif hasattr(cls, 'instance_id'):
+            q = q.filter(cls.instance_id.in_(instance_ids))
+        elif hasattr(cls, 'topic_id'):
+            q = q.filter(cls.topic_id.in_(instance_ids))
+        elif cls is model.User:
+            q = q.filter(model.User.memberships.any(
+                model.Membership.instance_id.in_(instance_ids)))
+    return q
+
+
+def id_ranges(cls, instance_ids=None, size=RANGE_SIZE):
+    '''
+    Split the ids of the entities of *cls* into ranges of *size* ids,
+    to index them one after the other or in parallel. The ranges start
+    at multiples of *size*, so they stay the same when entities are
+    added or deleted, e.g. between an interrupted index run and its
+    resumption.
+
+    :returns: list of ``(low, high)``, both included
+    '''
+    q = _query(cls, instance_ids)
+    (low, high) = q.from_self(func.min(cls.id), func.max(cls.id)).one()
+    if low is None:
+        return []
+    return [(start, start + size - 1)
+            for start in range(low - low % size, high + 1, size)]
 
 
-def rebuild(classes, instances=None):
+def index_range(cls, low, high, instance_ids=None, buffer_=None):
+    '''
+    Index the entities of *cls* with ids from *low* to *high*. They are
+    loaded in chunks of :data:`CHUNK_SIZE` and dropped from the session
+    after each chunk is sent to solr, so memory use stays flat.
+
+    :returns: the number of indexed entities
+    '''
+    if buffer_ is None:
+        buffer_ = index.IndexBuffer(index.get_sunburnt_connection())
+    done = 0
+    last_id = low - 1
+    while True:
+        q = _query(cls, instance_ids)
+        q = q.filter(cls.id > last_id).filter(cls.id <= high)
+        entities = q.order_by(cls.id).limit(CHUNK_SIZE).all()
+        if not entities:
+            break
+        buffer_.update_all(entities)
+        done += len(entities)
+        last_id = entities[-1].id
+        buffer_.flush()
+        model.meta.Session.expunge_all()
+    return done
+
+
+def rebuild(classes, instances=None, skip=None, progress=None):
     '''
     (Re)Index all entities of the given *classes*.
+
+    *skip*
+       A set of ``(class name, low id)`` of the id ranges (see
+       :func:`id_ranges`) that were indexed already.
+    *progress*
+       A function called with the class, the id range and the number of
+       indexed entities after each range.
     '''
     log = logging.getLogger('index')
-    connection = index.get_sunburnt_connection()
+    buffer_ = index.IndexBuffer(index.get_sunburnt_connection())
     start = time.time()
-    batch_start = time.time()
     done = 0
-    other_classes = 0
-    docs = {index.ADD: [],
-            index.SKIP: [],
-            index.DELETE: [],
-            index.IGNORE: []}
     instance_ids = [i.id for i in instances] if instances else None
 
     for cls in classes:
@@ -48,57 +117,24 @@ def rebuild(classes, instances=None):
                      cls)
             continue
         log.info("Re-indexing %ss..." % cls.__name__)
-        q = model.meta.Session.query(cls)
-        if instances:
-            if isinstance(cls, model.Instance):
-                q = q.filter(cls.id.in_(instance_ids))
-            elif hasattr(cls, 'instance_id'):
-                q = q.filter(cls.instance_id.in_(instance_ids))
-            elif hasattr(cls, 'topic_id'):
-                q = q.filter(cls.topic_id.in_(instance_ids))
-            elif cls is model.User:
-                q = q.filter(model.User.memberships.any(
-                    model.Membership.instance_id.in_(instance_ids)))
-        for entity in q:
-            (action, data) = index.get_update_information(entity)
-            docs[action].append(data)
-            done = done + 1
-            if done % 1000 == 0:
-                docs = commit_docs(docs, connection, log, start, batch_start)
-                batch_start = time.time()
-        log.info("...re-indexed %s %ss" % (done - other_classes, cls.__name__))
-        other_classes = done
-    commit_docs(docs, connection, log, start, batch_start)
+        cls_done = 0
+        for (low, high) in id_ranges(cls, instance_ids):
+            if skip and (cls.__name__, low) in skip:
+                continue
+            count = index_range(cls, low, high, instance_ids, buffer_)
+            cls_done += count
+            if progress is not None:
+                progress(cls, low, high, count)
+            now = time.time()
+            log.info('...indexed %s %ss up to id %s, %0.1f docs/s' % (
+                cls_done, cls.__name__, high,
+                (done + cls_done) / max(now - start, 0.001)))
+        log.info("...re-indexed %s %ss" % (cls_done, cls.__name__))
+        done += cls_done
     now = time.time()
     log.info('total: %s updates, %0.1f s' % (done, now - start))
 
 
-def commit_docs(docs, connection, log, start, batch_start):
-    to_add = docs[index.ADD]
-    if len(to_add):
-        connection.add(to_add)
-
-    to_delete = docs[index.DELETE]
-    if len(to_delete):
-        connection.delete(to_delete)
-
-    msg = "...indexed: %s/%s" % (len(to_add), len(to_delete))
-
-    to_skip = docs[index.SKIP]
-    if len(to_skip):
-        connection.delete(to_skip)
-        msg += ', skipped: %s' % len(to_skip)
-
-    connection.commit()
-    now = time.time()
-    msg += ' in %0.1f s. Total time: %0.1f s' % (now - batch_start,
-                                                 now - start)
-    log.info(msg)
-    for key in docs:
-        docs[key] = []
-    return docs
-
-
 def rebuild_all():
     '''(re)index all indexable models in solr. This does not drop
     orphaned entries from the solr index.
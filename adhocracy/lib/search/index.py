@@ -1,5 +1,6 @@
 import hashlib
 import logging
+from threading import RLock, Timer
 
 from httplib2 import Http
 from pylons import tmpl_context as c
@@ -15,6 +16,8 @@ ADD = 'add'
 DELETE = 'delete'
 IGNORE = 'ignore'
 
+_buffer = None
+
 
 def get_sunburnt_connection():
     try:
@@ -43,7 +46,135 @@ def gen_id(entity):
     return hashlib.sha1(ref).hexdigest()
 
 
+class IndexBuffer(object):
+    '''
+    Collects the documents to add and the ids to delete, and sends them
+    to solr with one request each, followed by a single commit. That
+    happens on :meth:`flush`, when *size* documents are waiting, or
+    *max_age* seconds after the first of them was buffered, even if no
+    other change follows (if they are not `None`). Only the last change
+    of each document is sent. If sending fails, the documents stay in
+    the buffer for the next flush.
+    '''
+
+    def __init__(self, connection=None, size=None, max_age=None):
+        self.connection = connection
+        self.size = size
+        self.max_age = max_age
+        self.docs = {}
+        self._lock = RLock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def update(self, entity):
+        (action, data) = get_update_information(entity)
+        if action != IGNORE:
+            self._append(action, data)
+
+    def update_all(self, entities):
+        '''
+        Like :meth:`update` for a list of *entities* of one class,
+        see :func:`get_update_informations`.
+        '''
+        for (action, data) in get_update_informations(entities):
+            if action != IGNORE:
+                self._append(action, data)
+
+    def delete(self, entity):
+        self._append(DELETE, gen_id(entity))
+
+    def _append(self, action, data):
+        index_id = data['id'] if action == ADD else data
+        with self._lock:
+            self.docs[index_id] = (action, data)
+            if self.size is not None and len(self) >= self.size:
+                self.flush()
+            else:
+                self._start_timer()
+
+    def _start_timer(self):
+        if self.max_age is not None and self._timer is None:
+            self._timer = Timer(self.max_age, self._flush_timed)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_timed(self):
+        try:
+            self.flush()
+        except Exception, e:
+            log.exception(e)
+
+    def flush(self):
+        '''
+        :returns: the number of ``(added, deleted, skipped)`` documents
+        '''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            docs = {ADD: [], SKIP: [], DELETE: []}
+            for (action, data) in self.docs.values():
+                docs[action].append(data)
+            counts = (len(docs[ADD]), len(docs[DELETE]), len(docs[SKIP]))
+            if not self.docs:
+                return counts
+            (pending, self.docs) = (self.docs, {})
+            connection = self.connection or get_sunburnt_connection()
+            try:
+                if docs[ADD]:
+                    connection.add(docs[ADD])
+                if docs[DELETE] or docs[SKIP]:
+                    connection.delete(docs[DELETE] + docs[SKIP])
+                connection.commit()
+            except Exception:
+                # changes buffered since are newer.
+                pending.update(self.docs)
+                self.docs = pending
+                log.warn("Index update failed, %s documents are waiting "
+                         "for the next flush" % len(self.docs))
+                self._start_timer()
+                raise
+        return counts
+
+
+def get_buffer():
+    '''
+    The buffer the update listeners add to, if
+    ``adhocracy.solr.buffer_size`` is greater than 1. It is flushed
+    after each batch of queue messages or ``adhocracy.solr.buffer_age``
+    seconds after a change at the latest.
+    '''
+    global _buffer
+    if _buffer is None:
+        size = int(config.get('adhocracy.solr.buffer_size', 1))
+        if size <= 1:
+            return None
+        max_age = float(config.get('adhocracy.solr.buffer_age', 10))
+        _buffer = IndexBuffer(size=size, max_age=max_age)
+    return _buffer
+
+
+def flush():
+    buffer_ = get_buffer()
+    if buffer_ is None:
+        return
+    try:
+        buffer_.flush()
+    except Exception, e:
+        log.exception(e)
+
+
 def update(entity):
+    buffer_ = get_buffer()
+    if buffer_ is not None:
+        try:
+            buffer_.update(entity)
+        except Exception, e:
+            log.exception(e)
+        return
+
     (action, data) = get_update_information(entity)
     if action == IGNORE:
         return
@@ -71,7 +202,57 @@ def get_update_information(entity):
     return (ADD, data)
 
 
+def get_update_informations(entities):
+    '''
+    Like :func:`get_update_information` for a list of *entities* of
+    one class. Each indexer adds its data to all documents at once
+    (see :meth:`adhocracy.lib.pager.SolrIndexer.add_data_to_indexes`),
+    which takes a few queries instead of some for each entity.
+
+    Returns: a list of ``(action, data)`` tuples in the order of
+    *entities*
+    '''
+    from adhocracy.lib.pager import INDEX_DATA_FINDERS
+    informations = []
+    indexed = []
+    for entity in entities:
+        if not isinstance(entity, model.meta.Indexable):
+            informations.append((IGNORE, None))
+        elif hasattr(entity, 'is_deleted') and entity.is_deleted():
+            informations.append((DELETE, gen_id(entity)))
+        else:
+            informations.append(None)
+            indexed.append(entity)
+
+    # the indexers load their data first, so the documents are built
+    # from the loaded relations.
+    indexes = [dict() for entity in indexed]
+    for indexer in INDEX_DATA_FINDERS:
+        indexer.add_data_to_indexes(indexed, indexes)
+
+    documents = iter(zip(indexed, indexes))
+    for (i, information) in enumerate(informations):
+        if information is not None:
+            continue
+        (entity, data) = documents.next()
+        data.update(entity.to_index(indexers=False))
+        data['id'] = gen_id(entity)
+        if data.pop('skip', False):
+            informations[i] = (SKIP, data['id'])
+        else:
+            informations[i] = (ADD, data)
+    return informations
+
+
 def delete(entity):
+    buffer_ = get_buffer()
+    if buffer_ is not None:
+        try:
+            buffer_.delete(entity)
+        except Exception, e:
+            log.exception(e)
+        return
+
     connection = get_sunburnt_connection()
     try:
         index_id = gen_id(entity)
@@ -8,6 +8,10 @@ from pylons import tmpl_context as c
 
 log = logging.getLogger(__name__)
 
+# the tag of the filter queries for selected facet values, which are
+# excluded from the counts of all facet values.
+FACET_TAG = 'facets'
+
 
 def sunburnt_query(entity_type=None, instance=None, connection=None):
     '''
@@ -74,6 +78,54 @@ def add_wildcard_query(query, field, string, lower=True):
     return query
 
 
+def term_query(field, value):
+    '''
+    Return a lucene query for documents whose *field* is *value*.
+    '''
+    value = unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+    return u'%s:"%s"' % (field, value)
+
+
+def all_counts_key(field):
+    '''
+    The key of the facet counts for *field* that ignore the selected
+    facet values (see :func:`faceted_options`).
+    '''
+    return 'all.%s' % field
+
+
+def faceted_options(query, filters, fields):
+    '''
+    Return the options to execute the sunburnt *query* with, so one
+    request returns both the facet counts of the results and the
+    counts without the selected facet values.
+
+    *filters*
+       A list of ``(field, value)`` tuples of the selected facet values.
+       They are added as filter queries tagged with :data:`FACET_TAG`.
+    *fields*
+       The facet fields. The counts that exclude the tagged filters
+       are returned under the key :func:`all_counts_key` of the field.
+
+    Returns: A dict to pass to
+    :meth:`sunburnt.SolrInterface.search`
+    '''
+    options = query.options()
+    fq = options.get('fq', [])
+    if not isinstance(fq, list):
+        fq = [fq]
+    fq = fq + [u'{!tag=%s}%s' % (FACET_TAG, term_query(field, value))
+               for (field, value) in filters]
+    if fq:
+        options['fq'] = fq
+    if fields:
+        options['facet'] = True
+        options['facet.field'] = list(options.get('facet.field', [])) + [
+            u'{!ex=%s key=%s}%s' % (FACET_TAG, all_counts_key(field), field)
+            for field in fields]
+    return options
+
+
 def run(terms, instance=None, entity_type=None, **kwargs):
     q = sunburnt_query(entity_type=entity_type,
                        instance=instance)
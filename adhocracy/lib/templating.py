@@ -1,12 +1,15 @@
+import calendar
 import rfc822
 import hashlib
 
-from pylons import response, tmpl_context as c
+from paste.deploy.converters import asbool
+from pylons import config, request, response, tmpl_context as c
 from pylons.templating import render_mako, render_mako_def
 from pylons.controllers.util import etag_cache
 from pylons.controllers.util import abort, redirect
 
 from adhocracy import model
+from adhocracy.lib.cache import util as cache_util
 from adhocracy.lib.helpers import json_dumps
 
 import tiles
@@ -119,3 +122,39 @@ def render_png(io, mtime, content_type="image/png", cache_forever=False):
     response.content_length = len(io)
     response.pragma = None
     return io
+
+
+def entity_cache(entity, format='html'):
+    """
+    Answer conditional requests for the json representation of a
+    versioned *entity* (a delegateable, comment or poll) from its
+    ``version`` and ``modify_time`` alone: Send the ETag and
+    Last-Modified headers, or a 304 Not Modified response if the
+    client has the current version. Html pages also show navigation,
+    other pages and instance settings which the version does not
+    cover, so they are always rendered. Enabled with
+    ``adhocracy.cache.conditional_requests``.
+
+    The ETag covers the cache namespace, locale and user. The
+    modification time does not, so Last-Modified is only sent to and
+    If-Modified-Since only answered for anonymous users, and the time
+    of the code and templates counts as a modification as well.
+    """
+    if not asbool(config.get('adhocracy.cache.conditional_requests',
+                             False)):
+        return
+    if format != 'json':
+        return
+    key = '%s.%s.%s.%s.%s.%s.%s' % (cache_util.namespace(),
+                                    entity.__class__.__name__, entity.id,
+                                    entity.version, format, c.locale,
+                                    c.user.id if c.user else '')
+    if not c.user and entity.modify_time is not None:
+        modified = max(calendar.timegm(entity.modify_time.timetuple()),
+                       cache_util.code_time())
+        response.last_modified = rfc822.formatdate(timeval=modified)
+        since = request.if_modified_since
+        if ('If-None-Match' not in request.headers and since is not None
+                and modified <= calendar.timegm(since.utctimetuple())):
+            abort(304)
+    etag_cache(key=hashlib.sha1(key).hexdigest())
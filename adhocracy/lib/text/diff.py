@@ -143,7 +143,7 @@ def norm_texts_inline_compare(text_from, text_to):
     return _line_table(lines)
 
 
-@memoize('normtab_diff')
+@memoize('normtab_diff', single_flight=True)
 def norm_texts_table_compare(text_from, text_to):
     insertions = _diff_line_based(text_from.text,
                                   text_to.text,
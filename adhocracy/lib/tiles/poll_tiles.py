@@ -133,10 +133,10 @@ class PollTile(BaseTile):
 
     def delegates_result(self, result):
         agents = []
-        for agent in self.delegates:
-            decision = democracy.Decision(agent, self.poll)
+        for decision in democracy.Decision.bulk_for_users(self.delegates,
+                                                          self.poll):
             if decision.is_decided() and decision.result == result:
-                agents.append(agent)
+                agents.append(decision.user)
         return agents
 
     @property
@@ -43,9 +43,9 @@ class ProposalTile(DelegateableTile):
             principals = set(map(lambda d: d.principal,
                                  self.dnode.transitive_inbound()))
             if self.poll:
-                principals = filter(
-                    lambda p: not Decision(p, self.poll).is_self_decided(),
-                    principals)
+                principals = [d.user for d in
+                              Decision.bulk_for_users(principals, self.poll)
+                              if not d.is_self_decided()]
             self.__num_principals = len(principals)
         return self.__num_principals
 
@@ -1,9 +1,12 @@
 import logging
 from time import time
 
-from pylons import tmpl_context as c, config
+from paste.deploy.converters import asbool
+from pylons import app_globals, tmpl_context as c, config
 
 from adhocracy.lib.cache import memoize
+from adhocracy.lib.cache.util import (collect_memoized, is_collecting,
+                                      prefetch_memoized)
 
 log = logging.getLogger(__name__)
 
@@ -14,6 +17,10 @@ class BaseTile(object):
     '''
 
 
+def cache_tiles():
+    return asbool(config.get('adhocracy.cache_tiles', True))
+
+
 def render_tile(template_name, def_name, tile, cached=False, **kwargs):
     from adhocracy.lib import templating
     begin_time = time()
@@ -22,11 +29,14 @@ def render_tile(template_name, def_name, tile, cached=False, **kwargs):
         return templating.render_def(template_name, def_name,
                                      tile=tile, **kwargs)
     rendered = ""
-    if cached and config.get('adhocracy.cache_tiles', True):
+    if cached and cache_tiles():
         @memoize('tile_cache' + template_name + def_name, 84600 / 4)
         def _cached(**kwargs):
             return render()
         rendered = _cached(locale=c.locale, **kwargs)
+    elif is_collecting():
+        # only the memoized tiles are prefetched, see prefetch_tiles
+        return rendered
     else:
         rendered = render()
 
@@ -35,3 +45,20 @@ def render_tile(template_name, def_name, tile, cached=False, **kwargs):
             template_name, def_name, (time() - begin_time) * 1000))
 
     return rendered
+
+
+def prefetch_tiles(itemfunc, items):
+    '''
+    Look up the cached tiles that ``itemfunc(item)`` renders for all
+    *items* at once, and render the missing ones. Calling *itemfunc*
+    for the items later in the request does not ask memcached again.
+    '''
+    try:
+        cache = app_globals.cache
+    except TypeError:
+        cache = None
+    if not cache or not cache_tiles():
+        # nothing would be collected, only rendered twice
+        return
+    calls = collect_memoized(itemfunc, items)
+    prefetch_memoized(calls)
@@ -0,0 +1,60 @@
+from sqlalchemy import MetaData, Column, ForeignKey, Table
+from sqlalchemy import Integer
+
+metadata = MetaData()
+
+
+category_graph = Table(
+    'category_graph', metadata,
+    Column('parent_id', Integer, ForeignKey('delegateable.id')),
+    Column('child_id', Integer, ForeignKey('delegateable.id')))
+
+delegateable_closure_table = Table(
+    'delegateable_closure', metadata,
+    Column('ancestor_id', Integer,
+           ForeignKey('delegateable.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('descendant_id', Integer,
+           ForeignKey('delegateable.id', ondelete='CASCADE'),
+           primary_key=True, index=True),
+    Column('depth', Integer, nullable=False))
+
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+
+    #setup
+    Table('delegateable', metadata, autoload=True)
+
+    #add new table delegateable_closure
+    delegateable_closure_table.create()
+
+    # fill it from the category graph. The column names of the
+    # category graph are inverted: `parent_id` holds the child.
+    parents = {}
+    for row in migrate_engine.execute(category_graph.select()):
+        parents.setdefault(row.parent_id, []).append(row.child_id)
+
+    rows = []
+    for id_ in parents.keys():
+        depths = {}
+        level = [id_]
+        depth = 0
+        while level:
+            depth += 1
+            next_level = []
+            for node in level:
+                for parent in parents.get(node, []):
+                    if parent != id_ and parent not in depths:
+                        depths[parent] = depth
+                        next_level.append(parent)
+            level = next_level
+        rows.extend([dict(ancestor_id=ancestor, descendant_id=id_,
+                          depth=ancestor_depth)
+                     for (ancestor, ancestor_depth) in depths.items()])
+    if rows:
+        migrate_engine.execute(delegateable_closure_table.insert(), rows)
+
+
+def downgrade(migrate_engine):
+    raise NotImplementedError()
@@ -0,0 +1,50 @@
+from sqlalchemy import MetaData, Column, ForeignKey, Table
+from sqlalchemy import Boolean, DateTime, Integer, Unicode
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    #setup
+    Table('user', meta, autoload=True)
+    Table('delegateable', meta, autoload=True)
+
+    delegation_table = Table(
+        'delegation', meta,
+        Column('id', Integer, primary_key=True),
+        Column('agent_id', Integer, ForeignKey('user.id'), nullable=False),
+        Column('principal_id', Integer, ForeignKey('user.id'),
+               nullable=False),
+        Column('scope_id', Integer, ForeignKey('delegateable.id'),
+               nullable=False),
+        Column('create_time', DateTime),
+        Column('revoke_time', DateTime, nullable=True))
+
+    poll_table = Table(
+        'poll', meta,
+        Column('id', Integer, primary_key=True),
+        Column('begin_time', DateTime),
+        Column('end_time', DateTime, nullable=True),
+        Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+        Column('action', Unicode(50), nullable=False),
+        Column('subject', Unicode(254), nullable=False),
+        Column('scope_id', Integer, ForeignKey('delegateable.id'),
+               nullable=False))
+
+    replay_pending_column = Column('replay_pending', Boolean,
+                                   nullable=True, default=False)
+    replay_pending_column.create(delegation_table)
+    u = delegation_table.update(values={'replay_pending': False})
+    migrate_engine.execute(u)
+
+    vote_pending_column = Column('vote_pending', Boolean,
+                                 nullable=True, default=False)
+    vote_pending_column.create(poll_table)
+    u = poll_table.update(values={'vote_pending': False})
+    migrate_engine.execute(u)
+
+
+def downgrade(migrate_engine):
+    raise NotImplementedError()
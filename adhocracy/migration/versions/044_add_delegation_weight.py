@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from sqlalchemy import MetaData, Column, ForeignKey, Table
+from sqlalchemy import DateTime, Integer
+
+metadata = MetaData()
+
+
+delegation_weight_table = Table(
+    'delegation_weight', metadata,
+    Column('agent_id', Integer, ForeignKey('user.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('scope_id', Integer,
+           ForeignKey('delegateable.id', ondelete='CASCADE'),
+           primary_key=True, index=True),
+    Column('weight', Integer, nullable=False),
+    Column('computed_at', DateTime, default=datetime.utcnow))
+
+
+def upgrade(migrate_engine):
+    metadata.bind = migrate_engine
+
+    #setup
+    Table('user', metadata, autoload=True)
+    Table('delegateable', metadata, autoload=True)
+
+    #add new table delegation_weight. It is filled with
+    #`paster delegation_weights`.
+    delegation_weight_table.create()
+
+
+def downgrade(migrate_engine):
+    raise NotImplementedError()
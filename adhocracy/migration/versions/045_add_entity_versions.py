@@ -0,0 +1,29 @@
+from sqlalchemy import MetaData, Column, Table
+from sqlalchemy import DateTime, Integer
+
+meta = MetaData()
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+
+    #setup
+    delegateable_table = Table('delegateable', meta, autoload=True)
+    comment_table = Table('comment', meta, autoload=True)
+    poll_table = Table('poll', meta, autoload=True)
+
+    for (table, created) in [(delegateable_table, 'create_time'),
+                             (comment_table, 'create_time'),
+                             (poll_table, 'begin_time')]:
+        version_column = Column('version', Integer, nullable=True,
+                                default=1)
+        version_column.create(table)
+        modify_time_column = Column('modify_time', DateTime, nullable=True)
+        modify_time_column.create(table)
+        u = table.update(values={'version': 1,
+                                 'modify_time': table.c[created]})
+        migrate_engine.execute(u)
+
+
+def downgrade(migrate_engine):
+    raise NotImplementedError()
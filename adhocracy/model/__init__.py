@@ -26,8 +26,11 @@ from adhocracy.model.group import Group, group_table
 from adhocracy.model.permission import (Permission, group_permission_table,
                                         permission_table)
 from adhocracy.model.delegateable import (Delegateable, delegateable_table,
-                                          category_graph)
+                                          category_graph,
+                                          delegateable_closure_table)
 from adhocracy.model.delegation import Delegation, delegation_table
+from adhocracy.model.delegation_weight import (DelegationWeight,
+                                               delegation_weight_table)
 from adhocracy.model.proposal import Proposal, proposal_table
 from adhocracy.model.poll import Poll, poll_table
 from adhocracy.model.vote import Vote, vote_table
@@ -297,6 +300,17 @@ mapper(Delegation, delegation_table, properties={
     })
 
 
+mapper(DelegationWeight, delegation_weight_table, properties={
+    'agent': relation(
+            User, lazy=True,
+            primaryjoin=delegation_weight_table.c.agent_id == user_table.c.id),
+    'scope': relation(
+            Delegateable, lazy=True,
+            primaryjoin=(delegation_weight_table.c.scope_id ==
+                         delegateable_table.c.id))
+    })
+
+
 mapper(Poll, poll_table, properties={
     'user': relation(
             User,
@@ -427,6 +441,7 @@ def init_model(engine):
         return
     sm = orm.sessionmaker(autoflush=True,
                           bind=engine,
+                          query_cls=meta.ListeningQuery,
                           extension=SessionModificationExtension())
     meta.engine = engine
     meta.Session = orm.scoped_session(sm)
@@ -20,7 +20,9 @@ comment_table = Table('comment', meta.data,
     Column('wiki', Boolean, default=False),
     Column('reply_id', Integer, ForeignKey('comment.id'), nullable=True),
     Column('poll_id', Integer, ForeignKey('poll.id'), nullable=True),
-    Column('variant', Unicode(255), nullable=True)
+    Column('variant', Unicode(255), nullable=True),
+    Column('version', Integer, default=1, nullable=True),
+    Column('modify_time', DateTime, default=datetime.utcnow, nullable=True)
     )
 
 
@@ -150,8 +152,8 @@ class Comment(meta.Indexable):
         d['revisions'] = map(lambda r: r.id, self.revisions)
         return d
 
-    def to_index(self):
-        index = super(Comment, self).to_index()
+    def to_index(self, indexers=True):
+        index = super(Comment, self).to_index(indexers)
         if self.latest is not None:
             index.update(dict(
                 tag=[],
@@ -8,10 +8,12 @@ SQLAlchemy's `joint table inheritance` is used.
 """
 
 from datetime import datetime
+from itertools import chain
 import logging
 
 from sqlalchemy import Table, Column, ForeignKey, or_
 from sqlalchemy import DateTime, Integer, String, Unicode
+from sqlalchemy.orm import attributes
 
 import meta
 import instance_filter as ifilter
@@ -26,6 +28,19 @@ category_graph = Table('category_graph', meta.data,
     )
 
 
+# Transitive closure of the category tree: one row for each delegateable
+# and each of its (transitive) parents. Maintained by `update_closure`.
+delegateable_closure_table = Table('delegateable_closure', meta.data,
+    Column('ancestor_id', Integer,
+           ForeignKey('delegateable.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('descendant_id', Integer,
+           ForeignKey('delegateable.id', ondelete='CASCADE'),
+           primary_key=True, index=True),
+    Column('depth', Integer, nullable=False)
+    )
+
+
 delegateable_table = Table('delegateable', meta.data,
     Column('id', Integer, primary_key=True),
     Column('label', Unicode(255), nullable=False),
@@ -36,7 +51,9 @@ delegateable_table = Table('delegateable', meta.data,
     Column('delete_time', DateTime, nullable=True),
     Column('milestone_id', Integer, ForeignKey('milestone.id'), nullable=True),
     Column('creator_id', Integer, ForeignKey('user.id'), nullable=False),
-    Column('instance_id', Integer, ForeignKey('instance.id'), nullable=False)
+    Column('instance_id', Integer, ForeignKey('instance.id'), nullable=False),
+    Column('version', Integer, default=1, nullable=True),
+    Column('modify_time', DateTime, default=datetime.utcnow, nullable=True)
     )
 
 
@@ -53,14 +70,32 @@ class Delegateable(meta.Indexable):
     def __repr__(self):
         return u"<Delegateable(%d,%s)>" % (self.id, self.instance.key)
 
+    def descendant_ids(self):
+        '''
+        The ids of all (transitive) children of the delegateable. They
+        are looked up in the closure table once and cached until the
+        category tree changes.
+        '''
+        if getattr(self, '_descendant_ids', None) is None:
+            closure = delegateable_closure_table
+            q = meta.Session.query(closure.c.descendant_id)
+            q = q.filter(closure.c.ancestor_id == self.id)
+            self._descendant_ids = frozenset([id_ for (id_,) in q])
+        return self._descendant_ids
+
+    def ancestors(self):
+        '''
+        All (transitive) parents of the delegateable, nearest first.
+        '''
+        closure = delegateable_closure_table
+        q = meta.Session.query(Delegateable)
+        q = q.filter(Delegateable.id == closure.c.ancestor_id)
+        q = q.filter(closure.c.descendant_id == self.id)
+        q = q.order_by(closure.c.depth)
+        return q.all()
+
     def is_super(self, delegateable):
-        if delegateable in self.children:
-            return True
-        for child in self.children:
-            r = child.is_super(delegateable)
-            if r:
-                return True
-        return False
+        return delegateable.id in self.descendant_ids()
 
     def is_sub(self, delegateable):
         return delegateable.is_super(self)
@@ -231,8 +266,8 @@ class Delegateable(meta.Indexable):
                     creator=self.creator.user_name,
                     create_time=self.create_time)
 
-    def to_index(self):
-        index = super(Delegateable, self).to_index()
+    def to_index(self, indexers=True):
+        index = super(Delegateable, self).to_index(indexers)
         index.update(dict(
             instance=self.instance.key,
             title=self.title,
@@ -240,3 +275,82 @@ class Delegateable(meta.Indexable):
             user=self.creator.user_name
             ))
         return index
+
+
+def changed_tree_nodes(session):
+    '''
+    Return the delegateables whose parents in the category tree change
+    with the next flush of *session*. Collections that are not loaded
+    are not touched.
+    '''
+    nodes = set()
+    for obj in session.deleted:
+        if isinstance(obj, Delegateable):
+            nodes.add(obj)
+    for obj in chain(session.new, session.dirty):
+        if not isinstance(obj, Delegateable):
+            continue
+        history = attributes.get_history(
+            obj, 'parents', passive=attributes.PASSIVE_NO_INITIALIZE)
+        if history.added or history.deleted:
+            nodes.add(obj)
+        history = attributes.get_history(
+            obj, 'children', passive=attributes.PASSIVE_NO_INITIALIZE)
+        nodes.update(history.added or ())
+        nodes.update(history.deleted or ())
+    return nodes
+
+
+def update_closure(session, delegateable_ids):
+    '''
+    Recompute the rows of the closure table for the given delegateables
+    and all of their descendants from the category graph. This has to
+    run after the category graph was flushed.
+    '''
+    closure = delegateable_closure_table
+    ids = set(delegateable_ids)
+    if not ids:
+        return
+    q = closure.select(closure.c.ancestor_id.in_(ids))
+    ids.update([row.descendant_id for row in session.execute(q)])
+
+    # Load the edges upwards, one query per level of the tree.
+    # Column names of the category graph are inverted with regard to
+    # the ``parents`` relation (see ``adhocracy.model``).
+    parents = {}
+    seen = set(ids)
+    level = ids
+    while level:
+        q = category_graph.select(category_graph.c.parent_id.in_(level))
+        level = set()
+        for row in session.execute(q):
+            parents.setdefault(row.parent_id, []).append(row.child_id)
+            if row.child_id not in seen:
+                level.add(row.child_id)
+        seen.update(level)
+
+    rows = []
+    for id_ in ids:
+        depths = {}
+        level = [id_]
+        depth = 0
+        while level:
+            depth += 1
+            next_level = []
+            for node in level:
+                for parent in parents.get(node, []):
+                    if parent != id_ and parent not in depths:
+                        depths[parent] = depth
+                        next_level.append(parent)
+            level = next_level
+        rows.extend([dict(ancestor_id=ancestor, descendant_id=id_,
+                          depth=ancestor_depth)
+                     for (ancestor, ancestor_depth) in depths.items()])
+
+    session.execute(closure.delete(closure.c.descendant_id.in_(ids)))
+    if rows:
+        session.execute(closure.insert(), rows)
+
+    for obj in session.identity_map.values():
+        if isinstance(obj, Delegateable):
+            obj._descendant_ids = None
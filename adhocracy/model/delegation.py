@@ -2,7 +2,7 @@ from datetime import datetime
 import logging
 
 from sqlalchemy import Table, Column,  ForeignKey, or_
-from sqlalchemy import DateTime, Integer
+from sqlalchemy import Boolean, DateTime, Integer
 
 import meta
 import instance_filter as ifilter
@@ -17,7 +17,8 @@ delegation_table = Table('delegation', meta.data,
     Column('principal_id', Integer, ForeignKey('user.id'), nullable=False),
     Column('scope_id', Integer, ForeignKey('delegateable.id'), nullable=False),
     Column('create_time', DateTime, default=datetime.utcnow),
-    Column('revoke_time', DateTime, default=None, nullable=True)
+    Column('revoke_time', DateTime, default=None, nullable=True),
+    Column('replay_pending', Boolean, default=False, nullable=True)
     )
 
 
@@ -106,13 +107,20 @@ class Delegation(object):
 
     @classmethod
     def create(cls, principal, agent, scope, replay=True):
-        from adhocracy.lib.democracy import Decision
+        '''
+        Create a new delegation. With *replay*, the principal takes
+        over the agent's past decisions within the scope. This is done
+        by a queued job if there is a queue, and ``replay_pending`` is
+        set until it is done.
+        '''
+        from adhocracy.lib import democracy
         delegation = Delegation(principal, agent, scope)
         meta.Session.add(delegation)
         meta.Session.flush()
         if replay:
             log.debug("Replaying the vote for Delegation: %s" % delegation)
-            Decision.replay_decisions(delegation)
+            delegation.replay_pending = True
+            democracy.post_job(democracy.REPLAY_DELEGATION, delegation)
         return delegation
 
     def revoke(self, revoke_time=None):
@@ -0,0 +1,54 @@
+from datetime import datetime
+import logging
+
+from sqlalchemy import Table, Column, Integer, ForeignKey, DateTime
+
+import meta
+
+
+log = logging.getLogger(__name__)
+
+
+delegation_weight_table = Table('delegation_weight', meta.data,
+    Column('agent_id', Integer, ForeignKey('user.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('scope_id', Integer,
+           ForeignKey('delegateable.id', ondelete='CASCADE'),
+           primary_key=True, index=True),
+    Column('weight', Integer, nullable=False),
+    Column('computed_at', DateTime, default=datetime.utcnow)
+    )
+
+
+class DelegationWeight(object):
+    '''
+    The number of delegations an agent holds within a scope, as
+    counted by :meth:`DelegationNode.number_of_delegations`. Kept up
+    to date by the queue (see
+    :func:`adhocracy.lib.democracy.update_delegation_weights`).
+    '''
+
+    def __init__(self, agent, scope, weight):
+        self.agent = agent
+        self.scope = scope
+        self.weight = weight
+
+    @classmethod
+    def find(cls, agent, scope):
+        q = meta.Session.query(DelegationWeight)
+        q = q.filter(DelegationWeight.agent_id == agent.id)
+        q = q.filter(DelegationWeight.scope_id == scope.id)
+        return q.first()
+
+    @classmethod
+    def all_in_scopes(cls, scope_ids):
+        if not scope_ids:
+            return []
+        q = meta.Session.query(DelegationWeight)
+        q = q.filter(DelegationWeight.scope_id.in_(scope_ids))
+        return q.all()
+
+    def __repr__(self):
+        return "<DelegationWeight(%s,%s,%s)>" % (self.agent_id,
+                                                 self.scope_id,
+                                                 self.weight)
@@ -239,8 +239,8 @@ class Instance(meta.Indexable):
             d['description'] = self.description
         return d
 
-    def to_index(self):
-        index = super(Instance, self).to_index()
+    def to_index(self, indexers=True):
+        index = super(Instance, self).to_index(indexers)
         index.update(dict(
             instance=self.key,
             title=self.label,
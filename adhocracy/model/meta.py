@@ -1,6 +1,7 @@
 """SQLAlchemy Metadata and Session object"""
 
 from sqlalchemy import MetaData
+from sqlalchemy.orm import Query
 
 __all__ = ['Session', 'data', 'engine']
 
@@ -15,10 +16,41 @@ Session = None
 # names, you'll need a metadata for each database
 data = MetaData()
 
+# Callables that are called with each entity loaded by a query, e.g. to
+# track the entities a cached value depends on.
+LOAD_LISTENERS = []
+
+
+class ListeningQuery(Query):
+    """
+    A query that reports the entities it loads to the
+    :data:`LOAD_LISTENERS`.
+    """
+
+    def __iter__(self):
+        results = super(ListeningQuery, self).__iter__()
+        if not LOAD_LISTENERS:
+            return results
+        return self._notify(results)
+
+    def _notify(self, results):
+        for row in results:
+            for obj in (row if isinstance(row, tuple) else (row,)):
+                if hasattr(obj, '_sa_instance_state'):
+                    for listener in LOAD_LISTENERS:
+                        listener(obj)
+            yield row
+
 
 class Indexable(object):
 
-    def to_index(self):
+    def to_index(self, indexers=True):
+        '''
+        Return the document that is indexed in solr for this entity.
+        Without *indexers*, the data of the
+        :class:`adhocracy.lib.pager.SolrIndexer` s is left out (see
+        :func:`adhocracy.lib.search.index.get_update_informations`).
+        '''
         import refs
         from adhocracy.lib.pager import INDEX_DATA_FINDERS
         index = dict(
@@ -28,7 +60,8 @@ class Indexable(object):
             index['skip'] = self.is_deleted()
         if hasattr(self, 'create_time'):
             index['create_time'] = self.create_time.strftime("%s")
-        for indexer in INDEX_DATA_FINDERS:
-            indexer.add_data_to_index(self, index)
+        if indexers:
+            for indexer in INDEX_DATA_FINDERS:
+                indexer.add_data_to_index(self, index)
 
         return index
@@ -106,8 +106,8 @@ class Milestone(object):
                  instance=self.instance.key)
         return d
 
-    def to_index(self):
-        index = super(Milestone, self).to_index()
+    def to_index(self, indexers=True):
+        index = super(Milestone, self).to_index(indexers)
         index.update(dict(
             instance=self.instance.key,
             title=self.title,
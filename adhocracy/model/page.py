@@ -134,7 +134,9 @@ class Page(Delegateable):
         return Tally.combine_polls(polls)
 
     def variant_tallies(self):
-        return [self.variant_tally(v) for v in self.variants]
+        from tally import Tally
+        return Tally.combine_poll_groups([self.variant_polls(v) for v in
+                                          self.variants])
 
     @property
     def proposal(self):
@@ -333,8 +335,8 @@ class Page(Delegateable):
             d['parent'] = self.parent.id
         return d
 
-    def to_index(self):
-        index = super(Page, self).to_index()
+    def to_index(self, indexers=True):
+        index = super(Page, self).to_index(indexers)
         if self.function == self.DESCRIPTION:
             index['skip'] = True
             return index
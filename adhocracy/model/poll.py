@@ -1,8 +1,8 @@
 import logging
 from datetime import datetime
 
-from sqlalchemy import Table, Column, ForeignKey, or_
-from sqlalchemy import DateTime, Integer, Unicode
+from sqlalchemy import Table, Column, ForeignKey, and_, func, or_
+from sqlalchemy import Boolean, DateTime, Integer, Unicode
 from sqlalchemy.orm import reconstructor, eagerload
 
 import meta
@@ -18,7 +18,11 @@ poll_table = Table('poll', meta.data,
     Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
     Column('action', Unicode(50), nullable=False),
     Column('subject', Unicode(254), nullable=False),
-    Column('scope_id', Integer, ForeignKey('delegateable.id'), nullable=False)
+    Column('scope_id', Integer, ForeignKey('delegateable.id'),
+           nullable=False),
+    Column('vote_pending', Boolean, default=False, nullable=True),
+    Column('version', Integer, default=1, nullable=True),
+    Column('modify_time', DateTime, default=datetime.utcnow, nullable=True)
     )
 
 
@@ -96,6 +100,28 @@ class Poll(object):
                 self._tally = Tally.create_from_poll(self)
         return self._tally
 
+    @classmethod
+    def preload_tallies(cls, polls):
+        '''
+        Load the current :attr:`tally` of all *polls* with one query.
+        Polls without tallies are left alone, their tally is created
+        when it is used.
+        '''
+        from tally import Tally
+        polls = dict((poll.id, poll) for poll in polls
+                     if poll._tally is None)
+        if not polls:
+            return
+        latest = meta.Session.query(
+            Tally.poll_id, func.max(Tally.create_time).label('create_time'))
+        latest = latest.filter(Tally.poll_id.in_(polls.keys()))
+        latest = latest.group_by(Tally.poll_id).subquery()
+        q = meta.Session.query(Tally)
+        q = q.join((latest, and_(Tally.poll_id == latest.c.poll_id,
+                                 Tally.create_time == latest.c.create_time)))
+        for tally in q:
+            polls[tally.poll_id]._tally = tally
+
     def can_end(self):
         if self.has_ended():
             return False
@@ -145,15 +171,19 @@ class Poll(object):
 
     @classmethod
     def create(cls, scope, user, action, subject=None, with_vote=False):
+        '''
+        Create a new poll. With *with_vote*, the creator votes for the
+        poll. The vote is cast by a queued job if there is a queue,
+        and ``vote_pending`` is set until it is done.
+        '''
         from tally import Tally
-        from vote import Vote
-        from adhocracy.lib.democracy import Decision
+        from adhocracy.lib import democracy
         poll = Poll(scope, user, action, subject=subject)
         meta.Session.add(poll)
         meta.Session.flush()
         if with_vote:
-            decision = Decision(user, poll)
-            decision.make(Vote.YES)
+            poll.vote_pending = True
+            democracy.post_job(democracy.CREATOR_VOTE, poll)
         Tally.create_from_poll(poll)
         meta.Session.flush()
         return poll
@@ -191,11 +221,7 @@ class Poll(object):
 
     @classmethod
     def within_scope(cls, scope):
-        def _crawl(scope):
-            l = [scope]
-            [l.extend(_crawl(c)) for c in scope.children]
-            return l
-        scope_ids = [s.id for s in _crawl(scope)]
+        scope_ids = [scope.id] + list(scope.descendant_ids())
         q = meta.Session.query(Poll)
         q = q.filter(Poll.scope_id.in_(scope_ids))
         q = q.filter(or_(Poll.end_time == None,
@@ -217,8 +217,8 @@ class Proposal(Delegateable):
                 c.proposal_pos[self.id] = c.user.any_position_on_proposal(self)
             return c.proposal_pos[self.id]
 
-    def to_index(self):
-        index = super(Proposal, self).to_index()
+    def to_index(self, indexers=True):
+        index = super(Proposal, self).to_index(indexers)
         if self.description is not None and self.description.head is not None:
             index.update(dict(
                 body=self.description.head.text,
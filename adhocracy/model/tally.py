@@ -1,6 +1,5 @@
 from datetime import datetime
 import logging
-from sets import Set
 
 from sqlalchemy import Table, Column, Integer, ForeignKey, DateTime
 
@@ -54,22 +53,95 @@ class Tally(object):
     score = property(_get_score)
 
     @classmethod
-    def create_from_vote(cls, vote):
+    def create_from_vote(cls, vote, bulk=False, incremental=False):
+        '''
+        Create the tally of the vote's poll as of the time the vote
+        was cast.
+
+        *incremental* (default: `False`)
+            Derive the tally from the previous tally of the poll (see
+            :meth:`incremental_counts`) if possible instead of counting
+            all decisions.
+        '''
         tally = cls.find_by_vote(vote)
         if tally is None:
-            tally = Tally.create_from_poll(vote.poll, vote.create_time)
+            counts = None
+            if incremental:
+                counts = cls.incremental_counts(vote)
+            if counts is None:
+                tally = Tally.create_from_poll(vote.poll, vote.create_time,
+                                               bulk=bulk)
+            else:
+                tally = Tally(vote.poll, *counts)
+                tally.create_time = vote.create_time
+                meta.Session.add(tally)
             tally.vote = vote
             meta.Session.flush()
         return tally
 
     @classmethod
-    def create_from_poll(cls, poll, at_time=None):
+    def incremental_counts(cls, vote):
+        '''
+        Compute the numbers of a tally after *vote* from the previous
+        tally of the poll and the change the vote made to the
+        decision of the voter. Votes propagated to principals are
+        votes on their own, so only the voter is affected.
+
+        Returns a `(num_for, num_against, num_abstain)` tuple or `None`
+        if there is no previous tally or if other votes were cast since
+        the previous tally.
+        '''
+        from adhocracy.lib.democracy import Decision
+        from vote import Vote
+        q = meta.Session.query(Tally)
+        q = q.filter(Tally.poll_id == vote.poll_id)
+        q = q.filter(Tally.create_time <= vote.create_time)
+        q = q.order_by(Tally.create_time.desc())
+        q = q.order_by(Tally.id.desc())
+        previous = q.limit(1).first()
+        if previous is None:
+            return None
+
+        q = meta.Session.query(Vote)
+        q = q.filter(Vote.poll_id == vote.poll_id)
+        q = q.filter(Vote.id != vote.id)
+        q = q.filter(Vote.create_time > previous.create_time)
+        q = q.filter(Vote.create_time <= vote.create_time)
+        if q.count() > 0:
+            return None
+
+        counts = {Vote.YES: previous.num_for,
+                  Vote.NO: previous.num_against,
+                  Vote.ABSTAIN: previous.num_abstain}
+        after = Decision(vote.user, vote.poll, at_time=vote.create_time)
+        before = after.without_vote(vote)
+        if before.is_decided():
+            counts[before.result] -= 1
+        if after.is_decided():
+            counts[after.result] += 1
+        return (counts[Vote.YES], counts[Vote.NO], counts[Vote.ABSTAIN])
+
+    @classmethod
+    def create_from_poll(cls, poll, at_time=None, bulk=False):
+        '''
+        Count the decisions made on *poll* and store them as a new
+        tally.
+
+        *bulk* (default: `False`)
+            Load the votes of all voters with a single query
+            (see :meth:`adhocracy.lib.democracy.Decision.bulk_for_poll`)
+            instead of one query per voter. The result is the same.
+        '''
         from adhocracy.lib.democracy import Decision
         from vote import Vote
         if at_time is None:
             at_time = datetime.utcnow()
+        if bulk:
+            decisions = Decision.bulk_for_poll(poll, at_time=at_time)
+        else:
+            decisions = Decision.for_poll(poll, at_time=at_time)
         results = {}
-        for decision in Decision.for_poll(poll, at_time=at_time):
+        for decision in decisions:
             if not decision.is_decided():
                 continue
             results[decision.result] = results.get(decision.result, 0) + 1
@@ -84,31 +156,59 @@ class Tally(object):
 
     @classmethod
     def combine_polls(cls, polls, at_time=None):
+        return cls.combine_poll_groups([polls], at_time=at_time)[0]
+
+    @classmethod
+    def combine_poll_groups(cls, poll_groups, at_time=None):
+        '''
+        Combine the decisions of each group of polls into a tally. Only
+        non-contradictory decisions are counted, e.g. a user who voted
+        yes on one poll of the group and no on another is not counted
+        at all.
+
+        The votes of all polls are loaded with one query. Voters are
+        numbered and the voters of each orientation are kept as bitsets
+        (`long` integers), so a group is combined with a few bitwise
+        operations.
+
+        Returns a list of unsaved tallies, one for each group.
+        '''
         from adhocracy.lib.democracy import Decision
         from vote import Vote
         if at_time is None:
             at_time = datetime.utcnow()
-        voters = {Vote.YES: Set(),
-                  Vote.NO: Set(),
-                  Vote.ABSTAIN: Set()}
+        polls = [poll for group in poll_groups for poll in group]
+        decisions = Decision.bulk_for_polls(polls, at_time=at_time)
 
-        for poll in polls:
-            for decision in Decision.for_poll(poll, at_time=at_time):
-                if not decision.is_decided():
-                    continue
+        bits = {}
+        voters = {}
+        for poll_id, poll_decisions in decisions.items():
+            voters[poll_id] = {Vote.YES: 0L, Vote.NO: 0L, Vote.ABSTAIN: 0L}
+            for decision in poll_decisions:
                 result = decision.result
-                if result is not None:
-                    voters_ = voters.get(result)
-                    voters_.add(decision.user)
-
-        # Do the math. We count only non-contradictory votes.
-        yes = voters[Vote.YES]
-        no = voters[Vote.NO]
-        abstain = voters[Vote.ABSTAIN]
-        return Tally(None,
-                     len(yes - no - abstain),
-                     len(no - yes - abstain),
-                     len(abstain - yes - no))
+                if result is None:
+                    continue
+                bit = bits.setdefault(decision.user.id, len(bits))
+                voters[poll_id][result] |= 1L << bit
+
+        def count(bitset):
+            return bin(bitset).count('1')
+
+        tallies = []
+        for group in poll_groups:
+            yes, no, abstain = 0L, 0L, 0L
+            for poll in group:
+                if poll.id not in voters:
+                    continue
+                yes |= voters[poll.id][Vote.YES]
+                no |= voters[poll.id][Vote.NO]
+                abstain |= voters[poll.id][Vote.ABSTAIN]
+            # Do the math. We count only non-contradictory votes.
+            tallies.append(Tally(None,
+                                 count(yes & ~no & ~abstain),
+                                 count(no & ~yes & ~abstain),
+                                 count(abstain & ~yes & ~no)))
+        return tallies
 
     @classmethod
     def find_by_vote(cls, vote):
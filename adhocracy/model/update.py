@@ -1,3 +1,4 @@
+from datetime import datetime
 import logging
 from sqlalchemy.orm import SessionExtension
 
@@ -10,6 +11,57 @@ UPDATE = "update"
 REGISTRY = {}
 
 
+def _shown_by(entity):
+    '''
+    The entities whose pages show *entity*.
+    '''
+    from adhocracy import model
+    if isinstance(entity, (model.Tally, model.Vote)):
+        return [entity.poll]
+    if isinstance(entity, model.Poll):
+        return [entity.scope]
+    if isinstance(entity, model.Revision):
+        return [entity.comment]
+    if isinstance(entity, model.Comment):
+        return [entity.topic]
+    if isinstance(entity, model.Text):
+        return [entity.page]
+    if isinstance(entity, model.Selection):
+        return [entity.proposal, entity.page]
+    if isinstance(entity, model.Tagging):
+        return [entity.delegateable]
+    if isinstance(entity, model.Page) and entity._proposal:
+        return [entity.proposal]
+    return []
+
+
+def bump_versions(session):
+    '''
+    Increase the ``version`` and set the ``modify_time`` of the changed
+    delegateables, comments and polls, and of those that show changed
+    entities, e.g. the proposal of a new comment or of a vote.
+    '''
+    from adhocracy import model
+    versioned = (model.Delegateable, model.Comment, model.Poll)
+    changed = list(session.new) + list(session.deleted)
+    changed += [e for e in session.dirty if session.is_modified(e)]
+    owners = {}
+    while changed:
+        entity = changed.pop()
+        if entity is None or id(entity) in owners:
+            continue
+        owners[id(entity)] = entity
+        changed.extend(_shown_by(entity))
+    now = datetime.utcnow()
+    for entity in owners.values():
+        if (not isinstance(entity, versioned) or entity in session.new or
+                entity in session.deleted):
+            continue
+        # counted up in the database, so concurrent changes both count.
+        entity.version = entity.__class__.version + 1
+        entity.modify_time = now
+
+
 class SessionModificationExtension(SessionExtension):
     '''
     A sqlalchemy SessionExtension to do work before commit, like
@@ -17,6 +69,7 @@ class SessionModificationExtension(SessionExtension):
     '''
 
     def before_flush(self, session, flush_context, instances):
+        from adhocracy.model.delegateable import changed_tree_nodes
         if not hasattr(session, '_object_cache'):
             session._object_cache = {INSERT: set(),
                                      DELETE: set(),
@@ -24,6 +77,18 @@ class SessionModificationExtension(SessionExtension):
         session._object_cache[INSERT].update(session.new)
         session._object_cache[DELETE].update(session.deleted)
         session._object_cache[UPDATE].update(session.dirty)
+        session._tree_changes = changed_tree_nodes(session)
+        bump_versions(session)
+
+    def after_flush(self, session, flush_context):
+        '''
+        Keep the closure table of the category tree up to date.
+        '''
+        from adhocracy.model.delegateable import update_closure
+        tree_changes = getattr(session, '_tree_changes', None)
+        if tree_changes:
+            del session._tree_changes
+            update_closure(session, [d.id for d in tree_changes])
 
     def before_commit(self, session):
         from adhocracy.lib import cache
@@ -32,9 +97,10 @@ class SessionModificationExtension(SessionExtension):
         if not hasattr(session, '_object_cache'):
             return
 
+        posted = set()
         for operation, entities in session._object_cache.items():
             for entity in entities:
-                self.post_update(entity, operation)
+                self.post_update(entity, operation, posted)
 
         #for entity in session._object_cache[INSERT]:
 
@@ -46,20 +112,44 @@ class SessionModificationExtension(SessionExtension):
 
         del session._object_cache
 
-    def post_update(self, entity, operation):
+    def after_commit(self, session):
+        '''
+        Post the queue messages that had to wait for the data they
+        refer to (see :func:`adhocracy.lib.queue.post_after_commit`).
+        '''
+        messages = getattr(session, '_queue_messages', None)
+        if messages:
+            del session._queue_messages
+            from adhocracy.lib import queue
+            for (service, text) in messages:
+                queue.post_message(service, text)
+
+    def after_rollback(self, session):
+        if hasattr(session, '_queue_messages'):
+            del session._queue_messages
+
+    def post_update(self, entity, operation, posted=None):
         '''
-        Post an update task for the entity and any related objects.
+        Post an update task for the entity and any related objects,
+        unless it is in the set of *posted* ``(entity, operation)``
+        pairs already.
         '''
         from adhocracy import model
         from adhocracy.lib import queue
-        queue.post_update(entity, operation)
+        if posted is None:
+            posted = set()
+
+        def post(entity, operation):
+            if (entity, operation) not in posted:
+                posted.add((entity, operation))
+                queue.post_update(entity, operation)
+
+        post(entity, operation)
 
         ## Do subsequent updates to reindex related content
-        # NOTE: This may post duplicate update tasks if an entity
-        # is part of the session, and also updated depending on
-        # another entity. Ignored for now cause the real work
-        # is asyncronous and (probably) not expensive.
+        # NOTE: Updates of other commits are collapsed by the consumer
+        # (see adhocracy.lib.queue.update.handle_updates).
         # NOTE: Move the decisions about which other objects to
         # update to the models
         if isinstance(entity, model.Poll):
-            queue.post_update(entity.scope, UPDATE)
+            post(entity.scope, UPDATE)
@@ -353,9 +353,10 @@ class User(meta.Indexable):
         May be a bit too much as multiple delegations are counted for each user
         they are delegated to. (This is the safety net delegation)
         """
+        from adhocracy.lib.democracy import delegation_weight
         if not self._has_permission('vote.cast'):
             return 0
-        return self.delegation_node(scope).number_of_delegations() + 1
+        return delegation_weight(self, scope) + 1
 
     def position_on_poll(self, poll):
         from adhocracy.lib.democracy.decision import Decision
@@ -437,8 +438,8 @@ class User(meta.Indexable):
         #                       self.memberships)
         return d
 
-    def to_index(self):
-        index = super(User, self).to_index()
+    def to_index(self, indexers=True):
+        index = super(User, self).to_index(indexers)
 
         index.update(dict(
             title=self.name,
@@ -65,6 +65,31 @@ class TestDecisionWithoutDelegation(TestController):
         self.assertEqual(self.decision.votes[1].orientation, Vote.YES)
         self.assertEqual(self.decision.votes[2].orientation, Vote.YES)
 
+    def test_decisions_in_one_request_share_the_votes(self):
+        self.decision.make(Vote.YES)
+        decision = Decision(self.proposal.creator, self.poll)
+        self.assertTrue(decision.votes is self.decision.votes)
+
+    def test_new_votes_are_seen_by_later_decisions(self):
+        self.assertFalse(Decision(self.proposal.creator,
+                                  self.poll).is_decided())
+        self.decision.make(Vote.NO)
+        self.assertEqual(Decision(self.proposal.creator, self.poll).result,
+                         Vote.NO)
+
+    def test_bulk_decisions_of_users_include_undecided_users(self):
+        other = tt_make_user()
+        self.decision.make(Vote.YES)
+        decisions = dict((d.user, d.result) for d in
+                         Decision.bulk_for_users([self.proposal.creator,
+                                                  other], self.poll))
+        self.assertEqual(decisions, {self.proposal.creator: Vote.YES,
+                                     other: None})
+
+    def test_decision_without_the_only_vote_is_undecided(self):
+        vote = self.decision.make(Vote.YES)[0]
+        self.assertFalse(self.decision.without_vote(vote).is_decided())
+
 
 class TestDecisionWithDelegation(TestController):
 
@@ -161,8 +186,59 @@ class TestDecisionWithDelegation(TestController):
         Decision(self.high_delegate, self.poll).make(Vote.YES)
         self.assertEqual(self.decision.reload().result, Vote.YES)
 
+    def test_new_delegation_replays_decisions_of_the_agent(self):
+        Decision(self.high_delegate, self.poll).make(Vote.NO)
+        self._do_delegate(self.me, self.high_delegate, self.proposal)
+        self.decision.reload()
+        self.assertEqual(self.decision.result, Vote.NO)
+        self.assertFalse(self.decision.is_self_decided())
+
+    def test_replayed_decisions_propagate_to_principals(self):
+        Decision(self.high_delegate, self.poll).make(Vote.YES)
+        self._do_delegate(self.me, self.low_delegate, self.proposal)
+        self._do_delegate(self.low_delegate, self.high_delegate,
+                          self.proposal)
+        self.assertEqual(self.decision.reload().result, Vote.YES)
+        self.assertEqual(Decision(self.low_delegate, self.poll).result,
+                         Vote.YES)
+
+    def test_delegation_without_replay_does_not_vote(self):
+        from adhocracy.model.delegation import Delegation
+        Decision(self.high_delegate, self.poll).make(Vote.YES)
+        Delegation.create(self.me, self.high_delegate, self.proposal,
+                          replay=False)
+        self.assertFalse(self.decision.reload().is_decided())
+
+    def test_replay_without_queue_is_done_right_away(self):
+        from adhocracy.lib.democracy import replay_delegation
+        from adhocracy.model.delegation import Delegation
+        Decision(self.high_delegate, self.poll).make(Vote.YES)
+        delegation = Delegation.create(self.me, self.high_delegate,
+                                       self.proposal)
+        self.assertFalse(delegation.replay_pending)
+        num_votes = len(self.decision.reload().votes)
+        # a job delivered twice does not replay again
+        replay_delegation(delegation)
+        self.assertEqual(len(self.decision.reload().votes), num_votes)
+
+    def test_creator_vote_without_queue_is_done_right_away(self):
+        poll = Poll.create(self.proposal, self.me, Poll.RATE,
+                           with_vote=True)
+        self.assertFalse(poll.vote_pending)
+        self.assertEqual(Decision(self.me, poll).result, Vote.YES)
+        self.assertEqual(poll.tally.num_for, 1)
+
+    def test_creator_vote_propagates_to_new_principal(self):
+        from adhocracy.model.delegation import Delegation
+        delegation = Delegation.create(self.me, self.high_delegate,
+                                       self.proposal)
+        poll = Poll.create(self.proposal, self.high_delegate, Poll.RATE,
+                           with_vote=True)
+        self.assertFalse(delegation.replay_pending)
+        self.assertFalse(poll.vote_pending)
+        self.assertEqual(Decision(self.me, poll).result, Vote.YES)
+
 
 # TODO: can access history of delegation decisions
-# TODO: test replay - this is currently in the decision -
 # TODO: could go to the DelegationNode though
 # TODO: can delegate on all levels
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+from adhocracy.lib.democracy import DelegationGraph, DelegationNode
+from adhocracy.model import Delegation
+
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_get_instance
+from adhocracy.tests.testtools import tt_make_proposal, tt_make_user
+
+
+class TestDelegationGraph(TestController):
+
+    def setUp(self):
+        super(TestDelegationGraph, self).setUp()
+        self.me = tt_make_user()
+        self.first = tt_make_user()
+        self.second = tt_make_user()
+        self.proposal = tt_make_proposal(voting=True)
+        self.instance = tt_get_instance()
+
+    def test_graph_knows_inbound_and_outbound_delegations(self):
+        Delegation.create(self.me, self.first, self.proposal)
+        graph = DelegationGraph(self.instance)
+        self.assertEqual(len(graph.outbound(self.me, self.proposal)), 1)
+        self.assertEqual(len(graph.inbound(self.first, self.proposal)), 1)
+        self.assertEqual(len(graph.inbound(self.me, self.proposal)), 0)
+
+    def test_graph_traverses_transitive_delegations(self):
+        Delegation.create(self.me, self.first, self.proposal)
+        Delegation.create(self.first, self.second, self.proposal)
+        graph = DelegationGraph(self.instance)
+        self.assertEqual(
+            len(graph.transitive_inbound(self.second, self.proposal)), 2)
+        self.assertEqual(
+            graph.number_of_delegations(self.second, self.proposal), 2)
+
+    def test_graph_handles_mutual_delegations(self):
+        Delegation.create(self.first, self.second, self.proposal)
+        Delegation.create(self.second, self.first, self.proposal)
+        graph = DelegationGraph(self.instance)
+        self.assertEqual(
+            len(graph.transitive_inbound(self.first, self.proposal)), 1)
+
+    def test_graph_ignores_delegations_created_later(self):
+        Delegation.create(self.me, self.first, self.proposal)
+        an_hour_ago = datetime.utcnow() - timedelta(hours=1)
+        graph = DelegationGraph(self.instance, at_time=an_hour_ago)
+        self.assertEqual(len(graph.inbound(self.first, self.proposal)), 0)
+
+    def test_nodes_sharing_a_graph_give_same_results(self):
+        Delegation.create(self.me, self.first, self.proposal)
+        Delegation.create(self.second, self.first, self.proposal)
+        graph = DelegationGraph(self.instance)
+        shared = DelegationNode(self.first, self.proposal, graph=graph)
+        node = DelegationNode(self.first, self.proposal)
+        self.assertEqual(set(shared.inbound()), set(node.inbound()))
+        self.assertEqual(shared.number_of_delegations(),
+                         node.number_of_delegations())
+
+
+class TestDelegationWeights(TestController):
+
+    def setUp(self):
+        super(TestDelegationWeights, self).setUp()
+        self.me = tt_make_user()
+        self.first = tt_make_user()
+        self.second = tt_make_user()
+        self.proposal = tt_make_proposal(voting=True)
+        self.instance = tt_get_instance()
+
+    def test_rebuilt_weights_match_the_graph(self):
+        from adhocracy.lib.democracy import rebuild_delegation_weights
+        from adhocracy.model import DelegationWeight
+        Delegation.create(self.me, self.first, self.proposal)
+        Delegation.create(self.first, self.second, self.proposal)
+        rebuild_delegation_weights(self.instance)
+        for agent in [self.first, self.second]:
+            weight = DelegationWeight.find(agent, self.proposal)
+            node = DelegationNode(agent, self.proposal)
+            self.assertEqual(weight.weight, node.number_of_delegations())
+        self.assertEqual(DelegationWeight.find(self.me, self.proposal), None)
+
+    def test_weights_without_queue_are_computed(self):
+        from adhocracy.lib.democracy import delegation_weight
+        Delegation.create(self.me, self.first, self.proposal)
+        self.assertEqual(delegation_weight(self.first, self.proposal), 1)
+        self.assertEqual(delegation_weight(self.me, self.proposal), 0)
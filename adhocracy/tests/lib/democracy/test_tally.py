@@ -0,0 +1,137 @@
+from adhocracy import model
+from adhocracy.lib.democracy import Decision
+from adhocracy.model import Delegation, Poll, Tally, Vote
+
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_make_proposal, tt_make_user
+
+
+class TestBulkTally(TestController):
+
+    def setUp(self):
+        super(TestBulkTally, self).setUp()
+        self.proposal = tt_make_proposal(voting=True)
+        self.poll = Poll.create(self.proposal, self.proposal.creator,
+                                Poll.ADOPT)
+        self.agent = tt_make_user()
+        self.other_agent = tt_make_user()
+        self.principals = [tt_make_user() for i in range(4)]
+
+    def assertSameTally(self, tally, other):
+        self.assertEqual((tally.num_for, tally.num_against,
+                          tally.num_abstain),
+                         (other.num_for, other.num_against,
+                          other.num_abstain))
+
+    def test_bulk_decisions_match_decisions_per_user(self):
+        Delegation.create(self.principals[0], self.agent, self.proposal)
+        Decision(self.agent, self.poll).make(Vote.YES)
+        Decision(self.principals[1], self.poll).make(Vote.NO)
+        decisions = dict((d.user, d.result) for d in
+                         Decision.for_poll(self.poll))
+        bulk_decisions = dict((d.user, d.result) for d in
+                              Decision.bulk_for_poll(self.poll))
+        self.assertEqual(decisions, bulk_decisions)
+
+    def test_bulk_tally_matches_tally(self):
+        # a chain of delegations, one of them overridden by a direct vote
+        Delegation.create(self.principals[0], self.agent, self.proposal)
+        Delegation.create(self.principals[1], self.principals[0],
+                          self.proposal)
+        Delegation.create(self.principals[2], self.agent, self.proposal)
+        # disagreeing agents cancel each other out
+        Delegation.create(self.principals[3], self.agent, self.proposal)
+        Delegation.create(self.principals[3], self.other_agent,
+                          self.proposal)
+        Decision(self.agent, self.poll).make(Vote.YES)
+        Decision(self.other_agent, self.poll).make(Vote.NO)
+        Decision(self.principals[2], self.poll).make(Vote.ABSTAIN)
+        Decision(self.agent, self.poll).make(Vote.NO)
+
+        tally = Tally.create_from_poll(self.poll)
+        bulk_tally = Tally.create_from_poll(self.poll, bulk=True)
+        self.assertSameTally(tally, bulk_tally)
+        self.assertEqual(len(bulk_tally), 6)
+
+    def test_bulk_tally_of_poll_without_votes_is_empty(self):
+        tally = Tally.create_from_poll(self.poll, bulk=True)
+        self.assertEqual(len(tally), 0)
+
+
+class TestIncrementalTally(TestController):
+
+    def setUp(self):
+        super(TestIncrementalTally, self).setUp()
+        self.proposal = tt_make_proposal(voting=True)
+        self.poll = Poll.create(self.proposal, self.proposal.creator,
+                                Poll.ADOPT)
+        self.agent = tt_make_user()
+        self.principal = tt_make_user()
+        self.voter = tt_make_user()
+
+    def _tally_votes(self):
+        votes = sorted(self.poll.votes, key=lambda v: v.id)
+        return [Tally.create_from_vote(v, incremental=True) for v in votes]
+
+    def test_incremental_tally_matches_full_count(self):
+        Delegation.create(self.principal, self.agent, self.proposal)
+        Decision(self.agent, self.poll).make(Vote.YES)
+        Decision(self.voter, self.poll).make(Vote.NO)
+        Decision(self.agent, self.poll).make(Vote.ABSTAIN)
+        Decision(self.principal, self.poll).make(Vote.NO)
+        tally = self._tally_votes()[-1]
+        full_tally = Tally.create_from_poll(self.poll)
+        self.assertEqual((tally.num_for, tally.num_against,
+                          tally.num_abstain),
+                         (full_tally.num_for, full_tally.num_against,
+                          full_tally.num_abstain))
+
+    def test_repeated_vote_does_not_count_twice(self):
+        Decision(self.voter, self.poll).make(Vote.YES)
+        Decision(self.voter, self.poll).make(Vote.YES)
+        tally = self._tally_votes()[-1]
+        self.assertEqual(tally.num_for, 1)
+        self.assertEqual(len(tally), 1)
+
+    def test_incremental_counts_need_a_previous_tally(self):
+        Decision(self.voter, self.poll).make(Vote.YES)
+        for tally in self.poll.tallies:
+            model.meta.Session.delete(tally)
+        model.meta.Session.flush()
+        vote = self.poll.votes[0]
+        self.assertEqual(Tally.incremental_counts(vote), None)
+
+
+class TestCombinePolls(TestController):
+
+    def setUp(self):
+        super(TestCombinePolls, self).setUp()
+        self.polls = []
+        for i in range(3):
+            proposal = tt_make_proposal(voting=True)
+            self.polls.append(Poll.create(proposal, proposal.creator,
+                                          Poll.ADOPT))
+        self.users = [tt_make_user() for i in range(3)]
+
+    def test_contradictory_decisions_are_not_counted(self):
+        Decision(self.users[0], self.polls[0]).make(Vote.YES)
+        Decision(self.users[0], self.polls[1]).make(Vote.NO)
+        Decision(self.users[1], self.polls[0]).make(Vote.YES)
+        Decision(self.users[1], self.polls[1]).make(Vote.YES)
+        Decision(self.users[2], self.polls[1]).make(Vote.ABSTAIN)
+        tally = Tally.combine_polls(self.polls[:2])
+        self.assertEqual((tally.num_for, tally.num_against,
+                          tally.num_abstain), (1, 0, 1))
+
+    def test_groups_are_combined_separately(self):
+        Decision(self.users[0], self.polls[0]).make(Vote.YES)
+        Decision(self.users[0], self.polls[1]).make(Vote.NO)
+        Decision(self.users[1], self.polls[2]).make(Vote.NO)
+        groups = [self.polls[:2], self.polls[1:], []]
+        tallies = Tally.combine_poll_groups(groups)
+        self.assertEqual([(t.num_for, t.num_against, t.num_abstain)
+                          for t in tallies],
+                         [(0, 0, 0), (0, 2, 0), (0, 0, 0)])
+        for group, tally in zip(groups, tallies):
+            combined = Tally.combine_polls(group)
+            self.assertEqual(tally.num_against, combined.num_against)
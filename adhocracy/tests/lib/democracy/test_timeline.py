@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+from adhocracy import model
+from adhocracy.lib.democracy import (Decision, DelegationGraph,
+                                     DelegationNode, DelegationTimeline,
+                                     PollTimeline)
+from adhocracy.model import Delegation, Poll, Tally, Vote
+
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_get_instance
+from adhocracy.tests.testtools import tt_make_proposal, tt_make_user
+
+
+class TestDelegationTimeline(TestController):
+
+    def setUp(self):
+        super(TestDelegationTimeline, self).setUp()
+        self.principal = tt_make_user()
+        self.agent = tt_make_user()
+        self.proposal = tt_make_proposal(voting=True)
+        self.instance = tt_get_instance()
+        self.created = datetime.utcnow() - timedelta(hours=2)
+        self.revoked = datetime.utcnow() - timedelta(hours=1)
+        delegation = Delegation.create(self.principal, self.agent,
+                                       self.proposal)
+        delegation.create_time = self.created
+        delegation.revoke(revoke_time=self.revoked)
+        model.meta.Session.flush()
+
+    def _inbound(self, graph):
+        return graph.inbound(self.agent, self.proposal)
+
+    def test_snapshot_matches_the_graph_loaded_at_the_time(self):
+        timeline = DelegationTimeline(self.instance)
+        minute = timedelta(minutes=1)
+        for at_time in (self.created - minute, self.created + minute,
+                        self.revoked):
+            loaded = DelegationGraph(self.instance, at_time=at_time)
+            self.assertEqual(self._inbound(timeline.snapshot(at_time)),
+                             self._inbound(loaded))
+        self.assertEqual(
+            len(self._inbound(timeline.snapshot(self.created + minute))), 1)
+
+    def test_advance_applies_the_events_since_the_snapshot(self):
+        timeline = DelegationTimeline(self.instance)
+        graph = timeline.snapshot(self.created)
+        self.assertEqual(len(self._inbound(graph)), 1)
+        timeline.advance(graph, self.revoked)
+        self.assertEqual(len(self._inbound(graph)), 0)
+        self.assertRaises(ValueError, timeline.advance, graph, self.created)
+
+    def test_replay_steps_through_creation_and_revocation(self):
+        timeline = DelegationTimeline(self.instance)
+        steps = [(time, len(self._inbound(graph))) for (time, graph)
+                 in timeline.replay()
+                 if time in (self.created, self.revoked)]
+        self.assertEqual(steps, [(self.created, 1), (self.revoked, 0)])
+
+    def test_nodes_traverse_snapshots_of_the_timeline(self):
+        node = DelegationNode(self.agent, self.proposal,
+                              timeline=DelegationTimeline(self.instance))
+        self.assertEqual(
+            len(node.inbound(at_time=self.created + timedelta(minutes=1))),
+            1)
+        self.assertEqual(len(node.inbound(at_time=self.revoked)), 0)
+
+
+class TestPollTimeline(TestController):
+
+    def setUp(self):
+        super(TestPollTimeline, self).setUp()
+        self.proposal = tt_make_proposal(voting=True)
+        self.poll = Poll.create(self.proposal, self.proposal.creator,
+                                Poll.ADOPT)
+        self.agent = tt_make_user()
+        self.principal = tt_make_user()
+        self.voter = tt_make_user()
+
+    def test_replay_matches_tallies_counted_per_vote(self):
+        Delegation.create(self.principal, self.agent, self.proposal)
+        Decision(self.agent, self.poll).make(Vote.YES)
+        Decision(self.voter, self.poll).make(Vote.YES)
+        Decision(self.principal, self.poll).make(Vote.NO)
+        Decision(self.voter, self.poll).make(Vote.ABSTAIN)
+        for (vote, counts) in PollTimeline(self.poll).replay():
+            tally = Tally.create_from_poll(self.poll, vote.create_time)
+            self.assertEqual(counts, (tally.num_for, tally.num_against,
+                                      tally.num_abstain))
+
+    def test_rebuild_creates_a_tally_for_each_vote(self):
+        Decision(self.voter, self.poll).make(Vote.YES)
+        Decision(self.agent, self.poll).make(Vote.NO)
+        tallies = PollTimeline(self.poll).rebuild_tallies()
+        self.assertEqual(len(tallies), 2)
+        self.assertEqual(len(tallies[-1]), 2)
+        self.assertEqual(PollTimeline(self.poll).rebuild_tallies(), [])
+
+    def test_rebuild_fills_in_the_tallies_of_an_instance(self):
+        from adhocracy.lib.democracy import rebuild_tallies
+        Decision(self.voter, self.poll).make(Vote.YES)
+        Decision(self.agent, self.poll).make(Vote.NO)
+        self.assertTrue(rebuild_tallies(tt_get_instance()) >= 2)
+        self.assertEqual(rebuild_tallies(tt_get_instance()), 0)
@@ -0,0 +1,416 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from adhocracy import model
+from adhocracy.lib.cache import page, util
+from adhocracy.lib.cache.backends import FileBackend, MemoryBackend
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_make_proposal
+from adhocracy.lib.cache.local import LRUCache
+
+
+class FakeMemcache(object):
+    '''The parts of ``memcache.Client`` that are used for memoizing.'''
+
+    def __init__(self):
+        self.data = {}
+        self.requests = 0
+
+    def get(self, key):
+        self.requests += 1
+        return self.data.get(key)
+
+    def get_multi(self, keys):
+        self.requests += 1
+        return dict((k, self.data[k]) for k in keys if k in self.data)
+
+    def set(self, key, value, time=0):
+        self.data[key] = value
+        return True
+
+    def set_multi(self, mapping, time=0):
+        self.data.update(mapping)
+        return []
+
+    def add(self, key, value, time=0):
+        if key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, key, time=0):
+        self.data.pop(key, None)
+        return True
+
+    def incr(self, key, delta=1):
+        if key not in self.data:
+            return None
+        self.data[key] += delta
+        return self.data[key]
+
+
+class FakeGlobals(object):
+
+    def __init__(self):
+        self.cache = FakeMemcache()
+
+
+class TestMemoize(TestCase):
+
+    def setUp(self):
+        self.app_globals = util.app_globals
+        util.app_globals = FakeGlobals()
+        self.calls = []
+
+        @util.memoize('test_memoize')
+        def double(value):
+            self.calls.append(value)
+            return value * 2
+        self.double = double
+
+    def tearDown(self):
+        util.app_globals = self.app_globals
+        util._local_cache = None
+
+    def test_results_are_cached(self):
+        self.assertEqual(self.double(2), 4)
+        self.assertEqual(self.double(2), 4)
+        self.assertEqual(self.calls, [2])
+
+    def test_clearing_a_tag_invalidates_its_entries(self):
+        self.double(2)
+        self.double(3)
+        util.clear_tag(2)
+        self.double(2)
+        self.double(3)
+        self.assertEqual(self.calls, [2, 3, 2])
+
+    def test_evicted_generations_invalidate_entries(self):
+        self.double(2)
+        del util.app_globals.cache.data[util.tag_key(util.make_tag(2))]
+        self.double(2)
+        self.assertEqual(self.calls, [2, 2])
+
+    def test_missing_generations_start_on_their_own(self):
+        cache = util.app_globals.cache
+        cache.add('existing', 5)
+        generations = util.init_generations(cache, ['existing', 'missing'])
+        self.assertEqual(generations['existing'], 5)
+        self.assertNotEqual(generations['missing'], 5)
+        self.assertEqual(generations['missing'], cache.data['missing'])
+
+    def test_local_hits_see_cleared_tags(self):
+        util._local_cache = LRUCache(10000, 60)
+        self.double(2)
+        self.double(2)
+        self.assertEqual(util.STATS['test_memoize']['local_hits'], 1)
+        util.clear_tag(2)
+        self.double(2)
+        self.assertEqual(self.calls, [2, 2])
+
+    def test_prefetched_results_need_no_requests(self):
+        util.begin_request()
+        try:
+            self.double(2)
+            calls = util.collect_memoized(self.double, [2, 3, 4])
+            self.assertEqual(self.calls, [2])
+            util.prefetch_memoized(calls)
+            self.assertEqual(self.calls, [2, 3, 4])
+            requests = util.app_globals.cache.requests
+            self.assertEqual([self.double(v) for v in [2, 3, 4]], [4, 6, 8])
+            self.assertEqual(util.app_globals.cache.requests, requests)
+        finally:
+            util.end_request()
+
+    def test_failing_items_are_not_prefetched(self):
+        def tile(value):
+            if value == 3:
+                raise ValueError(value)
+            return self.double(value)
+
+        util.begin_request()
+        try:
+            calls = util.collect_memoized(tile, [2, 3, 4])
+            self.assertEqual(len(calls), 2)
+            util.prefetch_memoized(calls)
+            self.assertEqual(self.calls, [2, 4])
+            self.assertEqual(self.double(3), 6)
+            self.assertEqual(self.calls, [2, 4, 3])
+        finally:
+            util.end_request()
+
+    def test_items_know_that_calls_are_collected(self):
+        collecting = []
+        util.collect_memoized(
+            lambda value: collecting.append(util.is_collecting()), [1, 2])
+        self.assertEqual(collecting, [True, True])
+        self.assertFalse(util.is_collecting())
+
+    def test_tiles_are_not_prefetched_without_cache(self):
+        import mock
+        from adhocracy.lib.tiles import util as tile_util
+        rendered = []
+        globals_ = FakeGlobals()
+        globals_.cache = None
+        with mock.patch.object(tile_util, 'app_globals', globals_):
+            tile_util.prefetch_tiles(rendered.append, [1, 2])
+        self.assertEqual(rendered, [])
+
+    def targeted(self, targeted=True):
+        import mock
+        return mock.patch.dict(util.config, {
+            'adhocracy.cache.targeted_invalidation': str(targeted)})
+
+    def test_entries_depend_on_nested_memoized_calls(self):
+        @util.memoize('test_outer')
+        def outer(value):
+            self.calls.append('outer')
+            return self.double(value + 1)
+
+        with self.targeted():
+            self.assertEqual(outer(1), 4)
+            self.assertEqual(outer(1), 4)
+            util.clear_tag(2)
+            self.assertEqual(outer(1), 4)
+        self.assertEqual(self.calls, ['outer', 2, 'outer', 2])
+
+    def make_reader(self, entity):
+        @util.memoize('test_reader')
+        def reader(value):
+            self.calls.append(value)
+            util.record_read(entity)
+            return value
+        return reader
+
+    def test_entries_depend_on_the_entities_they_read(self):
+        entity = u'an entity'
+        reader = self.make_reader(entity)
+        with self.targeted():
+            reader(1)
+            reader(1)
+            util.clear_tag(entity)
+            reader(1)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_reads_are_only_tracked_for_targeted_invalidation(self):
+        entity = u'an entity'
+        reader = self.make_reader(entity)
+        with self.targeted(False):
+            reader(1)
+            util.clear_tag(entity)
+            reader(1)
+        self.assertEqual(self.calls, [1])
+
+    def test_tags_are_cleared_once(self):
+        def clear():
+            util.clear_tag(2)
+            util.clear_tag(2)
+            util.clear_tag(3)
+        self.assertEqual(util.clear_tags_once(clear), 2)
+
+    def test_stale_results_are_served_during_recomputation(self):
+        @util.memoize('test_single_flight', single_flight=True)
+        def expensive(value):
+            self.calls.append(value)
+            return len(self.calls)
+
+        self.assertEqual(expensive(2), 1)
+        util.clear_tag(2)
+        lease = util.LEASE_PREFIX + util.make_key('test_single_flight',
+                                                  (2,), {})
+        util.app_globals.cache.add(lease, 1)
+        self.assertEqual(expensive(2), 1)
+        self.assertEqual(util.STATS['test_single_flight']['stale'], 1)
+        util.app_globals.cache.delete(lease)
+        self.assertEqual(expensive(2), 2)
+        self.assertFalse(lease in util.app_globals.cache.data)
+
+    def test_keys_change_with_the_cache_version(self):
+        key = util.make_key('test_memoize', (2,), {})
+        version = util.config.get('adhocracy.cache.version', '')
+        util.config['adhocracy.cache.version'] = version + '.next'
+        util._namespace = None
+        try:
+            self.assertNotEqual(util.make_key('test_memoize', (2,), {}), key)
+        finally:
+            util.config['adhocracy.cache.version'] = version
+            util._namespace = None
+
+    def test_keys_change_with_the_templates(self):
+        import mock
+        import os
+        directory = tempfile.mkdtemp()
+        template = os.path.join(directory, 'tiles.html')
+        open(template, 'w').close()
+        paths = {'pylons.paths': {'templates': [directory]}}
+        try:
+            with mock.patch.dict(util.config, paths):
+                util._namespace = None
+                key = util.make_key('test_memoize', (2,), {})
+                os.utime(template, (2 ** 31 - 1, 2 ** 31 - 1))
+                util._namespace = None
+                self.assertNotEqual(util.make_key('test_memoize', (2,), {}),
+                                    key)
+        finally:
+            util._namespace = None
+            shutil.rmtree(directory)
+
+    def test_keys_distinguish_non_ascii_strings(self):
+        self.assertNotEqual(util.make_key('test_memoize', (u'\xe4',), {}),
+                            util.make_key('test_memoize', (u'\xf6',), {}))
+
+    def test_keys_distinguish_types_and_separators(self):
+        keys = [util.make_key('test_memoize', args, {}) for args in
+                [(1,), ('1',), ('a|b',), ('a', 'b'), (('a', 'b'),),
+                 (('a,b',),)]]
+        self.assertEqual(len(set(keys)), len(keys))
+
+
+class TestPageCache(TestCase):
+
+    def setUp(self):
+        self.app_globals = util.app_globals
+        util.app_globals = FakeGlobals()
+        self.calls = []
+        self.config = dict((key, page.config.get(key)) for key in
+                           ['adhocracy.cache.page_ttl', 'beaker.session.key',
+                            'adhocracy.cache.targeted_invalidation'])
+        page.config['adhocracy.cache.page_ttl'] = '60'
+        page.config['adhocracy.cache.targeted_invalidation'] = 'false'
+        self.environ = {'REQUEST_METHOD': 'GET', 'HTTP_HOST': 'test.lan',
+                        'PATH_INFO': '/proposal', 'QUERY_STRING': ''}
+
+    def tearDown(self):
+        util.app_globals = self.app_globals
+        for (key, value) in self.config.items():
+            if value is None:
+                page.config.pop(key, None)
+            else:
+                page.config[key] = value
+
+    def app(self, environ, start_response):
+        self.calls.append(environ['PATH_INFO'])
+        util.record_read(u'an entity')
+        start_response('200 OK', [('Content-Type', 'text/html')])
+        return ['page']
+
+    def serve(self, instance=None):
+        return page.serve_cached(self.app, self.environ,
+                                 lambda status, headers: None, instance,
+                                 'en')
+
+    def test_pages_are_cached_until_their_instance_changes(self):
+        self.assertEqual(self.serve(u'instance'), ['page'])
+        self.assertEqual(self.serve(u'instance'), ['page'])
+        self.assertEqual(len(self.calls), 1)
+        util.clear_tag(u'instance')
+        self.serve(u'instance')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_pages_are_cached_until_a_shown_entity_changes(self):
+        page.config['adhocracy.cache.targeted_invalidation'] = 'true'
+        self.assertTrue(page.is_cacheable(self.environ, None))
+        self.assertEqual(self.serve(), ['page'])
+        self.assertEqual(self.serve(), ['page'])
+        self.assertEqual(len(self.calls), 1)
+        util.clear_tag(u'an entity')
+        self.serve()
+        self.assertEqual(len(self.calls), 2)
+
+    def test_sessions_are_not_cached(self):
+        self.environ['HTTP_COOKIE'] = 'adhocracy_state=1234'
+        page.config['beaker.session.key'] = 'adhocracy_state'
+        self.assertFalse(page.is_cacheable(self.environ, None))
+
+
+class TestKeys(TestController):
+
+    def test_model_objects_are_identified_by_type_and_key(self):
+        proposal = tt_make_proposal()
+        self.assertEqual(util.make_tag(proposal),
+                         'Delegateable.%s' % proposal.id)
+
+    def test_keys_do_not_change_when_the_version_is_expired(self):
+        proposal = tt_make_proposal()
+        key = util.make_key('test_keys', (proposal,), {})
+        model.meta.Session.expire(proposal, ['version'])
+        self.assertEqual(util.make_key('test_keys', (proposal,), {}), key)
+
+
+class TestLRUCache(TestCase):
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = LRUCache(150, 60)
+        cache.set('a', 'x' * 50, iden='first')
+        cache.set('b', 'x' * 50, iden='second')
+        cache.get('a')
+        evicted = cache.set('c', 'x' * 50, iden='third')
+        self.assertEqual(evicted, ['second'])
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'x' * 50)
+        self.assertTrue(cache.size <= 150)
+
+    def test_expired_entries_are_missing(self):
+        cache = LRUCache(200, 60)
+        cache.set('a', 'x', ttl=-1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+
+class BackendTests(object):
+
+    def test_values_are_stored(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.set('a', {'x': 1})
+        self.cache.set_multi({'b': 2, 'c': 3})
+        self.assertEqual(self.cache.get('a'), {'x': 1})
+        self.assertEqual(self.cache.get_multi(['a', 'b', 'd']),
+                         {'a': {'x': 1}, 'b': 2})
+        self.cache.delete('a')
+        self.assertEqual(self.cache.get('a'), None)
+
+    def test_add_and_incr(self):
+        self.assertEqual(self.cache.incr('a'), None)
+        self.assertTrue(self.cache.add('a', 1))
+        self.assertFalse(self.cache.add('a', 5))
+        self.assertEqual(self.cache.incr('a'), 2)
+        self.assertEqual(self.cache.get('a'), 2)
+
+    def test_expired_values_are_missing(self):
+        self.cache.set('a', 1, time=-1)
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertTrue(self.cache.add('a', 2))
+
+
+class TestMemoryBackend(BackendTests, TestCase):
+
+    def setUp(self):
+        self.cache = MemoryBackend(10000)
+
+
+class TestFileBackend(BackendTests, TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = FileBackend(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_expired_files_are_removed(self):
+        import os
+        self.cache.set('a', 1, time=-1)
+        self.cache.set('b', 2)
+        self.cache.sweep()
+        self.assertEqual(self.cache.get('b'), 2)
+        self.assertEqual(len([name for name in os.listdir(self.path)
+                              if name not in ('lock', 'sweep')]), 1)
+
+    def test_files_that_expire_first_are_removed_beyond_the_size(self):
+        self.cache.max_bytes = 300
+        for (i, key) in enumerate(['a', 'b', 'c', 'd']):
+            self.cache.set(key, 'x' * 100, time=100 + i)
+        self.cache.sweep()
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.get('d'), 'x' * 100)
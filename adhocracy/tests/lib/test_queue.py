@@ -0,0 +1,44 @@
+import json
+
+from adhocracy import model
+from adhocracy.lib import queue
+from adhocracy.lib.queue.update import LISTENERS, handle_updates
+from adhocracy.model.refs import to_ref
+from adhocracy.model.update import INSERT, UPDATE
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_make_user
+
+
+class FakeMessage(object):
+
+    def __init__(self, service, body):
+        self.application_headers = {'service': service}
+        self.body = body
+
+
+class TestQueue(TestController):
+
+    def test_repeated_messages_are_coalesced(self):
+        messages = [FakeMessage(queue.UPDATE_SERVICE, 'a'),
+                    FakeMessage(queue.MINUTE, ''),
+                    FakeMessage(queue.UPDATE_SERVICE, 'a'),
+                    FakeMessage(queue.MINUTE, '')]
+        (updates, others) = queue.coalesce(messages)
+        self.assertEqual(updates, ['a', 'a'])
+        self.assertEqual(others, [(queue.MINUTE, '')])
+
+    def test_listeners_run_once_per_entity(self):
+        calls = []
+        listener = calls.append
+        LISTENERS[(model.User, INSERT)].append(listener)
+        LISTENERS[(model.User, UPDATE)].append(listener)
+        try:
+            user = tt_make_user()
+            messages = [json.dumps(dict(operation=operation,
+                                        entity=to_ref(user)))
+                        for operation in [INSERT, UPDATE, UPDATE]]
+            self.assertEqual(handle_updates(messages), 1)
+            self.assertEqual(calls, [user])
+        finally:
+            LISTENERS[(model.User, INSERT)].remove(listener)
+            LISTENERS[(model.User, UPDATE)].remove(listener)
@@ -4,6 +4,10 @@ from StringIO import StringIO
 from sunburnt.schema import SolrSchema
 from sunburnt.search import SolrSearch
 
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import (tt_get_instance, tt_make_str,
+                                        tt_make_user)
+
 
 # borrowed from sunburnt.test_search
 schema_string = \
@@ -63,3 +67,263 @@ class TestSolrSearch(TestCase):
         self.assertEqual(
             query.params(),
             [('q', '*:*')])
+
+    def test_term_query_is_quoted(self):
+        from adhocracy.lib.search.query import term_query
+        self.assertEqual(term_query('text', u'a "b"'), u'text:"a \\"b\\""')
+
+    def test_facet_counts_without_selection_in_same_request(self):
+        from adhocracy.lib.search.query import faceted_options
+        search = SolrSearch(interface).facet_by('text', limit=10)
+        options = faceted_options(search, [('text', u'one')], ['text'])
+        self.assertEqual(options['fq'], [u'{!tag=facets}text:"one"'])
+        self.assertTrue(u'{!ex=facets key=all.text}text' in
+                        options['facet.field'])
+
+
+class FacetCounts(object):
+
+    def __init__(self, facet_fields):
+        self.facet_fields = facet_fields
+
+
+class FacetResponse(object):
+
+    def __init__(self, facet_fields):
+        self.facet_counts = FacetCounts(facet_fields)
+
+
+class CountingInterface(MockInterface):
+    '''
+    Counts the facet values of *docs* like solr does for the term
+    queries of sunburnt and :func:`adhocracy.lib.search.query.faceted_options`.
+    '''
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def matches(self, doc, query):
+        if query.startswith('{!'):
+            query = query[query.index('}') + 1:]
+        for term in query.split(' AND '):
+            if term == '*:*':
+                continue
+            (field, value) = term.split(':', 1)
+            if value.strip('"') not in doc.get(field, []):
+                return False
+        return True
+
+    def search(self, **options):
+        fq = options.get('fq', [])
+        if not isinstance(fq, list):
+            fq = [fq]
+        facet_fields = {}
+        for field in options.get('facet.field', []):
+            (key, filters) = (field, fq)
+            if field.startswith('{!'):
+                (params, field) = field[2:].split('}')
+                params = dict(p.split('=') for p in params.split())
+                key = params['key']
+                filters = [f for f in fq if not
+                           f.startswith('{!tag=%s}' % params['ex'])]
+            counts = {}
+            for doc in self.docs:
+                if (self.matches(doc, options['q']) and
+                        all([self.matches(doc, f) for f in filters])):
+                    for value in doc.get(field, []):
+                        counts[value] = counts.get(value, 0) + 1
+            counts = sorted(counts.items(), key=lambda item: -item[1])
+            limit = options.get('f.%s.facet.limit' % field, -1)
+            facet_fields[key] = counts if limit < 0 else counts[:limit]
+        return FacetResponse(facet_fields)
+
+
+class TestFacetCounts(TestController):
+
+    docs = [{'text': ['one', 'two']}, {'text': ['one']},
+            {'text': ['two', 'three']}, {'text': ['four']}]
+
+    def make_facet(self, *values):
+        from webob import Request
+        from adhocracy.lib.pager import SolrFacet
+
+        class TextFacet(SolrFacet):
+            name = 'text'
+            solr_field = 'text'
+
+            def _current_items(self):
+                return []
+
+        request = Request.blank('/')
+        for value in values:
+            request.GET.add('test_facet', 'text:%s' % value)
+        return TextFacet('test', request)
+
+    def assert_same_counts(self, *values):
+        from adhocracy.lib.search.query import faceted_options
+        interface = CountingInterface(self.docs)
+
+        # the counts of the former query of the results and of the
+        # query without the selected values
+        query = SolrSearch(interface).facet_by('text', limit=65000)
+        counts_query = query.paginate(rows=0)
+        for value in values:
+            query = query.query(text=value)
+        current_counts = interface.search(
+            **query.options()).facet_counts.facet_fields['text']
+        facet_counts = interface.search(
+            **counts_query.options()).facet_counts.facet_fields['text']
+
+        facet = self.make_facet(*values)
+        query = facet.add_to_query(SolrSearch(interface))
+        options = faceted_options(query, facet.filters(), ['text'])
+        facet.update(interface.search(**options))
+        self.assertEqual(facet.current_counts, dict(current_counts))
+        self.assertEqual(facet.facet_counts, dict(facet_counts))
+
+    def test_counts_without_selection(self):
+        self.assert_same_counts()
+
+    def test_counts_of_selected_values(self):
+        self.assert_same_counts('one')
+        self.assert_same_counts('one', 'two')
+
+
+class RecordingConnection(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def add(self, docs):
+        self.calls.append(('add', len(docs)))
+
+    def delete(self, docs):
+        self.calls.append(('delete', len(docs)))
+
+    def commit(self):
+        self.calls.append(('commit', None))
+
+
+class TestIndexBuffer(TestController):
+
+    def test_changes_are_sent_together(self):
+        from adhocracy.lib.search.index import IndexBuffer
+        connection = RecordingConnection()
+        buffer_ = IndexBuffer(connection, size=3)
+        users = [tt_make_user(), tt_make_user(), tt_make_user()]
+        for user in users[:2]:
+            buffer_.update(user)
+        self.assertEqual(connection.calls, [])
+        buffer_.delete(users[2])
+        self.assertEqual(connection.calls, [('add', 2), ('delete', 1),
+                                            ('commit', None)])
+        self.assertEqual(len(buffer_), 0)
+
+    def test_last_change_of_a_document_wins(self):
+        from adhocracy.lib.search.index import IndexBuffer
+        connection = RecordingConnection()
+        buffer_ = IndexBuffer(connection)
+        user = tt_make_user()
+        buffer_.delete(user)
+        buffer_.update(user)
+        self.assertEqual(len(buffer_), 1)
+        self.assertEqual(buffer_.flush(), (1, 0, 0))
+        self.assertEqual(connection.calls, [('add', 1), ('commit', None)])
+
+    def test_changes_are_kept_when_sending_fails(self):
+        from adhocracy.lib.search.index import IndexBuffer
+        connection = RecordingConnection()
+        connection.commit = lambda: 1 / 0
+        buffer_ = IndexBuffer(connection)
+        (user, other) = (tt_make_user(), tt_make_user())
+        buffer_.update(user)
+        self.assertRaises(ZeroDivisionError, buffer_.flush)
+        self.assertEqual(len(buffer_), 1)
+        buffer_.delete(user)
+        buffer_.update(other)
+        del connection.commit
+        self.assertEqual(buffer_.flush(), (1, 1, 0))
+        self.assertEqual(len(buffer_), 0)
+
+    def test_old_changes_are_sent_without_further_changes(self):
+        import time
+        from adhocracy.lib.search.index import IndexBuffer
+        connection = RecordingConnection()
+        buffer_ = IndexBuffer(connection, max_age=0.01)
+        buffer_.update(tt_make_user())
+        for i in range(100):
+            if connection.calls:
+                break
+            time.sleep(0.01)
+        self.assertEqual(connection.calls, [('add', 1), ('commit', None)])
+        self.assertEqual(len(buffer_), 0)
+
+    def test_id_ranges_cover_all_entities(self):
+        from adhocracy import model
+        from adhocracy.lib.search import id_ranges
+        users = [tt_make_user(), tt_make_user()]
+        ranges = id_ranges(model.User, size=2)
+        for user in users:
+            self.assertTrue([r for r in ranges if r[0] <= user.id <= r[1]])
+        self.assertTrue(all([high - low == 1 for (low, high) in ranges]))
+        self.assertTrue(all([low % 2 == 0 for (low, high) in ranges]))
+
+
+class TestBulkDocuments(TestController):
+
+    def assert_same_documents(self, entities):
+        from adhocracy import model
+        from adhocracy.lib.search.index import (get_update_information,
+                                                get_update_informations)
+        single = [get_update_information(entity) for entity in entities]
+        # unload the relations the single documents loaded
+        model.meta.Session.expire_all()
+        self.assertEqual(get_update_informations(entities), single)
+
+    def test_user_documents(self):
+        from adhocracy import model
+        group = model.Group.by_code(model.Group.CODE_VOTER)
+        users = [tt_make_user(instance_group=group), tt_make_user()]
+        self.assert_same_documents(users)
+
+    def test_page_documents(self):
+        from adhocracy import model
+        creator = tt_make_user()
+        pages = [model.Page.create(tt_get_instance(), tt_make_str(),
+                                   u'text', creator, tags=u'one two')
+                 for i in range(2)]
+        model.Comment.create(u'text', creator, pages[0])
+        model.meta.Session.flush()
+        self.assert_same_documents(pages)
+
+    def test_proposal_documents(self):
+        from adhocracy import model
+        creator = tt_make_user()
+        proposals = []
+        for i in range(3):
+            proposal = model.Proposal.create(tt_get_instance(), tt_make_str(),
+                                             creator, tags=u'one')
+            proposal.description = model.Page.create(
+                tt_get_instance(), tt_make_str(), u'text', creator,
+                function=model.Page.DESCRIPTION)
+            proposals.append(proposal)
+        model.Comment.create(u'text', creator, proposals[0].description)
+        # a comment without revisions
+        comment = model.Comment.create(u'text', creator,
+                                       proposals[1].description)
+        for revision in list(comment.revisions):
+            model.meta.Session.delete(revision)
+        model.meta.Session.flush()
+        model.meta.Session.expire(comment)
+        self.assert_same_documents(proposals)
+
+    def test_comment_documents(self):
+        from adhocracy import model
+        creator = tt_make_user()
+        page = model.Page.create(tt_get_instance(), tt_make_str(), u'text',
+                                 creator)
+        comment = model.Comment.create(u'text', creator, page)
+        reply = model.Comment.create(u'reply', tt_make_user(), page,
+                                     reply=comment)
+        model.meta.Session.flush()
+        self.assert_same_documents([comment, reply])
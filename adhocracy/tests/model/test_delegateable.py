@@ -0,0 +1,54 @@
+from adhocracy import model
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import (tt_get_instance, tt_make_proposal,
+                                       tt_make_str, tt_make_user)
+
+
+class TestDelegateableClosure(TestController):
+
+    def _make_page(self, parent=None):
+        creator = tt_make_user()
+        page = model.Page.create(tt_get_instance(), tt_make_str(),
+                                 tt_make_str(), creator,
+                                 function=model.Page.NORM)
+        if parent is not None:
+            page.parent = parent
+            model.meta.Session.flush()
+        return page
+
+    def test_proposal_is_super_of_its_description(self):
+        proposal = tt_make_proposal()
+        description = model.Page.create(tt_get_instance(), tt_make_str(),
+                                        tt_make_str(), proposal.creator,
+                                        function=model.Page.DESCRIPTION)
+        description.parents = [proposal]
+        model.meta.Session.flush()
+        self.assertTrue(proposal.is_super(description))
+        self.assertTrue(description.is_sub(proposal))
+        self.assertFalse(description.is_super(proposal))
+
+    def test_closure_is_transitive(self):
+        top = self._make_page()
+        middle = self._make_page(parent=top)
+        bottom = self._make_page(parent=middle)
+        self.assertTrue(top.is_super(middle))
+        self.assertTrue(top.is_super(bottom))
+        self.assertFalse(bottom.is_super(top))
+        self.assertEqual(bottom.ancestors(), [middle, top])
+
+    def test_moving_a_subtree_updates_the_closure(self):
+        top = self._make_page()
+        other = self._make_page()
+        middle = self._make_page(parent=top)
+        bottom = self._make_page(parent=middle)
+        middle.parent = other
+        model.meta.Session.flush()
+        self.assertFalse(top.is_super(bottom))
+        self.assertTrue(other.is_super(bottom))
+        self.assertEqual(bottom.ancestors(), [middle, other])
+
+    def test_within_scope_includes_descendants(self):
+        top = self._make_page()
+        bottom = self._make_page(parent=top)
+        poll = model.Poll.create(bottom, bottom.creator, model.Poll.RATE)
+        self.assertTrue(poll in model.Poll.within_scope(top))
@@ -68,3 +68,24 @@ class TestProposals(TestController):
         self.assertTrue(len(proposal.polls) > 0)
         for poll in proposal.polls:
             self.assertTrue(poll.is_deleted())
+
+    def test_comments_bump_the_version(self):
+        from adhocracy import model
+        (proposal, creator) = self._make_proposal()
+        model.meta.Session.commit()
+        version = proposal.version
+        model.Comment.create(u'text', creator, proposal)
+        model.meta.Session.commit()
+        self.assertTrue(proposal.version > version)
+        self.assertTrue(proposal.modify_time >= proposal.create_time)
+
+    def test_votes_bump_the_version(self):
+        from adhocracy import model
+        (proposal, creator) = self._make_proposal()
+        model.meta.Session.commit()
+        poll = proposal.rate_poll
+        version = (proposal.version, poll.version)
+        model.meta.Session.add(model.Vote(creator, poll, model.Vote.YES))
+        model.meta.Session.commit()
+        self.assertTrue(poll.version > version[1])
+        self.assertTrue(proposal.version > version[0])
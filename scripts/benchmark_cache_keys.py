@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measure how long it takes to build the cache key and tags of a cached
+proposal row tile, compared to stringifying the arguments like memoize
+used to.
+"""
+
+from time import time
+
+from adhocracy.lib.cache import util
+from adhocracy.model import Proposal, meta
+
+# boilerplate code. copy that
+import os
+import sys
+sys.path.insert(0,  os.path.abspath(os.path.dirname(__file__)))
+from common import create_parser, get_instances, load_from_args
+# /end boilerplate code
+
+ROUNDS = 1000
+
+
+def stringified_key(iden, args, kwargs):
+    def tag(obj):
+        rep = "catch_all"
+        try:
+            rep = repr(obj).encode('ascii', 'ignore')
+        except:
+            pass
+        try:
+            rep = unicode(obj).encode('ascii', 'ignore')
+        except:
+            pass
+        return util._hash(rep)
+    tags = [tag(a) for a in args] + [tag(v) for v in kwargs.values()]
+    return (util._hash(iden + tag(args) + tag(kwargs)), tags)
+
+
+def cheap_key(iden, args, kwargs):
+    return (util.make_key(iden, args, kwargs), util.make_tags(args, kwargs))
+
+
+def measure(make, calls):
+    begin = time()
+    for i in range(ROUNDS):
+        for kwargs in calls:
+            make('tile_cache/proposal/tiles.htmlrow', (), kwargs)
+    return (time() - begin) * 1000000 / (ROUNDS * len(calls))
+
+
+def main():
+    parser = create_parser(description=__doc__)
+    args = parser.parse_args()
+    load_from_args(args)
+    instances = get_instances(args)
+
+    q = meta.Session.query(Proposal)
+    if instances:
+        q = q.filter(Proposal.instance_id.in_([i.id for i in instances]))
+    proposals = q.limit(100).all()
+    if not proposals:
+        print "No proposals found."
+        return 1
+    calls = [dict(locale='en_US', proposal=proposal,
+                  badgesglobal_admin=False) for proposal in proposals]
+
+    for (name, make) in [('stringified', stringified_key),
+                         ('type and primary key', cheap_key)]:
+        print "%s: %.1f us per tile call" % (name, measure(make, calls))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -92,7 +92,10 @@ setup(
         ],
         'paste.paster_command': [
             'background = adhocracy.lib.cli:Background',
-            'index = adhocracy.lib.cli:Index'
+            'index = adhocracy.lib.cli:Index',
+            'delegation_weights = adhocracy.lib.cli:DelegationWeights',
+            'tallies = adhocracy.lib.cli:Tallies',
+            'warmcache = adhocracy.lib.cli:WarmCache'
         ],
         'paste.app_install': [
             'main = pylons.util:PylonsInstaller'